@@ -5,6 +5,7 @@ from typing import Optional, Tuple, TYPE_CHECKING
 from anthropic import AsyncAnthropic
 
 from app.ai.base import AIPlayer
+from app.ai.clients import ANTHROPIC
 from app.models.schemas import GameState, Player, Action, Holding, ActionType, AIDecisionLog, AIDecisionLogEntry
 
 if TYPE_CHECKING:
@@ -14,22 +15,33 @@ if TYPE_CHECKING:
 class AnthropicPlayer(AIPlayer):
     """AI player powered by Anthropic's Claude models."""
     
+    PROVIDER = ANTHROPIC
     DEFAULT_MODEL = "claude-sonnet-4-20250514"
     
-    def __init__(self, api_key: str, model: Optional[str] = None):
+    def __init__(self, api_key: str, model: Optional[str] = None, client: Optional[AsyncAnthropic] = None):
         super().__init__(api_key, model or self.DEFAULT_MODEL)
-        self.client = AsyncAnthropic(api_key=api_key)
+        self.client = client or AsyncAnthropic(api_key=api_key)
     
     async def _get_completion(self, system: str, user: str) -> str:
-        """Get a completion from Anthropic."""
+        """Get a completion from Anthropic.
+        
+        The system prompt (rules and board layout, see _get_static_prefix)
+        is the same for every call of a game, so it's marked for prompt
+        caching; later calls read it from the cache instead of paying for
+        it again.
+        """
         response = await self.client.messages.create(
             model=self.model,
             max_tokens=300,
-            system=system,
+            system=[
+                {"type": "text", "text": system, "cache_control": {"type": "ephemeral"}},
+            ],
             messages=[
                 {"role": "user", "content": user},
             ],
         )
+        usage = getattr(response, "usage", None)
+        self._record_prompt_cache(getattr(usage, "cache_read_input_tokens", None) if usage else None)
         return response.content[0].text.strip()
     
     async def decide_action(
@@ -48,7 +60,7 @@ class AnthropicPlayer(AIPlayer):
         state_text = self._format_game_state(game_state, player)
         actions_text = self._format_valid_actions(valid_actions, game_state, player)
         
-        system_prompt = self._get_system_prompt()
+        system_prompt = self._get_static_prefix(game_state)
         user_prompt = f"""{state_text}
 
 {actions_text}
@@ -72,7 +84,8 @@ REASON: [your strategic reasoning]"""
                 valid_actions=action_types,
                 considered=[AIDecisionLogEntry(action=action.action_type.value, status="chosen", reason=reason)],
                 chosen_action=action.action_type.value,
-                reason=reason
+                reason=reason,
+                **self._prompt_cache_counts(),
             )
         
         def log_ai_decision(response: str, chosen_action: Action, decision_log: AIDecisionLog):
@@ -93,7 +106,7 @@ REASON: [your strategic reasoning]"""
                 )
         
         try:
-            response = await self._get_completion(system_prompt, user_prompt)
+            response = await self._complete(system_prompt, user_prompt)
             
             # Parse the structured response
             action_num, target_id, soldiers_count, reason = self._parse_ai_response(response)
@@ -148,7 +161,7 @@ REASON: [your strategic reasoning]"""
         
         defender = None
         if target.owner_id:
-            defender = next((p for p in game_state.players if p.id == target.owner_id), None)
+            defender = game_state.get_player(target.owner_id)
         
         defender_info = "NEUTRAL" if not defender else f"{defender.name} (~{defender.soldiers}S)"
         
@@ -167,7 +180,7 @@ Calculate the optimal commitment considering:
 Respond with ONLY a number between {min_soldiers} and {max_soldiers}."""
         
         try:
-            response = await self._get_completion(self._get_system_prompt(), prompt)
+            response = await self._complete(self._get_static_prefix(game_state), prompt)
             
             numbers = re.findall(r'\d+', response)
             if numbers:
@@ -204,7 +217,7 @@ Choose based on:
 Respond with ONLY the number of your chosen town (1-{len(available_towns)})."""
         
         try:
-            response = await self._get_completion(self._get_system_prompt(), prompt)
+            response = await self._complete(self._get_static_prefix(game_state), prompt)
             
             numbers = re.findall(r'\d+', response)
             if numbers:
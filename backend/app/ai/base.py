@@ -1,12 +1,28 @@
 """Abstract base class for AI players."""
+import contextvars
+import re
 from abc import ABC, abstractmethod
-from typing import Optional, TYPE_CHECKING
-from app.models.schemas import GameState, Player, Action, Holding, ActionType, CardType, HoldingType
+from datetime import datetime
+from typing import Optional, Tuple, TYPE_CHECKING
+from app.models.schemas import (
+    GameState, Player, Action, Holding, ActionType, CardType, HoldingType,
+    AIDecisionLog, AIDecisionLogEntry
+)
+from app.ai.scheduler import estimate_tokens, get_scheduler
 
 if TYPE_CHECKING:
     from app.game.logger import GameLogger
 
 
+# Longest turn plan an AI may return
+MAX_PLAN_STEPS = 8
+
+# Prompt-cache (hits, misses) reported for the last completion of the current task
+_prompt_cache: contextvars.ContextVar[Optional[tuple[int, int]]] = contextvars.ContextVar(
+    "ai_prompt_cache", default=None
+)
+
+
 class AIPlayer(ABC):
     """Abstract base class for AI players.
     
@@ -14,6 +30,9 @@ class AIPlayer(ABC):
     to provide decision-making capabilities for the game.
     """
     
+    # Provider name for rate limiting (app.ai.clients.OPENAI, ...)
+    PROVIDER: Optional[str] = None
+    
     def __init__(self, api_key: str, model: Optional[str] = None):
         """Initialize the AI player.
         
@@ -87,6 +106,175 @@ class AIPlayer(ABC):
         """
         pass
     
+    @property
+    def supports_planning(self) -> bool:
+        """Whether this player can plan a whole turn in one call (see plan_turn)."""
+        return self.PROVIDER is not None
+    
+    async def plan_turn(
+        self,
+        game_state: GameState,
+        player: Player,
+        valid_actions: list[Action],
+        logger: Optional["GameLogger"] = None
+    ) -> Tuple[list[Action], Optional[AIDecisionLog]]:
+        """Plan the rest of the turn in one LLM call.
+        
+        The AI picks an ordered list of actions from valid_actions. The
+        caller carries them out one by one and asks for a new plan once a
+        step is no longer valid (e.g. after a lost combat) or the plan runs
+        out before END_TURN.
+        
+        Returns:
+            Completed actions in order (empty if the response couldn't be
+            used), and the decision log of the plan
+        """
+        state_text = self._format_game_state(game_state, player)
+        actions_text = self._format_valid_actions(valid_actions, game_state, player)
+        system_prompt = self._get_static_prefix(game_state)
+        user_prompt = f"""{state_text}
+
+{actions_text}
+
+You have {player.soldiers} soldiers available. Minimum 200 required for attacks.
+
+PLAN YOUR WHOLE TURN: list the actions you want to take this turn, in order,
+using the numbers above (at most {MAX_PLAN_STEPS}). Only plan actions from this list;
+end with end_turn if nothing else is worth doing. You will be asked again if
+a step becomes impossible (for example after losing a battle).
+
+Respond in this format (this replaces the single-action format):
+PLAN:
+1. ACTION: [number] | TARGET: [holding_id or "none"] | SOLDIERS: [number or "none"]
+2. ACTION: [number] | TARGET: [holding_id or "none"] | SOLDIERS: [number or "none"]
+REASON: [your strategic reasoning]"""
+        
+        try:
+            response = await self._complete(system_prompt, user_prompt)
+        except Exception as e:
+            response = f"Error: {str(e)}"
+            steps, reason = [], response[:100]
+        else:
+            steps, reason = self._parse_plan_response(response)
+        
+        plan: list[Action] = []
+        for action_num, target_id, soldiers_count in steps[:MAX_PLAN_STEPS]:
+            if not 1 <= action_num <= len(valid_actions):
+                break
+            completed = self._complete_action(
+                valid_actions[action_num - 1], game_state, player, target_id, soldiers_count
+            )
+            if completed is None:
+                break
+            plan.append(completed)
+            if completed.action_type == ActionType.END_TURN:
+                break
+        if not plan:
+            return [], None
+        
+        decision_log = AIDecisionLog(
+            player_name=player.name,
+            timestamp=datetime.now().isoformat(),
+            valid_actions=list(dict.fromkeys(a.action_type.value for a in valid_actions)),
+            considered=[
+                AIDecisionLogEntry(action=a.action_type.value, status="chosen" if i == 0 else "planned",
+                                   reason=f"Step {i + 1} of {len(plan)} in turn plan")
+                for i, a in enumerate(plan)
+            ],
+            chosen_action=plan[0].action_type.value,
+            reason=reason,
+            **self._prompt_cache_counts(),
+        )
+        if logger:
+            logger.log_ai_decision(
+                round_num=game_state.current_round,
+                player_id=player.id,
+                player_name=player.name,
+                player_type=player.player_type.value,
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                raw_response=response,
+                parsed_action=plan[0].action_type.value,
+                action_details=logger.get_action_details(plan[0]),
+                decision_log=decision_log.model_dump(),
+            )
+        return plan, decision_log
+    
+    async def _complete(self, system: str, user: str) -> str:
+        """Get a completion from the provider, within its rate limits.
+        
+        Subclasses implement the actual request as `_get_completion`, and
+        report whether the provider served the prompt prefix from its cache
+        with `_record_prompt_cache`.
+        """
+        _prompt_cache.set(None)
+        return await get_scheduler().call(
+            self.PROVIDER,
+            estimate_tokens(system, user),
+            lambda: self._get_completion(system, user),
+        )
+    
+    def _record_prompt_cache(self, cached_tokens: Optional[int]) -> None:
+        """Record a completion's prompt-cache usage (None if not reported)."""
+        if cached_tokens is not None:
+            _prompt_cache.set((1, 0) if cached_tokens > 0 else (0, 1))
+    
+    def _prompt_cache_counts(self) -> dict:
+        """Cache hit and miss counts of the last completion, for an AIDecisionLog."""
+        counts = _prompt_cache.get()
+        if counts is None:
+            return {}
+        return {"cache_hits": counts[0], "cache_misses": counts[1]}
+    
+    def _get_static_prefix(self, game_state: GameState) -> str:
+        """System prompt for every call of a game: the rules, then the board layout.
+        
+        Nothing in it changes during a game, so providers with prompt
+        caching can serve it from their cache; everything that does change
+        goes in the user prompt after it.
+        """
+        return f"{self._get_system_prompt()}\n\n{self._format_board_layout(game_state)}"
+    
+    def _format_board_layout(self, game_state: GameState) -> str:
+        """Describe the fixed parts of the board (who owns what is in the game state)."""
+        lines = ["=== Board Layout ==="]
+        for county in ["X", "U", "V", "Q"]:
+            lines.append(f"\n  County {county}:")
+            for holding in game_state.holdings:
+                if holding.county == county:
+                    lines.append(f"    {self._format_holding_layout(holding)}")
+        
+        lines.append("\n  Duchy Castles:")
+        for holding in game_state.holdings:
+            if holding.holding_type == HoldingType.DUCHY_CASTLE:
+                lines.append(f"    {holding.name} (id={holding.id}): Duchy={holding.duchy}")
+        
+        lines.append("\n  King's Castle:")
+        for holding in game_state.holdings:
+            if holding.holding_type == HoldingType.KING_CASTLE:
+                lines.append(f"    {holding.name} (id={holding.id})")
+        
+        return "\n".join(lines)
+    
+    def _format_holding_layout(self, holding: Holding) -> str:
+        """Format the parts of a holding that never change."""
+        type_label = "Town" if holding.holding_type == HoldingType.TOWN else "County Castle"
+        parts = [f"{holding.name} (id={holding.id})", f"Type={type_label}"]
+        if holding.gold_value > 0 or holding.soldier_value > 0:
+            parts.append(f"Income={holding.gold_value}G/{holding.soldier_value}S")
+        
+        bonuses = []
+        if holding.defense_modifier:
+            bonuses.append(f"{holding.defense_modifier:+d} defense")
+        if holding.attack_modifier:
+            bonuses.append(f"{holding.attack_modifier:+d} attack")
+        if holding.is_capitol:
+            bonuses.append("CAPITOL")
+        if bonuses:
+            parts.append(f"[{', '.join(bonuses)}]")
+        
+        return ", ".join(parts)
+    
     def _format_game_state(self, game_state: GameState, player: Player) -> str:
         """Format game state as a string for the AI prompt.
         
@@ -109,7 +297,7 @@ class AIPlayer(ABC):
         ]
         
         for holding_id in player.holdings:
-            holding = next((h for h in game_state.holdings if h.id == holding_id), None)
+            holding = game_state.get_holding(holding_id)
             if holding:
                 holding_info = self._format_holding_details(holding)
                 lines.append(f"  - {holding_info}")
@@ -132,37 +320,17 @@ class AIPlayer(ABC):
                 title = "KING" if p.is_king else p.title.value.upper()
                 lines.append(f"  {p.name} ({title}): {len(p.holdings)} holdings, ~{p.soldiers}S, {p.prestige}VP")
         
-        lines.append("\n=== All Holdings on Board ===")
-        # Group holdings by county for clarity
-        for county in ["X", "U", "V", "Q"]:
-            lines.append(f"\n  County {county}:")
-            county_holdings = [h for h in game_state.holdings if h.county == county]
-            for holding in county_holdings:
-                owner = "NEUTRAL"
-                if holding.owner_id:
-                    owner_player = next((p for p in game_state.players if p.id == holding.owner_id), None)
-                    owner = owner_player.name if owner_player else "Unknown"
-                holding_info = self._format_holding_details(holding, owner)
-                lines.append(f"    {holding_info}")
-        
-        # Duchy and King castles
-        lines.append("\n  Duchy Castles:")
+        # Board layout is in the system prompt; only control changes during a game
+        lines.append("\n=== Board Control ===")
         for holding in game_state.holdings:
-            if holding.holding_type == HoldingType.DUCHY_CASTLE:
-                owner = "NEUTRAL"
-                if holding.owner_id:
-                    owner_player = next((p for p in game_state.players if p.id == holding.owner_id), None)
-                    owner = owner_player.name if owner_player else "Unknown"
-                lines.append(f"    {holding.name} (id={holding.id}): Owner={owner}, Duchy={holding.duchy}")
-        
-        lines.append("\n  King's Castle:")
-        for holding in game_state.holdings:
-            if holding.holding_type == HoldingType.KING_CASTLE:
-                owner = "NEUTRAL"
-                if holding.owner_id:
-                    owner_player = next((p for p in game_state.players if p.id == holding.owner_id), None)
-                    owner = owner_player.name if owner_player else "Unknown"
-                lines.append(f"    {holding.name} (id={holding.id}): Owner={owner}")
+            owner = "NEUTRAL"
+            if holding.owner_id:
+                owner_player = game_state.get_player(holding.owner_id)
+                owner = owner_player.name if owner_player else "Unknown"
+            control = f"  {holding.id}: Owner={owner}"
+            if holding.fortification_count > 0:
+                control += f", FORT x{holding.fortification_count} (+{holding.fortification_count * 2} def)"
+            lines.append(control)
         
         lines.append(f"\n=== Your Hand ({len(player.hand)} cards) ===")
         for card_id in player.hand:
@@ -233,7 +401,7 @@ class AIPlayer(ABC):
                             for t in targets:
                                 owner = "NEUTRAL"
                                 if t.owner_id:
-                                    owner_player = next((p for p in game_state.players if p.id == t.owner_id), None)
+                                    owner_player = game_state.get_player(t.owner_id)
                                     owner = owner_player.name if owner_player else "Unknown"
                                 target_info = self._format_holding_details(t, owner)
                                 action_desc += f"\n        - {target_info}"
@@ -359,6 +527,35 @@ class AIPlayer(ABC):
         
         return action_num, target_id, soldiers_count, reason
     
+    def _parse_plan_response(self, response: str) -> tuple[list[tuple[int, Optional[str], Optional[int]]], str]:
+        """Parse a turn plan response (see plan_turn).
+        
+        Each line with an ACTION is one step; its TARGET and SOLDIERS are
+        read from the same line.
+        
+        Returns:
+            Tuple of (steps, reason); steps are (action_number, target_id,
+            soldiers_count) with the same meaning as in _parse_ai_response
+        """
+        steps = []
+        for line in response.splitlines():
+            action_match = re.search(r'ACTION:\s*(\d+)', line, re.IGNORECASE)
+            if not action_match:
+                continue
+            target_id = None
+            target_match = re.search(r'TARGET:\s*([^\s|]+)', line, re.IGNORECASE)
+            if target_match:
+                target_value = target_match.group(1).strip().lower()
+                if target_value not in ("none", "n/a"):
+                    target_id = target_value
+            soldiers_match = re.search(r'SOLDIERS:\s*(\d+)', line, re.IGNORECASE)
+            soldiers_count = int(soldiers_match.group(1)) if soldiers_match else None
+            steps.append((int(action_match.group(1)), target_id, soldiers_count))
+        
+        reason_match = re.search(r'REASON:\s*(.+?)(?:\n|$)', response, re.IGNORECASE)
+        reason = reason_match.group(1).strip() if reason_match else response.strip()[:200]
+        return steps, reason
+    
     def _complete_action(
         self, 
         action: Action, 
@@ -379,8 +576,10 @@ class AIPlayer(ABC):
             target_id: Optional target holding ID from AI response
             soldiers_count: Optional soldier count from AI response (for attacks)
         
-        Returns None if the action cannot be completed (e.g., no valid target).
+        Returns a completed copy (valid actions are shared and must not be
+        modified), or None if the action cannot be completed (e.g., no valid target).
         """
+        action = action.model_copy()
         if action.action_type == ActionType.PLAY_CARD:
             card = game_state.cards.get(action.card_id)
             if card and card.card_type == CardType.CLAIM:
@@ -0,0 +1,144 @@
+"""Process-wide LLM provider clients.
+
+AI players used to build their own SDK client, so every AIManager (one per
+simulation step, run or WebSocket) paid for new HTTP connections and TLS
+handshakes. The pool builds one client per provider and API key for the
+life of the app, each on a keep-alive httpx connection pool capped at
+ai_max_connections_per_provider connections; AIManager hands them to the
+players it creates. The app lifespan closes them on shutdown.
+
+Base URLs come from settings (openai_base_url, anthropic_base_url,
+xai_base_url), so a local stand-in server can take the place of a
+provider. Tests can pass an httpx transport instead, which every client
+then uses. The clients don't retry failed requests themselves; the
+scheduler (app.ai.scheduler) does.
+
+Gemini's SDK keeps its own process-wide gRPC channel per API key
+(genai.configure), so the pool only shares the configured model objects.
+"""
+import threading
+from typing import Optional
+
+import httpx
+from anthropic import AsyncAnthropic
+from openai import AsyncOpenAI
+
+from app.config import get_settings
+
+
+# Provider names, as used for settings and limits
+OPENAI = "openai"
+ANTHROPIC = "anthropic"
+GEMINI = "gemini"
+XAI = "xai"
+
+XAI_BASE_URL = "https://api.x.ai/v1"
+
+
+class ClientPool:
+    """Shared provider clients with keep-alive connection pooling."""
+
+    def __init__(
+        self,
+        max_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        settings = get_settings()
+        self.max_connections = max_connections or settings.ai_max_connections_per_provider
+        self.keepalive_expiry = keepalive_expiry or settings.ai_keepalive_expiry
+        self._transport = transport
+        self._base_urls = {
+            OPENAI: settings.openai_base_url or None,
+            ANTHROPIC: settings.anthropic_base_url or None,
+            XAI: settings.xai_base_url or XAI_BASE_URL,
+        }
+        self._http: dict[str, httpx.AsyncClient] = {}
+        self._clients: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _http_client(self, provider: str) -> httpx.AsyncClient:
+        """The connection pool shared by every client of a provider."""
+        http = self._http.get(provider)
+        if http is None:
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            )
+            http = httpx.AsyncClient(
+                limits=limits,
+                timeout=httpx.Timeout(60.0, connect=10.0),
+                transport=self._transport,
+            )
+            self._http[provider] = http
+        return http
+
+    def _get(self, key: tuple, create):
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = create()
+            return client
+
+    def openai(self, api_key: str) -> AsyncOpenAI:
+        """Shared OpenAI client for an API key."""
+        return self._get((OPENAI, api_key), lambda: AsyncOpenAI(
+            api_key=api_key,
+            base_url=self._base_urls[OPENAI],
+            http_client=self._http_client(OPENAI),
+            max_retries=0,  # Retries are up to the scheduler
+        ))
+
+    def xai(self, api_key: str) -> AsyncOpenAI:
+        """Shared client for xAI's OpenAI-compatible API."""
+        return self._get((XAI, api_key), lambda: AsyncOpenAI(
+            api_key=api_key,
+            base_url=self._base_urls[XAI],
+            http_client=self._http_client(XAI),
+            max_retries=0,
+        ))
+
+    def anthropic(self, api_key: str) -> AsyncAnthropic:
+        """Shared Anthropic client for an API key."""
+        return self._get((ANTHROPIC, api_key), lambda: AsyncAnthropic(
+            api_key=api_key,
+            base_url=self._base_urls[ANTHROPIC],
+            http_client=self._http_client(ANTHROPIC),
+            max_retries=0,
+        ))
+
+    def gemini(self, api_key: str, model: str):
+        """Shared Gemini model object for an API key and model."""
+        def create():
+            import google.generativeai as genai
+            genai.configure(api_key=api_key)
+            return genai.GenerativeModel(model)
+        return self._get((GEMINI, api_key, model), create)
+
+    async def close(self) -> None:
+        """Close every provider's connections."""
+        with self._lock:
+            http, self._http = list(self._http.values()), {}
+            self._clients.clear()
+        for client in http:
+            await client.aclose()
+
+
+_client_pool: Optional[ClientPool] = None
+
+
+def get_client_pool() -> ClientPool:
+    """Get the process-wide client pool (created on first use)."""
+    global _client_pool
+    if _client_pool is None:
+        _client_pool = ClientPool()
+    return _client_pool
+
+
+async def shutdown_client_pool() -> None:
+    """Close the pooled connections (call on application shutdown)."""
+    global _client_pool
+    pool, _client_pool = _client_pool, None
+    if pool is not None:
+        await pool.close()
@@ -5,6 +5,7 @@ from typing import Optional, Tuple, TYPE_CHECKING
 import google.generativeai as genai
 
 from app.ai.base import AIPlayer
+from app.ai.clients import GEMINI
 from app.models.schemas import GameState, Player, Action, Holding, ActionType, AIDecisionLog, AIDecisionLogEntry
 
 if TYPE_CHECKING:
@@ -14,12 +15,15 @@ if TYPE_CHECKING:
 class GeminiPlayer(AIPlayer):
     """AI player powered by Google's Gemini models."""
     
+    PROVIDER = GEMINI
     DEFAULT_MODEL = "gemini-1.5-pro"
     
-    def __init__(self, api_key: str, model: Optional[str] = None):
+    def __init__(self, api_key: str, model: Optional[str] = None, model_instance=None):
         super().__init__(api_key, model or self.DEFAULT_MODEL)
-        genai.configure(api_key=api_key)
-        self.model_instance = genai.GenerativeModel(self.model)
+        if model_instance is None:
+            genai.configure(api_key=api_key)
+            model_instance = genai.GenerativeModel(self.model)
+        self.model_instance = model_instance
     
     async def _get_completion(self, system: str, user: str) -> str:
         """Get a completion from Gemini."""
@@ -33,6 +37,9 @@ class GeminiPlayer(AIPlayer):
                 max_output_tokens=300,
             ),
         )
+        # The static prefix comes first, so implicit caching can reuse it
+        usage = getattr(response, "usage_metadata", None)
+        self._record_prompt_cache(getattr(usage, "cached_content_token_count", None) if usage else None)
         return response.text.strip()
     
     async def decide_action(
@@ -51,7 +58,7 @@ class GeminiPlayer(AIPlayer):
         state_text = self._format_game_state(game_state, player)
         actions_text = self._format_valid_actions(valid_actions, game_state, player)
         
-        system_prompt = self._get_system_prompt()
+        system_prompt = self._get_static_prefix(game_state)
         user_prompt = f"""{state_text}
 
 {actions_text}
@@ -75,7 +82,8 @@ REASON: [your strategic reasoning]"""
                 valid_actions=action_types,
                 considered=[AIDecisionLogEntry(action=action.action_type.value, status="chosen", reason=reason)],
                 chosen_action=action.action_type.value,
-                reason=reason
+                reason=reason,
+                **self._prompt_cache_counts(),
             )
         
         def log_ai_decision(response: str, chosen_action: Action, decision_log: AIDecisionLog):
@@ -96,7 +104,7 @@ REASON: [your strategic reasoning]"""
                 )
         
         try:
-            response = await self._get_completion(system_prompt, user_prompt)
+            response = await self._complete(system_prompt, user_prompt)
             
             # Parse the structured response
             action_num, target_id, soldiers_count, reason = self._parse_ai_response(response)
@@ -151,7 +159,7 @@ REASON: [your strategic reasoning]"""
         
         defender = None
         if target.owner_id:
-            defender = next((p for p in game_state.players if p.id == target.owner_id), None)
+            defender = game_state.get_player(target.owner_id)
         
         defender_info = "Undefended" if not defender else f"Defended by {defender.name}"
         
@@ -171,7 +179,7 @@ Choose your troop commitment wisely.
 Respond with ONLY a number between {min_soldiers} and {max_soldiers}."""
         
         try:
-            response = await self._get_completion(self._get_system_prompt(), prompt)
+            response = await self._complete(self._get_static_prefix(game_state), prompt)
             
             numbers = re.findall(r'\d+', response)
             if numbers:
@@ -206,7 +214,7 @@ Consider starting resources and strategic county positioning.
 Respond with ONLY the number of your choice (1-{len(available_towns)})."""
         
         try:
-            response = await self._get_completion(self._get_system_prompt(), prompt)
+            response = await self._complete(self._get_static_prefix(game_state), prompt)
             
             numbers = re.findall(r'\d+', response)
             if numbers:
@@ -5,6 +5,7 @@ from typing import Optional, Tuple, TYPE_CHECKING
 from openai import AsyncOpenAI
 
 from app.ai.base import AIPlayer
+from app.ai.clients import XAI
 from app.models.schemas import GameState, Player, Action, Holding, ActionType, AIDecisionLog, AIDecisionLogEntry
 
 if TYPE_CHECKING:
@@ -17,12 +18,13 @@ class GrokPlayer(AIPlayer):
     Note: Grok uses an OpenAI-compatible API endpoint.
     """
     
+    PROVIDER = XAI
     DEFAULT_MODEL = "grok-beta"
     BASE_URL = "https://api.x.ai/v1"
     
-    def __init__(self, api_key: str, model: Optional[str] = None):
+    def __init__(self, api_key: str, model: Optional[str] = None, client: Optional[AsyncOpenAI] = None):
         super().__init__(api_key, model or self.DEFAULT_MODEL)
-        self.client = AsyncOpenAI(
+        self.client = client or AsyncOpenAI(
             api_key=api_key,
             base_url=self.BASE_URL,
         )
@@ -38,6 +40,9 @@ class GrokPlayer(AIPlayer):
             temperature=0.7,
             max_tokens=300,
         )
+        # Prompts share their prefix, which the API caches on its own
+        details = getattr(response.usage, "prompt_tokens_details", None) if response.usage else None
+        self._record_prompt_cache(getattr(details, "cached_tokens", None) if details else None)
         return response.choices[0].message.content.strip()
     
     async def decide_action(
@@ -56,7 +61,7 @@ class GrokPlayer(AIPlayer):
         state_text = self._format_game_state(game_state, player)
         actions_text = self._format_valid_actions(valid_actions, game_state, player)
         
-        system_prompt = self._get_system_prompt()
+        system_prompt = self._get_static_prefix(game_state)
         user_prompt = f"""{state_text}
 
 {actions_text}
@@ -80,7 +85,8 @@ REASON: [your strategic reasoning]"""
                 valid_actions=action_types,
                 considered=[AIDecisionLogEntry(action=action.action_type.value, status="chosen", reason=reason)],
                 chosen_action=action.action_type.value,
-                reason=reason
+                reason=reason,
+                **self._prompt_cache_counts(),
             )
         
         def log_ai_decision(response: str, chosen_action: Action, decision_log: AIDecisionLog):
@@ -101,7 +107,7 @@ REASON: [your strategic reasoning]"""
                 )
         
         try:
-            response = await self._get_completion(system_prompt, user_prompt)
+            response = await self._complete(system_prompt, user_prompt)
             
             # Parse the structured response
             action_num, target_id, soldiers_count, reason = self._parse_ai_response(response)
@@ -156,7 +162,7 @@ REASON: [your strategic reasoning]"""
         
         defender = None
         if target.owner_id:
-            defender = next((p for p in game_state.players if p.id == target.owner_id), None)
+            defender = game_state.get_player(target.owner_id)
         
         defender_info = "No defender" if not defender else f"{defender.name} waiting"
         fort_status = "fortified (tough nut to crack)" if target.fortified else "open"
@@ -173,7 +179,7 @@ Remember: win = lose half your troops, lose = lose them all.
 How many soldiers are you sending in? Just give me a number."""
         
         try:
-            response = await self._get_completion(self._get_system_prompt(), prompt)
+            response = await self._complete(self._get_static_prefix(game_state), prompt)
             
             numbers = re.findall(r'\d+', response)
             if numbers:
@@ -208,7 +214,7 @@ Think about what kind of start you want - rich or military?
 Pick a number (1-{len(available_towns)})."""
         
         try:
-            response = await self._get_completion(self._get_system_prompt(), prompt)
+            response = await self._complete(self._get_static_prefix(game_state), prompt)
             
             numbers = re.findall(r'\d+', response)
             if numbers:
@@ -1,23 +1,59 @@
 """AI Player Manager - handles AI player creation and action execution."""
+from collections import OrderedDict, deque
 from typing import Optional, Tuple, TYPE_CHECKING
 from datetime import datetime
 from app.config import get_settings
 from app.models.schemas import (
-    GameState, Player, PlayerType, Action, ActionType, HoldingType,
+    GameState, Player, PlayerType, Action, ActionType, HoldingType, CardEffect,
     AIDecisionLog, AIDecisionLogEntry
 )
 from app.ai.base import AIPlayer
+from app.ai.clients import get_client_pool
+from app.ai.scheduler import for_game
 from app.ai.openai_player import OpenAIPlayer
 from app.ai.anthropic_player import AnthropicPlayer
 from app.ai.gemini_player import GeminiPlayer
 from app.ai.grok_player import GrokPlayer
 from app.game.engine import GameEngine
-from app.game.logger import get_logger
+from app.game.state import logger_for
 
 if TYPE_CHECKING:
     from app.game.logger import GameLogger
 
 
+# Turn plans still being carried out, by (game, player); kept process-wide
+# because callers create a new AIManager per step. Oldest forgotten first.
+MAX_TURN_PLANS = 1024
+
+
+class TurnPlan:
+    """Remaining steps of an AI's turn plan (see AIPlayer.plan_turn)."""
+    
+    def __init__(self, turn: tuple[int, int], combats: int, steps: list[Action], reason: str):
+        self.turn = turn  # (round, current player index) the plan was made for
+        self.combats = combats  # Length of the combat log when it was made
+        self.steps = deque(steps)
+        self.total = len(steps)
+        self.reason = reason
+
+
+_turn_plans: "OrderedDict[tuple[str, str], TurnPlan]" = OrderedDict()
+
+
+def _plan_key(action: Action) -> tuple:
+    """What identifies a planned step among valid actions (AI-filled fields aside)."""
+    target = None if action.action_type == ActionType.PLAY_CARD else action.target_holding_id
+    return (action.action_type, action.source_holding_id, target, action.card_id, action.target_player_id)
+
+
+# Title claims by preference (bigger titles first)
+TITLE_PRIORITY = {
+    HoldingType.KING_CASTLE: 0,
+    HoldingType.DUCHY_CASTLE: 1,
+    HoldingType.COUNTY_CASTLE: 2,
+}
+
+
 class AIManager:
     """Manages AI players for games."""
     
@@ -36,31 +72,36 @@ class AIManager:
         if key in self._players:
             return self._players[key]
         
-        # Create new AI player based on type
+        # Create new AI player based on type (sharing the process-wide clients)
         ai_player: Optional[AIPlayer] = None
+        pool = get_client_pool()
         
         if player_type == PlayerType.AI_OPENAI:
             if self.settings.openai_api_key:
-                ai_player = OpenAIPlayer(self.settings.openai_api_key)
+                api_key = self.settings.openai_api_key
+                ai_player = OpenAIPlayer(api_key, client=pool.openai(api_key))
             else:
                 # Fallback to simple AI
                 ai_player = SimpleAIPlayer()
                 
         elif player_type == PlayerType.AI_ANTHROPIC:
             if self.settings.anthropic_api_key:
-                ai_player = AnthropicPlayer(self.settings.anthropic_api_key)
+                api_key = self.settings.anthropic_api_key
+                ai_player = AnthropicPlayer(api_key, client=pool.anthropic(api_key))
             else:
                 ai_player = SimpleAIPlayer()
                 
         elif player_type == PlayerType.AI_GEMINI:
             if self.settings.google_api_key:
-                ai_player = GeminiPlayer(self.settings.google_api_key)
+                api_key = self.settings.google_api_key
+                ai_player = GeminiPlayer(api_key, model_instance=pool.gemini(api_key, GeminiPlayer.DEFAULT_MODEL))
             else:
                 ai_player = SimpleAIPlayer()
                 
         elif player_type == PlayerType.AI_GROK:
             if self.settings.xai_api_key:
-                ai_player = GrokPlayer(self.settings.xai_api_key)
+                api_key = self.settings.xai_api_key
+                ai_player = GrokPlayer(api_key, client=pool.xai(api_key))
             else:
                 ai_player = SimpleAIPlayer()
         
@@ -83,17 +124,37 @@ class AIManager:
             ai_player = SimpleAIPlayer()
         
         # Get valid actions from game engine
-        engine = GameEngine(state.id)
+        engine = GameEngine(state.id, state)  # Also works on detached forks
         valid_actions = engine.get_valid_actions(player.id)
         
         if not valid_actions:
             return None, None
         
         # Get the game logger for this game
-        logger = get_logger(state.id)
+        logger = logger_for(state)
+        
+        # Decisions with one sensible answer don't need an LLM call
+        if ai_player.PROVIDER is not None:
+            triaged = self._triage(ai_player, state, player, valid_actions)
+            if triaged:
+                return self._log_rule_based(state, player, valid_actions, *triaged, logger=logger)
+        
+        # Plan mode: one LLM call plans the turn, later steps are replayed
+        if self.settings.ai_turn_planning and ai_player.supports_planning:
+            action, decision_log = self._next_planned_action(ai_player, state, player, valid_actions)
+            if action is None:
+                with for_game(state.id):
+                    plan, decision_log = await ai_player.plan_turn(state, player, valid_actions, logger=logger)
+                if plan:
+                    self._store_plan(state, player, plan[1:], decision_log.reason)
+                    return plan[0], decision_log
+            else:
+                return action, decision_log
         
         # Have AI decide - pass the logger for detailed logging
-        result = await ai_player.decide_action(state, player, valid_actions, logger=logger)
+        # (its LLM calls queue fairly with other games' under the rate limits)
+        with for_game(state.id):
+            result = await ai_player.decide_action(state, player, valid_actions, logger=logger)
         
         if isinstance(result, tuple):
             return result
@@ -101,6 +162,139 @@ class AIManager:
             # Legacy AI players that don't return logs
             return result, None
     
+    def _triage(
+        self,
+        ai_player: AIPlayer,
+        state: GameState,
+        player: Player,
+        valid_actions: list[Action],
+    ) -> Optional[Tuple[Action, str]]:
+        """Resolve decisions that need no strategy, without asking the AI.
+        
+        - A title claim is always taken (every provider prompt says so),
+          the biggest title first
+        - END_TURN is taken when every other action can't actually be
+          carried out (unaffordable, or nothing to apply it to) or has no
+          effect
+        
+        Returns:
+            (action, reason), or None if the choice is up to the AI
+        """
+        titles = [a for a in valid_actions if a.action_type == ActionType.CLAIM_TITLE]
+        if titles:
+            def priority(action: Action) -> int:
+                holding = state.get_holding(action.target_holding_id)
+                return TITLE_PRIORITY.get(holding.holding_type, len(TITLE_PRIORITY)) if holding else len(TITLE_PRIORITY)
+            action = min(titles, key=priority)
+            return action, f"Claiming title at {action.target_holding_id} (always worth taking)"
+        
+        end_turn = next((a for a in valid_actions if a.action_type == ActionType.END_TURN), None)
+        if end_turn is None:
+            return None
+        if all(a.action_type == ActionType.END_TURN or self._is_dead_action(ai_player, state, player, a)
+               for a in valid_actions):
+            if len(valid_actions) == 1:
+                return end_turn, "Ending turn (the only valid action)"
+            return end_turn, "Ending turn (no other action can be afforded or would have an effect)"
+        return None
+    
+    def _is_dead_action(self, ai_player: AIPlayer, state: GameState, player: Player, action: Action) -> bool:
+        """Whether a listed action would certainly fail or do nothing if chosen."""
+        if action.action_type in (ActionType.MOVE, ActionType.RECRUIT):
+            return True  # Soldiers are a single pool: these only record the action
+        if action.action_type == ActionType.ATTACK:
+            return player.soldiers < 200
+        if action.action_type == ActionType.PLAY_CARD:
+            card = state.cards.get(action.card_id)
+            if card and card.effect == CardEffect.ADVENTURER and player.gold < 25:
+                return True
+            return ai_player._complete_action(action, state, player) is None
+        return False
+    
+    def _log_rule_based(
+        self,
+        state: GameState,
+        player: Player,
+        valid_actions: list[Action],
+        action: Action,
+        reason: str,
+        logger: Optional["GameLogger"] = None,
+    ) -> Tuple[Action, AIDecisionLog]:
+        """Build and log the decision log of a triaged action."""
+        decision_log = AIDecisionLog(
+            player_name=player.name,
+            timestamp=datetime.now().isoformat(),
+            valid_actions=list(dict.fromkeys(a.action_type.value for a in valid_actions)),
+            considered=[AIDecisionLogEntry(action=action.action_type.value, status="chosen", reason=reason)],
+            chosen_action=action.action_type.value,
+            reason=reason,
+        )
+        if logger:
+            logger.log_ai_decision(
+                round_num=state.current_round,
+                player_id=player.id,
+                player_name=player.name,
+                player_type=player.player_type.value,
+                system_prompt="Triage (rule-based, no LLM call)",
+                user_prompt="N/A - rule-based decision",
+                raw_response="N/A - rule-based decision",
+                parsed_action=action.action_type.value,
+                action_details=logger.get_action_details(action),
+                decision_log=decision_log.model_dump(),
+            )
+        return action, decision_log
+    
+    def _store_plan(self, state: GameState, player: Player, steps: list[Action], reason: str) -> None:
+        key = (state.id, player.id)
+        _turn_plans.pop(key, None)
+        if not steps:
+            return
+        turn = (state.current_round, state.current_player_idx)
+        _turn_plans[key] = TurnPlan(turn, len(state.combat_log), steps, reason)
+        while len(_turn_plans) > MAX_TURN_PLANS:
+            _turn_plans.popitem(last=False)
+    
+    def _next_planned_action(
+        self,
+        ai_player: AIPlayer,
+        state: GameState,
+        player: Player,
+        valid_actions: list[Action],
+    ) -> Tuple[Optional[Action], Optional[AIDecisionLog]]:
+        """Take the next step of the player's turn plan, if it's still valid.
+        
+        The plan is dropped (so the caller re-plans) when the turn has moved
+        on, the player has lost a battle since planning, or the step isn't
+        among the valid actions any more.
+        """
+        plan = _turn_plans.pop((state.id, player.id), None)
+        if plan is None or plan.turn != (state.current_round, state.current_player_idx):
+            return None, None
+        for combat in state.combat_log[plan.combats:]:
+            if combat.attacker_id == player.id and not combat.attacker_won:
+                return None, None
+        step = plan.steps.popleft()
+        match = next((a for a in valid_actions if _plan_key(a) == _plan_key(step)), None)
+        if match is None:
+            return None, None
+        action = ai_player._complete_action(match, state, player, step.target_holding_id, step.soldiers_count)
+        if action is None:
+            return None, None
+        if plan.steps:
+            _turn_plans[(state.id, player.id)] = plan
+        
+        number = plan.total - len(plan.steps) + 1  # The first step was returned with the plan
+        reason = f"Step {number} of {plan.total + 1} in turn plan: {plan.reason}"
+        decision_log = AIDecisionLog(
+            player_name=player.name,
+            timestamp=datetime.now().isoformat(),
+            valid_actions=list(dict.fromkeys(a.action_type.value for a in valid_actions)),
+            considered=[AIDecisionLogEntry(action=action.action_type.value, status="chosen", reason=reason)],
+            chosen_action=action.action_type.value,
+            reason=reason,
+        )
+        return action, decision_log
+    
     async def get_starting_town(
         self, 
         state: GameState, 
@@ -112,7 +306,8 @@ class AIManager:
         if not ai_player:
             ai_player = SimpleAIPlayer()
         
-        return await ai_player.decide_starting_town(state, player, available_towns)
+        with for_game(state.id):
+            return await ai_player.decide_starting_town(state, player, available_towns)
 
 
 class SimpleAIPlayer(AIPlayer):
@@ -168,11 +363,11 @@ class SimpleAIPlayer(AIPlayer):
         # 2. IF HAVE CLAIMS: Attack enemies
         if not chosen_action and has_expansion_claims:
             if attack_actions and player.soldiers >= 200:
-                chosen_action = attack_actions[0]
                 # Commit 70% of soldiers for aggressive attacks (minimum 300), rounded down to 100s
                 raw_soldiers = max(300, int(player.soldiers * 0.7))
                 rounded_soldiers = (raw_soldiers // 100) * 100
-                chosen_action.soldiers_count = rounded_soldiers
+                # Valid actions are shared, so fill in a copy
+                chosen_action = attack_actions[0].model_copy(update={"soldiers_count": rounded_soldiers})
                 chosen_reason = f"ATTACKING {chosen_action.target_holding_id} with {chosen_action.soldiers_count} soldiers! Have claim, using it!"
                 considered.append(AIDecisionLogEntry(action="attack", status="chosen", reason=chosen_reason))
             elif attack_actions:
@@ -199,8 +394,7 @@ class SimpleAIPlayer(AIPlayer):
                     if card and card.card_type.value == "claim":
                         target = self._find_claim_target(game_state, player, card)
                         if target:
-                            action.target_holding_id = target.id
-                            chosen_action = action
+                            chosen_action = action.model_copy(update={"target_holding_id": target.id})
                             chosen_reason = f"URGENT: Playing claim card '{card.name}' targeting {target.name} - need claims to expand!"
                             considered.append(AIDecisionLogEntry(action="play_card", status="chosen", reason=chosen_reason))
                             break
@@ -228,8 +422,7 @@ class SimpleAIPlayer(AIPlayer):
                     if card and card.card_type.value == "claim":
                         target = self._find_claim_target(game_state, player, card)
                         if target:
-                            action.target_holding_id = target.id
-                            chosen_action = action
+                            chosen_action = action.model_copy(update={"target_holding_id": target.id})
                             chosen_reason = f"Playing claim card '{card.name}' targeting {target.name} to enable more attacks!"
                             considered.append(AIDecisionLogEntry(action="play_card", status="chosen", reason=chosen_reason))
                             break
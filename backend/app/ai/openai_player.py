@@ -6,6 +6,7 @@ from typing import Optional, Tuple, TYPE_CHECKING
 from openai import AsyncOpenAI
 
 from app.ai.base import AIPlayer
+from app.ai.clients import OPENAI
 from app.models.schemas import GameState, Player, Action, Holding, ActionType, AIDecisionLog, AIDecisionLogEntry
 
 if TYPE_CHECKING:
@@ -15,11 +16,12 @@ if TYPE_CHECKING:
 class OpenAIPlayer(AIPlayer):
     """AI player powered by OpenAI's GPT models."""
     
+    PROVIDER = OPENAI
     DEFAULT_MODEL = "gpt-4o"
     
-    def __init__(self, api_key: str, model: Optional[str] = None):
+    def __init__(self, api_key: str, model: Optional[str] = None, client: Optional[AsyncOpenAI] = None):
         super().__init__(api_key, model or self.DEFAULT_MODEL)
-        self.client = AsyncOpenAI(api_key=api_key)
+        self.client = client or AsyncOpenAI(api_key=api_key)
     
     async def _get_completion(self, system: str, user: str) -> str:
         """Get a completion from OpenAI."""
@@ -32,6 +34,9 @@ class OpenAIPlayer(AIPlayer):
             temperature=0.7,
             max_tokens=300,
         )
+        # Prompts share their prefix, which the API caches on its own
+        details = getattr(response.usage, "prompt_tokens_details", None) if response.usage else None
+        self._record_prompt_cache(getattr(details, "cached_tokens", None) if details else None)
         return response.choices[0].message.content.strip()
     
     async def decide_action(
@@ -51,7 +56,7 @@ class OpenAIPlayer(AIPlayer):
         state_text = self._format_game_state(game_state, player)
         actions_text = self._format_valid_actions(valid_actions, game_state, player)
         
-        system_prompt = self._get_system_prompt()
+        system_prompt = self._get_static_prefix(game_state)
         user_prompt = f"""{state_text}
 
 {actions_text}
@@ -75,7 +80,8 @@ REASON: [your strategic reasoning]"""
                 valid_actions=action_types,
                 considered=[AIDecisionLogEntry(action=action.action_type.value, status="chosen", reason=reason)],
                 chosen_action=action.action_type.value,
-                reason=reason
+                reason=reason,
+                **self._prompt_cache_counts(),
             )
         
         def log_ai_decision(response: str, chosen_action: Action, decision_log: AIDecisionLog):
@@ -96,7 +102,7 @@ REASON: [your strategic reasoning]"""
                 )
         
         try:
-            response = await self._get_completion(system_prompt, user_prompt)
+            response = await self._complete(system_prompt, user_prompt)
             
             # Parse the structured response
             action_num, target_id, soldiers_count, reason = self._parse_ai_response(response)
@@ -158,7 +164,7 @@ REASON: [your strategic reasoning]"""
         # Get defender info
         defender = None
         if target.owner_id:
-            defender = next((p for p in game_state.players if p.id == target.owner_id), None)
+            defender = game_state.get_player(target.owner_id)
         
         defender_info = "NEUTRAL (undefended)" if not defender else f"{defender.name} with ~{defender.soldiers} soldiers"
         
@@ -184,7 +190,7 @@ How many soldiers should you commit? Consider:
 Respond with ONLY a number between {min_soldiers} and {max_soldiers}."""
         
         try:
-            response = await self._get_completion(self._get_system_prompt(), prompt)
+            response = await self._complete(self._get_static_prefix(game_state), prompt)
             
             numbers = re.findall(r'\d+', response)
             if numbers:
@@ -226,7 +232,7 @@ STRATEGY TIPS:
 Respond with ONLY the number of your chosen town (1-{len(available_towns)})."""
         
         try:
-            response = await self._get_completion(self._get_system_prompt(), prompt)
+            response = await self._complete(self._get_static_prefix(game_state), prompt)
             
             numbers = re.findall(r'\d+', response)
             if numbers:
@@ -0,0 +1,258 @@
+"""Rate-limited scheduling of LLM calls.
+
+Every completion an AI player asks for goes through the process-wide
+scheduler, which keeps each provider within its budgets:
+
+- requests per minute and tokens per minute, as token buckets that refill
+  continuously (a call's tokens are estimated from its prompt plus the
+  completion limit)
+- a cap on requests in flight at once
+
+Calls waiting for budget are queued per game and served round-robin
+across games, so one busy simulation can't starve the others. Calls that
+fail with a rate-limit or overload status (429, 5xx) are retried with
+jittered exponential backoff; the pooled SDK clients (app.ai.clients) don't
+retry on their own. Queue depth, wait times and retry counts are kept per
+provider (GET /api/ai/scheduler).
+
+Usage:
+    with for_game(state.id):
+        text = await get_scheduler().call(OPENAI, estimate, lambda: client_call())
+"""
+import asyncio
+import contextvars
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Iterator, Optional, TypeVar
+
+from app.config import get_settings
+
+
+T = TypeVar("T")
+
+# HTTP statuses worth retrying (Anthropic reports overload as 529)
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504, 529})
+
+# Game the current task is deciding for (used to queue its calls fairly)
+_current_game: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("ai_game", default=None)
+
+
+@contextmanager
+def for_game(game_id: str) -> Iterator[None]:
+    """Attribute the LLM calls made inside the block to a game."""
+    token = _current_game.set(game_id)
+    try:
+        yield
+    finally:
+        _current_game.reset(token)
+
+
+def estimate_tokens(*prompts: str, completion_tokens: int = 300) -> int:
+    """Rough token count of a call: ~4 characters per prompt token plus the completion limit."""
+    return sum(len(p) for p in prompts) // 4 + completion_tokens
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Tell whether an SDK error is a rate limit or transient overload."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(error, "code", None)  # google.api_core errors
+    return isinstance(status, int) and status in RETRY_STATUSES
+
+
+class _TokenBucket:
+    """Budget per minute that refills continuously."""
+
+    __slots__ = ("capacity", "level", "rate", "updated")
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available (0 if it already is)."""
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+
+class _Waiter:
+    __slots__ = ("future", "tokens", "queued_at")
+
+    def __init__(self, future: asyncio.Future, tokens: int):
+        self.future = future
+        self.tokens = tokens
+        self.queued_at = time.monotonic()
+
+
+class ProviderLimiter:
+    """Request/token budgets and fair queueing for one provider."""
+
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int, max_concurrent: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self._requests = _TokenBucket(requests_per_minute)
+        self._tokens = _TokenBucket(tokens_per_minute)
+        self._queues: OrderedDict[Optional[str], deque[_Waiter]] = OrderedDict()
+        self._in_flight = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Metrics
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    async def acquire(self, game_id: Optional[str], tokens: int) -> None:
+        """Wait for this game's turn and for budget for one call."""
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), tokens)
+        self._queues.setdefault(game_id, deque()).append(waiter)
+        self._pump()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release()  # Granted just as we were cancelled
+            else:
+                self._discard(game_id, waiter)
+            raise
+        waited = time.monotonic() - waiter.queued_at
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def release(self) -> None:
+        """Free the concurrency slot of a finished call."""
+        self._in_flight -= 1
+        self._pump()
+
+    def _discard(self, game_id: Optional[str], waiter: _Waiter) -> None:
+        queue = self._queues.get(game_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[game_id]
+
+    def _pump(self) -> None:
+        """Grant waiting calls, round-robin by game, while budget lasts."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        self._requests.refill(now)
+        self._tokens.refill(now)
+        while self._queues and self._in_flight < self.max_concurrent:
+            game_id, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            if waiter.future.done():  # Cancelled while queued
+                queue.popleft()
+                if not queue:
+                    del self._queues[game_id]
+                continue
+            delay = max(self._requests.wait_time(1), self._tokens.wait_time(waiter.tokens))
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._pump)
+                return
+            self._requests.level -= 1
+            self._tokens.level -= min(waiter.tokens, self._tokens.capacity)
+            self._in_flight += 1
+            queue.popleft()
+            # Rotate: this game goes to the back of the line
+            del self._queues[game_id]
+            if queue:
+                self._queues[game_id] = queue
+            waiter.future.set_result(None)
+
+    def metrics(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "in_flight": self._in_flight,
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "average_wait": self.total_wait / self.calls if self.calls else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class AIScheduler:
+    """Per-provider rate limiting, fair queueing and retries for LLM calls."""
+
+    def __init__(
+        self,
+        max_retries: Optional[int] = None,
+        retry_base_delay: Optional[float] = None,
+        retry_max_delay: Optional[float] = None,
+    ):
+        settings = get_settings()
+        self.max_retries = settings.ai_max_retries if max_retries is None else max_retries
+        self.retry_base_delay = settings.ai_retry_base_delay if retry_base_delay is None else retry_base_delay
+        self.retry_max_delay = settings.ai_retry_max_delay if retry_max_delay is None else retry_max_delay
+        self._limiters: dict[str, ProviderLimiter] = {}
+
+    def limiter(self, provider: str) -> ProviderLimiter:
+        """Get a provider's limiter (created from settings on first use)."""
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            settings = get_settings()
+            limiter = self._limiters[provider] = ProviderLimiter(
+                provider,
+                settings.ai_requests_per_minute.get(provider, 60),
+                settings.ai_tokens_per_minute.get(provider, 100_000),
+                settings.ai_max_concurrent_requests.get(provider, 8),
+            )
+        return limiter
+
+    async def call(self, provider: str, tokens: int, request: Callable[[], Awaitable[T]]) -> T:
+        """Run an API request within the provider's budgets, retrying rate limits.
+
+        Args:
+            provider: Provider name (app.ai.clients.OPENAI, ...)
+            tokens: Estimated tokens the request uses (see estimate_tokens)
+            request: Makes the request; called again for each retry
+        """
+        limiter = self.limiter(provider)
+        game_id = _current_game.get()
+        attempt = 0
+        while True:
+            await limiter.acquire(game_id, tokens)
+            limiter.calls += 1
+            try:
+                return await request()
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    limiter.failures += 1
+                    raise
+            finally:
+                limiter.release()
+            limiter.retries += 1
+            delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt)
+            await asyncio.sleep(random.uniform(0, delay))  # Full jitter
+            attempt += 1
+
+    def metrics(self) -> dict[str, dict]:
+        """Queue depth, wait times and retry counts per provider."""
+        return {name: limiter.metrics() for name, limiter in self._limiters.items()}
+
+
+_scheduler: Optional[AIScheduler] = None
+
+
+def get_scheduler() -> AIScheduler:
+    """Get the process-wide scheduler (created on first use)."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = AIScheduler()
+    return _scheduler
@@ -0,0 +1,152 @@
+"""Delta encoding of game state for WebSocket broadcasts.
+
+Clients that connect with `?protocol=delta` receive a full snapshot once and
+then RFC 6902 JSON Patch operations against the previous revision, each
+tagged with a sequence number.
+"""
+from typing import Any, Optional
+
+from app.models.schemas import GameState
+
+
+# Fields that never change after a game is created; only sent in snapshots
+STATIC_FIELDS = frozenset({"cards"})
+
+# Lists that only ever grow; only their new entries are dumped and sent
+APPEND_ONLY_FIELDS = ("action_log", "combat_log")
+
+
+def _escape(key: str) -> str:
+    """Escape a key for use in a JSON Pointer (RFC 6901)."""
+    return key.replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def diff(old: Any, new: Any, path: str = "") -> list[dict]:
+    """Compute JSON Patch operations that turn `old` into `new`.
+
+    Both values must be JSON-compatible (dicts, lists, scalars).
+    """
+    ops: list[dict] = []
+    _diff(old, new, path, ops)
+    return ops
+
+
+def _diff(old: Any, new: Any, path: str, ops: list[dict]) -> None:
+    if old is new:
+        return
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in new.items():
+            child = f"{path}/{_escape(key)}"
+            if key not in old:
+                ops.append({"op": "add", "path": child, "value": value})
+            else:
+                _diff(old[key], value, child, ops)
+        return
+
+    if isinstance(old, list) and isinstance(new, list):
+        common = min(len(old), len(new))
+        for i in range(common):
+            _diff(old[i], new[i], f"{path}/{i}", ops)
+        # Remove from the end so indexes stay valid
+        for i in range(len(old) - 1, common - 1, -1):
+            ops.append({"op": "remove", "path": f"{path}/{i}"})
+        for value in new[common:]:
+            ops.append({"op": "add", "path": f"{path}/-", "value": value})
+        return
+
+    if type(old) is not type(new) or old != new:
+        ops.append({"op": "replace", "path": path, "value": new})
+
+
+def apply_patch(doc: Any, ops: list[dict]) -> Any:
+    """Apply JSON Patch operations (add/remove/replace) to a document in place.
+
+    Returns the patched document (a new object if the root was replaced).
+    """
+    for op in ops:
+        path = op["path"]
+        if path == "":
+            if op["op"] == "remove":
+                doc = None
+            else:
+                doc = op["value"]
+            continue
+
+        tokens = [_unescape(t) for t in path.split("/")[1:]]
+        parent = doc
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+        last = tokens[-1]
+
+        if isinstance(parent, list):
+            if op["op"] == "add":
+                if last == "-":
+                    parent.append(op["value"])
+                else:
+                    parent.insert(int(last), op["value"])
+            elif op["op"] == "remove":
+                del parent[int(last)]
+            else:
+                parent[int(last)] = op["value"]
+        else:
+            if op["op"] == "remove":
+                del parent[last]
+            else:
+                parent[last] = op["value"]
+    return doc
+
+
+class StateDeltaTracker:
+    """Tracks the last broadcast revision of one game's state.
+
+    Static fields are left out of the baseline entirely, and append-only
+    logs are tracked by length, so each update only dumps what can change.
+    """
+
+    _EXCLUDE = set(STATIC_FIELDS) | set(APPEND_ONLY_FIELDS)
+
+    def __init__(self):
+        self.seq = 0
+        self._baseline: Optional[dict] = None
+        self._log_lengths: dict[str, int] = {}
+
+    def update(self, state: GameState) -> Optional[list[dict]]:
+        """Advance to the given state, bumping seq if it changed.
+
+        Returns:
+            The patch from the previous revision (empty if nothing changed),
+            or None if there was no previous revision to diff against.
+        """
+        current = state.model_dump(mode="json", exclude=self._EXCLUDE)
+        previous, self._baseline = self._baseline, current
+        lengths = self._log_lengths
+        if previous is None:
+            for field in APPEND_ONLY_FIELDS:
+                lengths[field] = len(getattr(state, field))
+            self.seq += 1
+            return None
+
+        ops = diff(previous, current)
+        for field in APPEND_ONLY_FIELDS:
+            entries = getattr(state, field)
+            seen = lengths.get(field, 0)
+            if len(entries) < seen:
+                ops.append({"op": "replace", "path": f"/{field}",
+                            "value": [e.model_dump(mode="json") for e in entries]})
+            else:
+                ops.extend(
+                    {"op": "add", "path": f"/{field}/-", "value": e.model_dump(mode="json")}
+                    for e in entries[seen:]
+                )
+            lengths[field] = len(entries)
+        if ops:
+            self.seq += 1
+        return ops
@@ -0,0 +1,232 @@
+"""Background simulation jobs.
+
+A job runs an AI-only game (the same loop as POST /simulation/{game_id}/run)
+on the server's event loop, detached from the request that submitted it.
+Clients poll or subscribe for progress, cancel it, and fetch the result
+once it has finished.
+
+Jobs whose players all fall back to SimpleAI are CPU-bound; jobs with at
+least one LLM-backed player spend most of their time waiting on API calls.
+Each kind has its own concurrency limit, so a batch of slow LLM games can't
+starve quick local ones and vice versa. Jobs past their limit wait queued.
+
+All jobs run on the event loop, the thread the game routes and WebSockets
+use too, so game state needs no locking. The CPU limit caps how many local
+games are interleaved; it isn't a worker pool: jobs yield to other requests
+after every step but don't run in parallel. Bulk AI-vs-AI
+runs that need every core belong in POST /simulation/batch, which plays
+headless games on the process pool.
+"""
+import asyncio
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from app.config import get_settings
+from app.models.schemas import PlayerType, SimulationJob, SimulationJobKind, SimulationJobStatus
+from app.game.engine import GameEngine
+from app.game.state import get_game, get_winner
+
+
+# Finished jobs kept for polling before the oldest are forgotten
+MAX_FINISHED_JOBS = 1000
+
+FINISHED_STATUSES = frozenset({
+    SimulationJobStatus.COMPLETED,
+    SimulationJobStatus.CANCELLED,
+    SimulationJobStatus.FAILED,
+})
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are already waiting to run."""
+
+
+class JobManager:
+    """Runs simulation jobs with separate CPU and LLM concurrency limits."""
+
+    def __init__(
+        self,
+        cpu_workers: Optional[int] = None,
+        llm_workers: Optional[int] = None,
+        max_queued: Optional[int] = None,
+    ):
+        settings = get_settings()
+        self._limits = {
+            SimulationJobKind.CPU: asyncio.Semaphore(cpu_workers or settings.simulation_cpu_jobs),
+            SimulationJobKind.LLM: asyncio.Semaphore(llm_workers or settings.simulation_llm_jobs),
+        }
+        self.max_queued = max_queued or settings.simulation_job_queue_size
+        self._jobs: OrderedDict[str, SimulationJob] = OrderedDict()
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._changed: dict[str, asyncio.Condition] = {}
+
+    # ============ Submitting ============
+
+    def classify(self, game_id: str) -> SimulationJobKind:
+        """Tell whether a game's AI players call an LLM or run locally."""
+        from app.ai.manager import AIManager, SimpleAIPlayer
+
+        state = get_game(game_id)
+        if not state:
+            raise ValueError("Game not found")
+        ai_manager = AIManager()
+        for player in state.players:
+            if player.player_type == PlayerType.HUMAN:
+                continue
+            if not isinstance(ai_manager.get_ai_player(player.player_type), SimpleAIPlayer):
+                return SimulationJobKind.LLM
+        return SimulationJobKind.CPU
+
+    def submit(self, game_id: str, max_steps: int = 1000) -> SimulationJob:
+        """Queue a simulation of an existing game.
+
+        Raises:
+            ValueError: If the game doesn't exist or already has an active job
+            JobQueueFull: If max_queued jobs are already waiting
+        """
+        kind = self.classify(game_id)
+        active = [job for job in self._jobs.values() if job.status not in FINISHED_STATUSES]
+        if any(job.game_id == game_id for job in active):
+            raise ValueError("Game already has an active simulation job")
+        if sum(job.status == SimulationJobStatus.QUEUED for job in active) >= self.max_queued:
+            raise JobQueueFull("Too many simulation jobs queued")
+
+        job = SimulationJob(
+            id=str(uuid.uuid4()),
+            game_id=game_id,
+            kind=kind,
+            max_steps=max_steps,
+            created_at=datetime.now().isoformat(),
+        )
+        self._jobs[job.id] = job
+        self._changed[job.id] = asyncio.Condition()
+        self._tasks[job.id] = asyncio.create_task(self._run(job))
+        return job
+
+    # ============ Queries ============
+
+    def get(self, job_id: str) -> Optional[SimulationJob]:
+        """Get a job by ID."""
+        return self._jobs.get(job_id)
+
+    def list(self) -> list[SimulationJob]:
+        """All known jobs, oldest first."""
+        return list(self._jobs.values())
+
+    async def watch(self, job_id: str) -> AsyncIterator[SimulationJob]:
+        """Yield the job now and after every change, until it finishes.
+
+        Slow consumers skip intermediate updates rather than queueing them.
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise ValueError("Job not found")
+        changed = self._changed[job_id]
+        while True:
+            yield job.model_copy()
+            if job.status in FINISHED_STATUSES:
+                return
+            seen = job.revision
+            async with changed:
+                await changed.wait_for(lambda: job.revision != seen)
+
+    # ============ Control ============
+
+    def cancel(self, job_id: str) -> SimulationJob:
+        """Cancel a queued or running job (a no-op once it has finished)."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise ValueError("Job not found")
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+        return job
+
+    async def shutdown(self) -> None:
+        """Cancel every unfinished job and wait for them to stop."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ============ Running ============
+
+    async def _update(self, job: SimulationJob, **changes) -> None:
+        for field, value in changes.items():
+            setattr(job, field, value)
+        job.revision += 1
+        changed = self._changed[job.id]
+        async with changed:
+            changed.notify_all()
+
+    async def _run(self, job: SimulationJob) -> None:
+        from app.ai.manager import AIManager
+
+        try:
+            async with self._limits[job.kind]:
+                await self._update(
+                    job, status=SimulationJobStatus.RUNNING, started_at=datetime.now().isoformat()
+                )
+                engine = GameEngine(job.game_id)
+                ai_manager = AIManager()
+
+                steps = 0
+                while not engine.is_game_over() and steps < job.max_steps:
+                    current_player = engine.state.players[engine.state.current_player_idx]
+                    action, _ = await ai_manager.get_ai_action(engine.state, current_player)
+                    if action:
+                        engine.perform_action(action)
+                    steps += 1
+                    await self._update(job, steps=steps, round=engine.state.current_round)
+                    # SimpleAI never awaits anything, so let other requests in
+                    await asyncio.sleep(0)
+
+                winner = get_winner(engine.state)
+                await self._update(
+                    job,
+                    status=SimulationJobStatus.COMPLETED,
+                    finished_at=datetime.now().isoformat(),
+                    result={
+                        "status": "completed" if engine.is_game_over() else "max_steps_reached",
+                        "steps": steps,
+                        "winner": winner.model_dump(mode="json") if winner else None,
+                    },
+                )
+        except asyncio.CancelledError:
+            await self._update(
+                job, status=SimulationJobStatus.CANCELLED, finished_at=datetime.now().isoformat()
+            )
+        except Exception as e:
+            await self._update(
+                job, status=SimulationJobStatus.FAILED, finished_at=datetime.now().isoformat(), error=str(e)
+            )
+        finally:
+            self._tasks.pop(job.id, None)
+            self._forget_finished()
+
+    def _forget_finished(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED_STATUSES]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+            self._changed.pop(job_id, None)
+
+
+_job_manager: Optional[JobManager] = None
+
+
+def get_job_manager() -> JobManager:
+    """Get the process-wide job manager (created on first use)."""
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = JobManager()
+    return _job_manager
+
+
+async def shutdown_job_manager() -> None:
+    """Cancel all running jobs (call on application shutdown)."""
+    global _job_manager
+    manager, _job_manager = _job_manager, None
+    if manager is not None:
+        await manager.shutdown()
@@ -0,0 +1,141 @@
+"""Dry-run ("what-if") evaluation of actions.
+
+An action is performed on a fork of the game (GameState.fork()), so the
+stored game, its logs and its history are left untouched, and the result is
+reported as a JSON Patch against the current state plus prestige changes.
+
+The fork gets a fresh random seed first: previewing an attack must not
+reveal the dice the live game would roll. For combats (attacks, and defends
+against a pending attack) every outcome is played out as well, with the
+dice forced to a roll that produces it and its exact probability attached.
+An attack on a human defender waits for their response; its outcomes assume
+they defend with every soldier and no cards (the DEFEND default).
+"""
+import random
+from typing import Optional
+
+from app.models.schemas import (
+    Action, ActionPreview, ActionType, CardEffect, CombatOutcome, CombatResult, GameState
+)
+from app.api.delta import STATIC_FIELDS, diff
+from app.game.odds import roll_distribution
+from app.game.engine import GameEngine
+from app.game.history import forced_rolls
+
+
+def preview_action(state: GameState, action: Action) -> ActionPreview:
+    """Work out what an action would do without committing it.
+
+    Args:
+        state: Current game state (not modified)
+        action: Action to try
+    """
+    before = _dump(state)
+    fork = _reseeded_fork(state)
+    success, message, result = GameEngine(state.id, fork).perform_action(action)
+    fork.rng_seed = state.rng_seed
+
+    preview = ActionPreview(
+        success=success,
+        message=message,
+        diff=diff(before, _dump(fork)),
+        prestige_changes=_prestige_changes(state, fork),
+        combat_result=result,
+    )
+    if success and action.action_type in (ActionType.ATTACK, ActionType.DEFEND):
+        preview.outcomes = _combat_outcomes(state, before, action, fork, result)
+    return preview
+
+
+def _combat_outcomes(
+    state: GameState,
+    before: dict,
+    action: Action,
+    fork: GameState,
+    result: Optional[CombatResult],
+) -> Optional[list[CombatOutcome]]:
+    """Play out every way the combat started by an action can end."""
+    if result is None:
+        pending = fork.pending_combat
+        if pending is None:
+            return None
+        # Awaiting a human defender: sample their default response for the odds
+        base = fork
+        resolve = Action(action_type=ActionType.DEFEND, player_id=pending.defender_id)
+        _, _, result = GameEngine(state.id, _reseeded_fork(base)).perform_action(resolve)
+        if result is None:
+            return None
+    else:
+        base, resolve = state, action
+
+    outcomes = []
+    for attacker_won, (probability, rolls) in _outcome_rolls(result).items():
+        outcome_state = base.fork()
+        with forced_rolls(outcome_state, rolls):
+            _, _, outcome = GameEngine(state.id, outcome_state).perform_action(resolve)
+        outcomes.append(CombatOutcome(
+            attacker_won=attacker_won,
+            probability=probability,
+            attacker_losses=outcome.attacker_losses,
+            defender_losses=outcome.defender_losses,
+            prestige_changes=_prestige_changes(state, outcome_state),
+            diff=diff(before, _dump(outcome_state)),
+        ))
+    return outcomes
+
+
+def _outcome_rolls(result: CombatResult) -> dict[bool, tuple[float, list[int]]]:
+    """Probability of each combat outcome, and dice rolls that produce it.
+
+    Everything but the dice is fixed once a combat starts, so the strength
+    bonuses are read off a sampled result.
+
+    Returns:
+        attacker_won -> (probability, 2d6 rolls in the order resolve_combat
+        makes them); outcomes that can't happen are left out
+    """
+    has_defender = result.defender_id is not None
+    attacker_excalibur = CardEffect.EXCALIBUR in result.attacker_effects
+    defender_excalibur = has_defender and CardEffect.EXCALIBUR in result.defender_effects
+    attacker_halved = has_defender and CardEffect.POISONED_ARROWS in result.defender_effects
+    defender_halved = CardEffect.POISONED_ARROWS in result.attacker_effects
+
+    attacker_bonus = result.attacker_strength - result.attacker_roll
+    defender_bonus = result.defender_strength - result.defender_roll
+
+    outcomes: dict[bool, tuple[float, list[int]]] = {}
+    for attacker_roll, p_attacker in roll_distribution(attacker_excalibur, attacker_halved).items():
+        for defender_roll, p_defender in roll_distribution(defender_excalibur, defender_halved).items():
+            # Defender wins ties
+            attacker_won = attacker_roll + attacker_bonus > defender_roll + defender_bonus
+            probability, rolls = outcomes.get(attacker_won, (0.0, None))
+            if rolls is None:
+                rolls = (_raw_rolls(attacker_roll, attacker_excalibur, attacker_halved)
+                         + _raw_rolls(defender_roll, defender_excalibur, defender_halved))
+            outcomes[attacker_won] = (probability + p_attacker * p_defender, rolls)
+    return outcomes
+
+
+def _raw_rolls(final: int, excalibur: bool, halved: bool) -> list[int]:
+    """2d6 rolls that come out as the given final roll."""
+    raw = final * 2 if halved else final
+    return [raw, raw] if excalibur else [raw]
+
+
+def _reseeded_fork(state: GameState) -> GameState:
+    fork = state.fork()
+    fork.rng_seed = random.getrandbits(63)
+    return fork
+
+
+def _dump(state: GameState) -> dict:
+    return state.model_dump(mode="json", exclude=set(STATIC_FIELDS))
+
+
+def _prestige_changes(before: GameState, after: GameState) -> dict[str, int]:
+    """Prestige gained per player (players whose prestige didn't change are left out)."""
+    changes = {}
+    for old, new in zip(before.players, after.players):
+        if new.prestige != old.prestige:
+            changes[old.id] = new.prestige - old.prestige
+    return changes
@@ -1,12 +1,15 @@
 """REST API routes for the game."""
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from typing import Optional
 
 from app.models.schemas import (
     CreateGameRequest, CreateGameResponse,
     PerformActionRequest, PerformActionResponse,
     GetValidActionsRequest, GetValidActionsResponse,
-    GameState, Action, SimulationConfig
+    GameState, Action, ActionType, ActionPreview,
+    SimulationConfig, SimulationBatchRequest, SimulationJob
 )
 from app.game.state import (
     create_game, get_game, list_games, delete_game,
@@ -21,7 +24,7 @@ router = APIRouter()
 async def create_new_game(request: CreateGameRequest):
     """Create a new game with the specified player configurations."""
     try:
-        state = create_game(request.player_configs)
+        state = create_game(request.player_configs, seed=request.seed)
         return CreateGameResponse(game_id=state.id, state=state)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -110,18 +113,34 @@ async def process_income(game_id: str):
 
 
 @router.get("/games/{game_id}/valid-actions/{player_id}", response_model=GetValidActionsResponse)
-async def get_valid_actions(game_id: str, player_id: str):
-    """Get valid actions for a player."""
+async def get_valid_actions(
+    game_id: str, player_id: str, types: Optional[list[ActionType]] = Query(default=None)
+):
+    """Get valid actions for a player, optionally only of the given types."""
     state = get_game(game_id)
     if not state:
         raise HTTPException(status_code=404, detail="Game not found")
     
     engine = GameEngine(game_id)
-    actions = engine.get_valid_actions(player_id)
+    if types:
+        actions = list(engine.iter_valid_actions(player_id, types))
+    else:
+        actions = engine.get_valid_actions(player_id)
     
     return GetValidActionsResponse(actions=actions)
 
 
+@router.get("/games/{game_id}/valid-actions/{player_id}/{action_type}")
+async def has_valid_action(game_id: str, player_id: str, action_type: ActionType):
+    """Check whether a player can take an action of a type (e.g. "can I attack?")."""
+    state = get_game(game_id)
+    if not state:
+        raise HTTPException(status_code=404, detail="Game not found")
+    
+    engine = GameEngine(game_id)
+    return {"action_type": action_type, "available": engine.has_valid_action(player_id, action_type)}
+
+
 @router.post("/games/{game_id}/action", response_model=PerformActionResponse)
 async def perform_action(game_id: str, action: Action):
     """Perform a game action."""
@@ -140,6 +159,61 @@ async def perform_action(game_id: str, action: Action):
     )
 
 
+@router.post("/games/{game_id}/simulate-action", response_model=ActionPreview)
+async def simulate_action(game_id: str, action: Action):
+    """Dry-run an action: what it would change, without committing or logging it.
+
+    Attacks (and defends) also get every possible combat outcome with its
+    probability (see app.api.preview).
+    """
+    from app.api.preview import preview_action
+    
+    state = get_game(game_id)
+    if not state:
+        raise HTTPException(status_code=404, detail="Game not found")
+    
+    return preview_action(state, action)
+
+
+@router.get("/games/{game_id}/action-codes/{player_id}")
+async def get_action_codes(game_id: str, player_id: str):
+    """Get a player's legal actions as integer codes (see app.game.action_codec)."""
+    from app.game.action_codec import codec_for, iter_codes
+    
+    state = get_game(game_id)
+    if not state:
+        raise HTTPException(status_code=404, detail="Game not found")
+    
+    engine = GameEngine(game_id)
+    codec = codec_for(state)
+    return {"size": codec.size, "codes": list(iter_codes(codec.legal_mask(engine, player_id)))}
+
+
+@router.post("/games/{game_id}/action-codes/{player_id}/{code}", response_model=PerformActionResponse)
+async def perform_action_code(game_id: str, player_id: str, code: int):
+    """Perform the action with the given integer code."""
+    from app.game.action_codec import codec_for
+    
+    state = get_game(game_id)
+    if not state:
+        raise HTTPException(status_code=404, detail="Game not found")
+    
+    try:
+        action = codec_for(state).decode(code, player_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    engine = GameEngine(game_id)
+    success, message, combat_result = engine.perform_action(action)
+    
+    return PerformActionResponse(
+        success=success,
+        message=message,
+        state=engine.state,
+        combat_result=combat_result,
+    )
+
+
 @router.get("/games/{game_id}/prestige")
 async def get_prestige(game_id: str):
     """Get current prestige scores for all players."""
@@ -169,13 +243,50 @@ async def get_game_winner(game_id: str):
     }
 
 
+@router.get("/games/{game_id}/history")
+async def get_game_history(
+    game_id: str,
+    seq: Optional[int] = None,
+    round_num: Optional[int] = None,
+    player_idx: int = 0,
+):
+    """Rebuild a game's state from its event history.
+    
+    With seq, returns the state right after that event; with round_num,
+    the state at the start of that round's turn for player_idx. Without
+    either, returns the latest recorded state.
+    """
+    from app.game.history import rebuild_game
+    try:
+        # File parsing and replay: keep them off the event loop
+        state = await run_in_threadpool(
+            rebuild_game, game_id, seq=seq, round_num=round_num, player_idx=player_idx
+        )
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"state": state}
+
+
+@router.post("/games/{game_id}/recover")
+async def recover_game_endpoint(game_id: str):
+    """Restore a game that is missing from the store from its event history."""
+    from app.game.history import recover_game
+    if get_game(game_id):
+        raise HTTPException(status_code=400, detail="Game is already loaded")
+    try:
+        state = await run_in_threadpool(recover_game, game_id)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"status": "recovered", "state": state}
+
+
 # ============ AI Simulation Endpoints ============
 
 @router.post("/simulation/create")
 async def create_simulation(config: SimulationConfig):
     """Create an AI-only simulation game."""
     try:
-        state = create_game(config.player_configs)
+        state = create_game(config.player_configs, seed=config.seed)
         
         return {
             "game_id": state.id,
@@ -186,6 +297,30 @@ async def create_simulation(config: SimulationConfig):
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.post("/simulation/batch")
+async def run_simulation_batch(request: SimulationBatchRequest):
+    """Play a batch of headless AI-vs-AI games across worker processes.
+    
+    Streams one SimulationResult per line (NDJSON) as each game finishes.
+    """
+    from app.game.simulation import resolve_policies, stream_batch
+    
+    if not 4 <= len(request.policies) <= 6:
+        raise HTTPException(status_code=400, detail="Game requires 4-6 players")
+    try:
+        resolve_policies(request.policies)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    async def lines():
+        async for result in stream_batch(
+            request.n_games, request.policies, request.seed, request.max_steps
+        ):
+            yield result.model_dump_json() + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @router.post("/simulation/{game_id}/step")
 async def simulation_step(game_id: str):
     """Execute one turn in a simulation."""
@@ -207,10 +342,8 @@ async def simulation_step(game_id: str):
     
     # Have AI decide and perform action
     try:
-        # Get valid actions from engine
-        valid_actions = engine.get_valid_actions(current_player.id)
-        
-        if not valid_actions:
+        # Only need to know whether any action exists; the AI gets the full list
+        if next(engine.iter_valid_actions(current_player.id), None) is None:
             return {"status": "no_action", "state": state, "decision_log": None}
         
         # Use AI manager to get appropriate AI player (falls back to SimpleAI if no API key)
@@ -264,3 +397,72 @@ async def run_full_simulation(game_id: str, max_steps: int = 1000):
         "winner": get_winner(engine.state).model_dump() if get_winner(engine.state) else None,
     }
 
+
+
+# ============ Simulation Job Endpoints ============
+
+@router.post("/simulation/{game_id}/jobs", response_model=SimulationJob)
+async def submit_simulation_job(game_id: str, max_steps: int = 1000):
+    """Queue a full simulation to run in the background."""
+    from app.api.jobs import get_job_manager, JobQueueFull
+    
+    if not get_game(game_id):
+        raise HTTPException(status_code=404, detail="Game not found")
+    try:
+        return get_job_manager().submit(game_id, max_steps)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.get("/simulation/jobs", response_model=list[SimulationJob])
+async def list_simulation_jobs():
+    """List queued, running and recently finished simulation jobs."""
+    from app.api.jobs import get_job_manager
+    return get_job_manager().list()
+
+
+@router.get("/simulation/jobs/{job_id}", response_model=SimulationJob)
+async def get_simulation_job(job_id: str):
+    """Get a simulation job's status and progress."""
+    from app.api.jobs import get_job_manager
+    
+    job = get_job_manager().get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/simulation/jobs/{job_id}/result")
+async def get_simulation_job_result(job_id: str):
+    """Get a finished simulation job's result."""
+    from app.api.jobs import get_job_manager
+    from app.models.schemas import SimulationJobStatus
+    
+    job = get_job_manager().get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status != SimulationJobStatus.COMPLETED:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status.value}")
+    return job.result
+
+
+@router.delete("/simulation/jobs/{job_id}", response_model=SimulationJob)
+async def cancel_simulation_job(job_id: str):
+    """Cancel a queued or running simulation job."""
+    from app.api.jobs import get_job_manager
+    
+    try:
+        return get_job_manager().cancel(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+# ============ AI Endpoints ============
+
+@router.get("/ai/scheduler")
+async def get_ai_scheduler_metrics():
+    """Queue depth, wait times and retries of LLM calls, per provider."""
+    from app.ai.scheduler import get_scheduler
+    return get_scheduler().metrics()
@@ -1,72 +1,243 @@
 """WebSocket handlers for real-time game updates."""
 import asyncio
 import json
-from typing import Dict, Set
+from collections import deque
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Set
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
+from app.config import get_settings
 from app.game.state import get_game
 from app.game.engine import GameEngine
 from app.ai.manager import AIManager
+from app.models.schemas import GameState
+from app.api.delta import StateDeltaTracker
 
 router = APIRouter()
 
 
+def encode_message(message: dict, state: Optional[GameState] = None, key: str = "state") -> str:
+    """Encode a message once for every recipient.
+    
+    The state (if any) is serialized with pydantic's JSON encoder and
+    spliced in under `key`, skipping the intermediate dict.
+    """
+    text = json.dumps(message)
+    if state is None:
+        return text
+    separator = ", " if message else ""
+    return f'{text[:-1]}{separator}"{key}": {state.model_dump_json()}}}'
+
+
+class _Connection:
+    """Outgoing frame queue of one WebSocket, drained by its own sender task."""
+    
+    def __init__(self, websocket: WebSocket, protocol: str):
+        self.websocket = websocket
+        self.protocol = protocol
+        # (text, superseded_by_later_state) pairs waiting to be sent
+        self.frames: deque[tuple[str, bool]] = deque()
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.dropped = 0
+        self.task: Optional[asyncio.Task] = None
+
+
 class ConnectionManager:
-    """Manages WebSocket connections for games."""
+    """Manages WebSocket connections for games.
     
-    def __init__(self):
+    Each connection uses one of two protocols for state updates:
+    - "full": every state-bearing message carries the whole state
+    - "delta": a snapshot ({"type": ..., "seq", "data"}) on connect or on
+      request, then messages carry {"seq", "patch"} with JSON Patch ops
+      against the previous revision. A client that sees a seq gap should
+      send {"type": "get_state"} to resync.
+    
+    Messages are encoded once per broadcast and queued per connection;
+    each connection has a sender task, so a slow client never holds up
+    the game loop or other clients. Once a queue reaches the high-water
+    mark, full clients drop their queued state frames (each is superseded
+    by the newer one) and delta clients have their backlog replaced by a
+    fresh snapshot.
+    """
+    
+    def __init__(self, high_water: Optional[int] = None):
         # game_id -> set of connected websockets
         self.active_connections: Dict[str, Set[WebSocket]] = {}
+        # websocket -> send queue and protocol
+        self.connections: Dict[WebSocket, _Connection] = {}
+        # game_id -> revision tracker (only while delta clients are connected)
+        self.trackers: Dict[str, StateDeltaTracker] = {}
+        self.high_water = high_water or get_settings().ws_send_queue_size
     
-    async def connect(self, websocket: WebSocket, game_id: str):
+    async def connect(self, websocket: WebSocket, game_id: str, protocol: str = "full"):
         """Accept a new connection for a game."""
         await websocket.accept()
         if game_id not in self.active_connections:
             self.active_connections[game_id] = set()
         self.active_connections[game_id].add(websocket)
+        conn = _Connection(websocket, protocol)
+        conn.task = asyncio.create_task(self._sender(game_id, conn))
+        self.connections[websocket] = conn
     
     def disconnect(self, websocket: WebSocket, game_id: str):
         """Remove a connection."""
+        conn = self.connections.pop(websocket, None)
+        if conn is not None and conn.task is not asyncio.current_task():
+            conn.task.cancel()
         if game_id in self.active_connections:
             self.active_connections[game_id].discard(websocket)
             if not self.active_connections[game_id]:
                 del self.active_connections[game_id]
+        if not self._connections(game_id, "delta"):
+            self.trackers.pop(game_id, None)
+    
+    async def close(self, websocket: WebSocket, game_id: str, timeout: float = 5.0):
+        """Wait for a connection's queued frames to go out, then remove it."""
+        conn = self.connections.get(websocket)
+        if conn is not None:
+            try:
+                await asyncio.wait_for(conn.idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.disconnect(websocket, game_id)
+    
+    def _connections(self, game_id: str, protocol: str) -> list[_Connection]:
+        return [
+            conn for ws in self.active_connections.get(game_id, ())
+            if (conn := self.connections.get(ws)) is not None and conn.protocol == protocol
+        ]
+    
+    # ============ Queues ============
+    
+    def _push(self, conn: _Connection, text: str, supersedable: bool = False):
+        """Queue a frame, dropping superseded state frames past the high-water mark."""
+        if supersedable and len(conn.frames) >= self.high_water:
+            kept = deque(frame for frame in conn.frames if not frame[1])
+            conn.dropped += len(conn.frames) - len(kept)
+            conn.frames = kept
+        conn.frames.append((text, supersedable))
+        conn.idle.clear()
+        conn.wakeup.set()
+    
+    def _push_delta(self, conn: _Connection, text: str, snapshot: Callable[[], str]):
+        """Queue a patch, or resync with a snapshot if the client has fallen behind."""
+        if len(conn.frames) < self.high_water:
+            self._push(conn, text)
+            return
+        # Patches can't be skipped, so the backlog is replaced as a whole
+        conn.dropped += len(conn.frames)
+        conn.frames.clear()
+        self._push(conn, snapshot())
+    
+    async def _sender(self, game_id: str, conn: _Connection):
+        """Send a connection's queued frames in order."""
+        try:
+            while True:
+                while not conn.frames:
+                    conn.idle.set()
+                    conn.wakeup.clear()
+                    await conn.wakeup.wait()
+                text, _ = conn.frames.popleft()
+                await conn.websocket.send_text(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.disconnect(conn.websocket, game_id)
+    
+    # ============ Sending ============
+    
+    async def send(self, websocket: WebSocket, message: dict):
+        """Queue a message for one connection."""
+        conn = self.connections.get(websocket)
+        if conn is not None:
+            self._push(conn, json.dumps(message))
     
     async def broadcast(self, game_id: str, message: dict):
         """Broadcast a message to all connections for a game."""
-        if game_id in self.active_connections:
-            message_text = json.dumps(message)
-            disconnected = set()
-            for connection in self.active_connections[game_id]:
-                try:
-                    await connection.send_text(message_text)
-                except Exception:
-                    disconnected.add(connection)
-            
-            # Clean up disconnected
-            for conn in disconnected:
-                self.active_connections[game_id].discard(conn)
+        text = json.dumps(message)
+        for ws in self.active_connections.get(game_id, ()):
+            self._push(self.connections[ws], text)
+    
+    def _snapshot_text(self, tracker: StateDeltaTracker, state: GameState,
+                       message_type: str = "state") -> str:
+        return encode_message({"type": message_type, "seq": tracker.seq}, state, key="data")
+    
+    async def send_snapshot(self, websocket: WebSocket, game_id: str, state: GameState,
+                            message_type: str = "state"):
+        """Send the full state to one connection.
+        
+        For delta clients the snapshot is tagged with the current revision;
+        if the state moved on since the last broadcast, the other delta
+        clients get that change first so everyone shares one revision line.
+        """
+        conn = self.connections.get(websocket)
+        if conn is None:
+            return
+        if conn.protocol != "delta":
+            self._push(conn, encode_message({"type": message_type}, state, key="data"))
+            return
+        
+        tracker = self.trackers.setdefault(game_id, StateDeltaTracker())
+        patch = tracker.update(state)
+        if patch:
+            text = json.dumps({"type": "state_delta", "seq": tracker.seq, "patch": patch})
+            snapshot = lru_cache(maxsize=1)(lambda: self._snapshot_text(tracker, state))
+            for other in self._connections(game_id, "delta"):
+                if other is not conn:
+                    self._push_delta(other, text, snapshot)
+        self._push(conn, self._snapshot_text(tracker, state, message_type))
+    
+    async def broadcast_state(self, game_id: str, message: dict, state: GameState):
+        """Broadcast a message that carries the game state.
+        
+        Full clients get the message with "state" added; delta clients get
+        it with "seq" and "patch" instead.
+        """
+        full = self._connections(game_id, "full")
+        delta = self._connections(game_id, "delta")
+        
+        if full:
+            text = encode_message(message, state)
+            for conn in full:
+                self._push(conn, text, supersedable=True)
+        
+        if delta:
+            tracker = self.trackers.setdefault(game_id, StateDeltaTracker())
+            patch = tracker.update(state)
+            if patch is None:
+                # No revision to diff against: send the whole state
+                text = encode_message({**message, "seq": tracker.seq}, state)
+            else:
+                text = json.dumps({**message, "seq": tracker.seq, "patch": patch})
+            snapshot = lru_cache(maxsize=1)(lambda: self._snapshot_text(tracker, state))
+            for conn in delta:
+                self._push_delta(conn, text, snapshot)
 
 
 manager = ConnectionManager()
 
 
+PROTOCOLS = ("full", "delta")
+
+
 @router.websocket("/game/{game_id}")
-async def game_websocket(websocket: WebSocket, game_id: str):
+async def game_websocket(websocket: WebSocket, game_id: str, protocol: str = "full"):
     """WebSocket endpoint for game updates."""
     state = get_game(game_id)
     if not state:
         await websocket.close(code=4004, reason="Game not found")
         return
+    if protocol not in PROTOCOLS:
+        await websocket.close(code=4000, reason=f"Unknown protocol: {protocol}")
+        return
     
-    await manager.connect(websocket, game_id)
+    await manager.connect(websocket, game_id, protocol)
     
     try:
         # Send initial state
-        await websocket.send_json({
-            "type": "state",
-            "data": state.model_dump(),
-        })
+        await manager.send_snapshot(websocket, game_id, state)
         
         while True:
             # Wait for messages from client
@@ -74,15 +245,12 @@ async def game_websocket(websocket: WebSocket, game_id: str):
             message = json.loads(data)
             
             if message.get("type") == "ping":
-                await websocket.send_json({"type": "pong"})
+                await manager.send(websocket, {"type": "pong"})
             
             elif message.get("type") == "get_state":
                 state = get_game(game_id)
                 if state:
-                    await websocket.send_json({
-                        "type": "state",
-                        "data": state.model_dump(),
-                    })
+                    await manager.send_snapshot(websocket, game_id, state)
             
             elif message.get("type") == "action":
                 # Handle game action
@@ -94,36 +262,37 @@ async def game_websocket(websocket: WebSocket, game_id: str):
                 success, msg, combat = engine.perform_action(action)
                 
                 # Broadcast update to all connected clients
-                await manager.broadcast(game_id, {
+                await manager.broadcast_state(game_id, {
                     "type": "action_result",
                     "success": success,
                     "message": msg,
-                    "state": engine.state.model_dump(),
-                    "combat": combat.model_dump() if combat else None,
-                })
+                    "combat": combat.model_dump(mode="json") if combat else None,
+                }, engine.state)
     
     except WebSocketDisconnect:
         manager.disconnect(websocket, game_id)
 
 
 @router.websocket("/simulation/{game_id}")
-async def simulation_websocket(websocket: WebSocket, game_id: str, speed_ms: int = 1000):
+async def simulation_websocket(
+    websocket: WebSocket, game_id: str, speed_ms: int = 1000, protocol: str = "full"
+):
     """WebSocket endpoint for watching AI simulations."""
     state = get_game(game_id)
     if not state:
         await websocket.close(code=4004, reason="Game not found")
         return
+    if protocol not in PROTOCOLS:
+        await websocket.close(code=4000, reason=f"Unknown protocol: {protocol}")
+        return
     
-    await manager.connect(websocket, game_id)
+    await manager.connect(websocket, game_id, protocol)
     engine = GameEngine(game_id)
     ai_manager = AIManager()
     
     try:
         # Send initial state
-        await websocket.send_json({
-            "type": "simulation_start",
-            "data": state.model_dump(),
-        })
+        await manager.send_snapshot(websocket, game_id, state, message_type="simulation_start")
         
         running = True
         
@@ -141,6 +310,8 @@ async def simulation_websocket(websocket: WebSocket, game_id: str, speed_ms: int
                     continue
                 elif message.get("type") == "speed":
                     speed_ms = message.get("value", speed_ms)
+                elif message.get("type") == "get_state":
+                    await manager.send_snapshot(websocket, game_id, engine.state)
             except asyncio.TimeoutError:
                 pass
             
@@ -148,21 +319,20 @@ async def simulation_websocket(websocket: WebSocket, game_id: str, speed_ms: int
             current_player = engine.state.players[engine.state.current_player_idx]
             
             try:
-                action = await ai_manager.get_ai_action(engine.state, current_player)
+                action, _ = await ai_manager.get_ai_action(engine.state, current_player)
                 if action:
                     success, msg, combat = engine.perform_action(action)
                     
                     # Broadcast the action
-                    await manager.broadcast(game_id, {
+                    await manager.broadcast_state(game_id, {
                         "type": "simulation_step",
                         "player": current_player.name,
-                        "action": action.model_dump(),
+                        "action": action.model_dump(mode="json"),
                         "message": msg,
-                        "state": engine.state.model_dump(),
-                        "combat": combat.model_dump() if combat else None,
-                    })
+                        "combat": combat.model_dump(mode="json") if combat else None,
+                    }, engine.state)
             except Exception as e:
-                await websocket.send_json({
+                await manager.send(websocket, {
                     "type": "error",
                     "message": str(e),
                 })
@@ -174,16 +344,37 @@ async def simulation_websocket(websocket: WebSocket, game_id: str, speed_ms: int
         from app.game.state import get_winner, calculate_prestige
         winner = get_winner(engine.state)
         
-        await manager.broadcast(game_id, {
+        await manager.broadcast_state(game_id, {
             "type": "simulation_end",
-            "state": engine.state.model_dump(),
-            "winner": winner.model_dump() if winner else None,
+            "winner": winner.model_dump(mode="json") if winner else None,
             "prestige": calculate_prestige(engine.state),
-        })
+        }, engine.state)
+        await manager.close(websocket, game_id)
     
     except WebSocketDisconnect:
         manager.disconnect(websocket, game_id)
 
 
-
-
+@router.websocket("/simulation/jobs/{job_id}")
+async def simulation_job_websocket(websocket: WebSocket, job_id: str):
+    """WebSocket endpoint for following a background simulation job.
+    
+    Sends a job_progress message for each update, ending with the finished job.
+    """
+    from app.api.jobs import get_job_manager
+    
+    job_manager = get_job_manager()
+    if not job_manager.get(job_id):
+        await websocket.close(code=4004, reason="Job not found")
+        return
+    
+    await websocket.accept()
+    try:
+        async for job in job_manager.watch(job_id):
+            await websocket.send_text(json.dumps({
+                "type": "job_progress",
+                "job": job.model_dump(mode="json"),
+            }))
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
@@ -14,9 +14,36 @@ class Settings(BaseSettings):
     google_api_key: str = ""
     xai_api_key: str = ""
     
+    # LLM provider clients (app.ai.clients), shared for the app's lifetime
+    # Base URL overrides point a provider at a local stand-in ("" = default)
+    openai_base_url: str = ""
+    anthropic_base_url: str = ""
+    xai_base_url: str = ""
+    ai_max_connections_per_provider: int = 20  # Keep-alive HTTP connections per provider
+    ai_keepalive_expiry: float = 30.0          # Seconds an idle connection is kept open
+    
+    # LLM call scheduling (app.ai.scheduler): budgets per provider
+    ai_requests_per_minute: dict[str, int] = {"openai": 500, "anthropic": 50, "gemini": 360, "xai": 60}
+    ai_tokens_per_minute: dict[str, int] = {"openai": 30000, "anthropic": 40000, "gemini": 120000, "xai": 100000}
+    ai_max_concurrent_requests: dict[str, int] = {"openai": 8, "anthropic": 8, "gemini": 8, "xai": 8}
+    ai_max_retries: int = 5            # Retries of a rate-limited or overloaded call
+    ai_retry_base_delay: float = 1.0   # Backoff before the first retry (doubles each time, jittered)
+    ai_retry_max_delay: float = 30.0   # Longest backoff between retries
+    # LLM players plan their whole turn in one call and replay the steps,
+    # asking again only when a step becomes invalid (app.ai.base.plan_turn)
+    ai_turn_planning: bool = True
+    
     # Database
     database_url: str = "sqlite:///./kingdom.db"
     
+    # Game Storage
+    # - "memory": games are kept in process memory only (lost on restart)
+    # - "sqlite": games are persisted to database_url with batched writes
+    game_storage_backend: Literal["memory", "sqlite"] = "memory"
+    game_storage_flush_interval: float = 1.0  # Max seconds a save stays buffered
+    game_storage_batch_size: int = 50         # Dirty games that trigger a flush
+    game_storage_cache_size: int = 256        # Clean games kept in memory
+    
     # Server
     host: str = "0.0.0.0"
     port: int = 8000
@@ -28,6 +55,43 @@ class Settings(BaseSettings):
     # Game Logging
     game_logging_enabled: bool = True
     game_logs_directory: str = "./game_logs"
+    # Log file format:
+    # - "json": single JSON document rewritten on every event
+    # - "jsonl": one JSON line per event, appended with buffered writes
+    #   (convert with `python -m app.game.log_convert`)
+    game_log_format: Literal["json", "jsonl"] = "json"
+    game_log_flush_bytes: int = 64 * 1024   # Buffered bytes that trigger a write
+    game_log_flush_interval: float = 1.0    # Max seconds an event stays buffered
+    # Log writes happen on a background thread ("thread") or inline ("sync")
+    game_log_writer: Literal["thread", "sync"] = "thread"
+    game_log_queue_size: int = 10000        # Events queued for the writer thread
+    # What to do when the writer queue is full:
+    # - "block": wait for the writer to catch up
+    # - "drop_debug": drop AI prompt/response events, block for the rest
+    # - "spill": write overflow events to a temporary file, drained in order
+    game_log_backpressure: Literal["block", "drop_debug", "spill"] = "block"
+    
+    # Event-sourced game history (for crash recovery and replays)
+    event_sourcing_enabled: bool = False
+    event_log_directory: str = "./game_events"
+    event_checkpoint_interval: int = 200  # Events between state checkpoints
+    
+    # WebSocket fan-out: frames queued per connection before a lagging
+    # client's stale state frames are dropped (or it is resynced)
+    ws_send_queue_size: int = 32
+    
+    # Headless batch simulations (app.game.simulation)
+    simulation_workers: int = 0  # Worker processes (0 = one per CPU)
+    
+    # Background simulation jobs (app.api.jobs)
+    simulation_cpu_jobs: int = 2          # Concurrent jobs with only local AI players
+    simulation_llm_jobs: int = 8          # Concurrent jobs with LLM players
+    simulation_job_queue_size: int = 100  # Jobs waiting to run before submits are refused
+    
+    # AI defenders (app.game.odds.best_defender_commitment): soldiers are
+    # committed to maximize holding_value * P(hold) - reserve_weight * losses
+    ai_defense_holding_value: float = 1000.0  # Worth of a holding, in soldiers
+    ai_defense_reserve_weight: float = 1.0    # Cost of each soldier lost
     
     # Game Settings
     # Starting town selection mode:
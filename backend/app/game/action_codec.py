@@ -0,0 +1,242 @@
+"""Fixed integer encoding of the whole action space.
+
+Every action a player could send maps to one stable integer code, so
+actions can be cached, logged, used as policy outputs or sent over the wire
+as small numbers. Codes are grouped by action type (in ActionType order);
+within a type, the code is a mixed-radix index over that type's parameters:
+
+    MOVE                    adjacent (source, target) pairs
+    RECRUIT, DRAW_CARD,
+    END_TURN                no parameters
+    BUILD_FORTIFICATION,
+    CLAIM_TOWN, FAKE_CLAIM  target town
+    RELOCATE_FORTIFICATION  (source town, target town) pairs
+    CLAIM_TITLE             target castle
+    ATTACK                  source holding (or none) x target x soldier bucket
+    DEFEND                  soldier bucket
+    PLAY_CARD               card x target holding (or none)
+
+Soldier counts are bucketed to multiples of 100, the granularity the engine
+resolves attacks at; None (the engine's default) is its own bucket. Cards
+are identified by their deck slot (`card_<n>`), so a codec is specific to a
+deck size. The acting player isn't part of the code. Combat card lists,
+edicts and target players/counties can't be encoded.
+
+Legality masks are ints with one bit per code, so they combine with & and |
+like the board masks in board.py.
+
+Usage:
+    codec = codec_for(state)
+    mask = codec.legal_mask(engine, player_id)
+    action = codec.decode(next(iter_codes(mask)), player_id)
+"""
+from functools import lru_cache
+from typing import Iterator, Optional
+
+from app.models.schemas import Action, ActionType, GamePhase, GameState, HoldingType
+from app.game.board import ADJACENCY, create_board, get_all_towns
+from app.game.cards import claim_target_error, is_claim_card
+
+
+# Largest soldier commitment that can be encoded (King's cap doubled by Big War, plus Adventurer)
+MAX_SOLDIERS = 5000
+ATTACK_BUCKETS = (None, *range(200, MAX_SOLDIERS + 1, 100))
+DEFEND_BUCKETS = (None, *range(0, MAX_SOLDIERS + 1, 100))
+
+# Action fields that are never part of a code; they must be left unset
+_UNENCODED_FIELDS = ("target_player_id", "edict", "target_county", "attack_cards", "defense_cards")
+
+
+def _bucket(soldiers: Optional[int], minimum: int) -> Optional[int]:
+    """Round a soldier count down to its bucket (None stays None)."""
+    if soldiers is None:
+        return None
+    return max(minimum, (soldiers // 100) * 100)
+
+
+class _Segment:
+    """The codes of one action type: a mixed-radix index over its parameter axes."""
+
+    __slots__ = ("action_type", "offset", "axes", "indexes", "fields", "size")
+
+    def __init__(self, action_type: ActionType, offset: int, axes: list[tuple[tuple[str, ...], list[tuple]]]):
+        self.action_type = action_type
+        self.offset = offset
+        self.axes = axes
+        self.indexes = [{value: i for i, value in enumerate(values)} for _, values in axes]
+        self.fields = frozenset(field for fields, _ in axes for field in fields)
+        size = 1
+        for _, values in axes:
+            size *= len(values)
+        self.size = size
+
+
+class ActionCodec:
+    """Encodes actions as integers in [0, size) and back."""
+
+    def __init__(self, n_cards: int):
+        """Build the code layout.
+
+        Args:
+            n_cards: Cards in the deck (card slots card_0 .. card_{n-1})
+        """
+        holdings = create_board()
+        ids = [h.id for h in holdings]
+        towns = get_all_towns()
+        castles = [h.id for h in holdings if h.holding_type != HoldingType.TOWN]
+        self.n_cards = n_cards
+        self.card_ids = [f"card_{n}" for n in range(n_cards)]
+
+        source_target = ("source_holding_id", "target_holding_id")
+        target = ("target_holding_id",)
+        single = lambda values: [(v,) for v in values]
+        axes_by_type: dict[ActionType, list] = {
+            ActionType.MOVE: [(source_target, [(s, t) for s in ids for t in ADJACENCY.get(s, [])])],
+            ActionType.RECRUIT: [],
+            ActionType.BUILD_FORTIFICATION: [(target, single(towns))],
+            ActionType.RELOCATE_FORTIFICATION: [
+                (source_target, [(s, t) for s in towns for t in towns if s != t])
+            ],
+            ActionType.CLAIM_TITLE: [(target, single(castles))],
+            ActionType.CLAIM_TOWN: [(target, single(towns))],
+            ActionType.ATTACK: [
+                (("source_holding_id",), single([None, *ids])),
+                (target, single(ids)),
+                (("soldiers_count",), single(ATTACK_BUCKETS)),
+            ],
+            ActionType.DEFEND: [(("soldiers_count",), single(DEFEND_BUCKETS))],
+            ActionType.PLAY_CARD: [
+                (("card_id",), single(self.card_ids)),
+                (target, single([None, *ids])),
+            ],
+            ActionType.DRAW_CARD: [],
+            ActionType.FAKE_CLAIM: [(target, single(towns))],
+            ActionType.END_TURN: [],
+        }
+
+        self.segments: dict[ActionType, _Segment] = {}
+        offset = 0
+        for action_type in ActionType:
+            segment = _Segment(action_type, offset, axes_by_type[action_type])
+            self.segments[action_type] = segment
+            offset += segment.size
+        self.size = offset
+        self._ordered = list(self.segments.values())
+
+    # ============ Encoding ============
+
+    def encode(self, action: Action) -> int:
+        """Get an action's code.
+
+        Raises:
+            ValueError: If the action has parameters outside the action space
+        """
+        segment = self.segments[action.action_type]
+        for field in _UNENCODED_FIELDS:
+            if getattr(action, field):
+                raise ValueError(f"Actions with {field} can't be encoded")
+        fields = segment.fields
+        for field in ("source_holding_id", "target_holding_id", "soldiers_count", "card_id"):
+            if field not in fields and getattr(action, field) is not None:
+                raise ValueError(f"{action.action_type.value} actions don't take {field}")
+
+        soldiers = action.soldiers_count
+        if action.action_type == ActionType.ATTACK:
+            soldiers = _bucket(soldiers, 200)
+        elif action.action_type == ActionType.DEFEND:
+            soldiers = _bucket(soldiers, 0)
+
+        code = 0
+        for (axis_fields, values), index in zip(segment.axes, segment.indexes):
+            key = tuple(soldiers if f == "soldiers_count" else getattr(action, f) for f in axis_fields)
+            i = index.get(key)
+            if i is None:
+                raise ValueError(f"Can't encode {action.action_type.value} with {dict(zip(axis_fields, key))}")
+            code = code * len(values) + i
+        return segment.offset + code
+
+    def decode(self, code: int, player_id: str) -> Action:
+        """Get the action for a code, taken by the given player.
+
+        Raises:
+            ValueError: If the code is out of range
+        """
+        if not 0 <= code < self.size:
+            raise ValueError(f"Action code {code} out of range (0-{self.size - 1})")
+        segment = self._segment_for(code)
+        rest = code - segment.offset
+        params: dict = {}
+        for axis_fields, values in reversed(segment.axes):
+            rest, i = divmod(rest, len(values))
+            params.update(zip(axis_fields, values[i]))
+        return Action(action_type=segment.action_type, player_id=player_id, **params)
+
+    def _segment_for(self, code: int) -> _Segment:
+        for segment in reversed(self._ordered):
+            if code >= segment.offset and segment.size:
+                return segment
+        raise ValueError(f"Action code {code} out of range")
+
+    # ============ Legality ============
+
+    def legal_mask(self, engine, player_id: str) -> int:
+        """Bitmask of every code the player could take right now.
+
+        Built from engine.get_valid_actions(), widened to what the engine
+        accepts: every affordable soldier bucket for attacks, every valid
+        target for claim cards, and defending during the player's combat.
+        """
+        state: GameState = engine.state
+        player = state.get_player(player_id)
+        if not player:
+            return 0
+
+        mask = 0
+        for action in engine.get_valid_actions(player_id):
+            if action.action_type == ActionType.ATTACK:
+                mask |= self._span(action, ATTACK_BUCKETS, player.soldiers)
+            elif action.action_type == ActionType.PLAY_CARD and _is_claim(state, action.card_id):
+                card = state.cards[action.card_id]
+                for holding in state.holdings:
+                    if claim_target_error(card, holding) is None:
+                        mask |= 1 << self.encode(action.model_copy(update={"target_holding_id": holding.id}))
+            else:
+                mask |= 1 << self.encode(action)
+
+        pending = state.pending_combat
+        if state.phase == GamePhase.COMBAT and pending and pending.defender_id == player_id:
+            defend = Action(action_type=ActionType.DEFEND, player_id=player_id)
+            mask |= self._span(defend, DEFEND_BUCKETS, player.soldiers)
+        return mask
+
+    def _span(self, action: Action, buckets: tuple, soldiers: int) -> int:
+        """Bits for an action at the default and every bucket up to soldiers."""
+        mask = 0
+        for bucket in buckets:
+            if bucket is None or bucket <= soldiers:
+                mask |= 1 << self.encode(action.model_copy(update={"soldiers_count": bucket}))
+        return mask
+
+
+def _is_claim(state: GameState, card_id: Optional[str]) -> bool:
+    card = state.cards.get(card_id)
+    return card is not None and is_claim_card(card)
+
+
+def iter_codes(mask: int) -> Iterator[int]:
+    """Yield the codes set in a legality mask, in increasing order."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+@lru_cache(maxsize=8)
+def get_action_codec(n_cards: int) -> ActionCodec:
+    """Get the (shared, read-only) codec for a deck size."""
+    return ActionCodec(n_cards)
+
+
+def codec_for(state: GameState) -> ActionCodec:
+    """Get the codec for a game's deck."""
+    return get_action_codec(len(state.cards))
@@ -1,5 +1,6 @@
 """Board topology and holding definitions."""
 import json
+from functools import lru_cache
 from pathlib import Path
 from app.models.schemas import Holding, HoldingType
 
@@ -403,3 +404,55 @@ CAPITOLS: dict[str, str] = {
 def get_capitol_for_county(county: str) -> str | None:
     """Get the capitol town ID for a county."""
     return CAPITOLS.get(county)
+
+
+# ============ Bitmasks ============
+
+class BoardMasks:
+    """Holding sets as integer bitmasks.
+    
+    Each holding gets one bit, in create_board() order, so "which holdings"
+    questions become ANDs and ORs and "how many" becomes int.bit_count().
+    """
+    
+    __slots__ = ("ids", "bit", "towns", "county_towns", "duchy_towns", "adjacent")
+    
+    def __init__(self):
+        self.ids: tuple[str, ...] = tuple(h.id for h in create_board())
+        self.bit: dict[str, int] = {hid: 1 << i for i, hid in enumerate(self.ids)}
+        self.towns = self.mask(get_all_towns())
+        self.county_towns: dict[str, int] = {
+            county: self.mask(get_towns_in_county(county)) for county in CAPITOLS
+        }
+        self.duchy_towns: dict[str, int] = {
+            duchy: self.county_towns[first] | self.county_towns[second]
+            for duchy in ("XU", "QV")
+            for first, second in [get_counties_in_duchy(duchy)]
+        }
+        self.adjacent: dict[str, int] = {
+            hid: self.mask(get_adjacent_holdings(hid)) for hid in self.ids
+        }
+    
+    def mask(self, holding_ids) -> int:
+        """Bitmask of the given holding IDs."""
+        bit = self.bit
+        result = 0
+        for holding_id in holding_ids:
+            result |= bit[holding_id]
+        return result
+    
+    def holding_ids(self, mask: int) -> list[str]:
+        """Holding IDs in a bitmask, in board order."""
+        ids = self.ids
+        result = []
+        while mask:
+            low = mask & -mask
+            result.append(ids[low.bit_length() - 1])
+            mask ^= low
+        return result
+
+
+@lru_cache(maxsize=1)
+def get_board_masks() -> BoardMasks:
+    """Get the (shared, read-only) bitmask tables for the board."""
+    return BoardMasks()
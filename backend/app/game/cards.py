@@ -1,6 +1,7 @@
 """Card deck definitions and logic."""
 import random
-from app.models.schemas import Card, CardType, CardEffect
+from typing import Optional
+from app.models.schemas import Card, CardType, CardEffect, Holding, HoldingType
 from app.config import get_settings
 
 
@@ -117,10 +118,15 @@ def create_deck() -> list[Card]:
     return cards
 
 
-def shuffle_deck(cards: list[Card]) -> list[str]:
-    """Shuffle cards and return list of card IDs."""
+def shuffle_deck(cards: list[Card], rng: Optional[random.Random] = None) -> list[str]:
+    """Shuffle cards and return list of card IDs.
+    
+    Args:
+        cards: Cards to shuffle
+        rng: Random stream to use (defaults to the global random module)
+    """
     card_ids = [card.id for card in cards]
-    random.shuffle(card_ids)
+    (rng or random).shuffle(card_ids)
     return card_ids
 
 
@@ -150,3 +156,34 @@ def get_card_county(card: Card) -> str | None:
     elif card.effect == CardEffect.CLAIM_Q:
         return "Q"
     return None
+
+
+def claim_target_error(card: Card, holding: Holding) -> Optional[str]:
+    """Check whether a claim card can target a holding.
+    
+    Returns:
+        Why the card can't target it, or None if it can
+    """
+    effect = card.effect
+    if effect in [CardEffect.CLAIM_X, CardEffect.CLAIM_U, CardEffect.CLAIM_V, CardEffect.CLAIM_Q]:
+        required_county = get_card_county(card)
+        if holding.county != required_county:
+            return f"This claim only works in County {required_county}"
+        # County claim cards can ONLY target TOWNS, NOT castles
+        # To claim a castle, you must meet Count prerequisites (2 towns or fortified capitol)
+        if holding.holding_type != HoldingType.TOWN:
+            return "County claim cards only work on towns. To claim a castle, meet Count prerequisites."
+    
+    elif effect == CardEffect.DUCHY_CLAIM:
+        # Can claim any town or Duke+ title
+        if holding.holding_type not in [HoldingType.TOWN, HoldingType.DUCHY_CASTLE, HoldingType.KING_CASTLE]:
+            return "Invalid target for Duchy Claim"
+    
+    elif effect == CardEffect.ULTIMATE_CLAIM:
+        # Can claim anything - no restrictions
+        pass
+    
+    else:
+        return "Unknown claim type"
+    
+    return None
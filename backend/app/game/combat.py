@@ -1,25 +1,44 @@
 """Combat resolution system."""
 import random
-from typing import Optional
+from typing import Callable, Optional
 from app.models.schemas import (
     GameState, CombatResult, Action, ActionType, 
-    TitleType, HoldingType, CardEffect
+    TitleType, HoldingType, CardEffect, Holding, Player
 )
-from app.game.state import save_game
+from app.game.state import save_game, refresh_prestige
+from app.game.history import recorded_roll
 
 
-def roll_dice() -> int:
-    """Roll 2d6."""
-    return random.randint(1, 6) + random.randint(1, 6)
+def roll_dice(rng: Optional[random.Random] = None) -> int:
+    """Roll 2d6, using the given random stream (defaults to the global random module)."""
+    rng = rng or random
+    return rng.randint(1, 6) + rng.randint(1, 6)
 
 
-def roll_dice_with_excalibur() -> tuple[int, int]:
+def roll_dice_with_excalibur(roll: Callable[[], int] = roll_dice) -> tuple[int, int]:
     """Roll 2d6 twice (for Excalibur effect) and return both rolls."""
-    roll1 = roll_dice()
-    roll2 = roll_dice()
+    roll1 = roll()
+    roll2 = roll()
     return roll1, roll2
 
 
+# Card effects that apply to a combat they're selected for
+COMBAT_CARD_EFFECTS = frozenset({
+    CardEffect.EXCALIBUR, CardEffect.POISONED_ARROWS,
+    CardEffect.TALENTED_COMMANDER, CardEffect.DUEL,
+})
+
+
+def combat_card_effects(state: GameState, card_ids: list[str] | None) -> list[CardEffect]:
+    """Get the combat effects of the cards a side selected (other cards are ignored)."""
+    effects: list[CardEffect] = []
+    for card_id in card_ids or []:
+        card = state.cards.get(card_id)
+        if card and card.effect in COMBAT_CARD_EFFECTS:
+            effects.append(card.effect)
+    return effects
+
+
 def calculate_defense_bonus(state: GameState, holding_id: str, defender_id: str | None = None) -> int:
     """Calculate defense bonuses for a holding.
     
@@ -28,7 +47,7 @@ def calculate_defense_bonus(state: GameState, holding_id: str, defender_id: str
         holding_id: ID of the holding being defended
         defender_id: ID of the defending player (for player-specific fortification bonus)
     """
-    holding = next((h for h in state.holdings if h.id == holding_id), None)
+    holding = state.get_holding(holding_id)
     if not holding:
         return 0
     
@@ -71,7 +90,7 @@ def calculate_attack_bonus(state: GameState, source_holding_id: str | None, atta
     if not source_holding_id:
         return 0
     
-    holding = next((h for h in state.holdings if h.id == source_holding_id), None)
+    holding = state.get_holding(source_holding_id)
     if not holding:
         return 0
     
@@ -95,6 +114,39 @@ def calculate_attack_bonus(state: GameState, source_holding_id: str | None, atta
     return bonus
 
 
+def calculate_target_fortification_bonus(holding: Holding, attacker_id: str) -> int:
+    """Calculate the attacker's bonus from their own fortifications on the target."""
+    attacker_forts = holding.fortifications_by_player.get(attacker_id, 0)
+    bonus = 0
+    if attacker_forts >= 1:
+        bonus += 1
+    if attacker_forts >= 2:
+        bonus += 2  # Total +3 for 2 forts
+    return bonus
+
+
+def committed_defender_soldiers(defender: Player | None, attacker_soldiers: int,
+                                override: int | None = None) -> int:
+    """Get the soldiers a defender commits (matches the attacker unless overridden)."""
+    if not defender:
+        return 0
+    if override is not None:
+        return min(override, defender.soldiers)
+    return min(defender.soldiers, attacker_soldiers)
+
+
+def calculate_winner_losses(soldiers: int, effects: list[CardEffect]) -> int:
+    """Calculate the losses of the winning side of a combat.
+    
+    The winner keeps half its soldiers, rounded down to the nearest 100
+    (300 committed -> 100 remain), or loses none with Talented Commander.
+    """
+    if CardEffect.TALENTED_COMMANDER in effects:
+        return 0
+    remaining = (soldiers // 2 // 100) * 100
+    return soldiers - remaining
+
+
 def calculate_title_combat_bonus(state: GameState, player_id: str, holding_id: str, is_defending: bool) -> int:
     """Calculate title-based combat bonuses.
     
@@ -133,8 +185,8 @@ def resolve_combat(
     Returns:
         CombatResult with outcome
     """
-    attacker = next((p for p in state.players if p.id == attacker_id), None)
-    holding = next((h for h in state.holdings if h.id == target_holding_id), None)
+    attacker = state.get_player(attacker_id)
+    holding = state.get_holding(target_holding_id)
     
     if not attacker or not holding:
         raise ValueError("Invalid attacker or target")
@@ -147,34 +199,14 @@ def resolve_combat(
     
     # Get defender
     defender_id = holding.owner_id
-    defender = next((p for p in state.players if p.id == defender_id), None) if defender_id else None
+    defender = state.get_player(defender_id) if defender_id else None
     
     # Calculate defender's committed soldiers
-    if defender_soldiers_override is not None:
-        defender_soldiers = min(defender_soldiers_override, defender.soldiers if defender else 0)
-    elif defender:
-        defender_soldiers = min(defender.soldiers, attacker_soldiers)
-    else:
-        defender_soldiers = 0
+    defender_soldiers = committed_defender_soldiers(defender, attacker_soldiers, defender_soldiers_override)
     
     # Build card effects from selected cards
-    attacker_effects: list[CardEffect] = []
-    defender_effects: list[CardEffect] = []
-    
-    combat_card_effects = {CardEffect.EXCALIBUR, CardEffect.POISONED_ARROWS,
-                           CardEffect.TALENTED_COMMANDER, CardEffect.DUEL}
-    
-    if attacker_cards:
-        for card_id in attacker_cards:
-            card = state.cards.get(card_id)
-            if card and card.effect in combat_card_effects:
-                attacker_effects.append(card.effect)
-    
-    if defender_cards:
-        for card_id in defender_cards:
-            card = state.cards.get(card_id)
-            if card and card.effect in combat_card_effects:
-                defender_effects.append(card.effect)
+    attacker_effects = combat_card_effects(state, attacker_cards)
+    defender_effects = combat_card_effects(state, defender_cards)
     
     # Check for Duel effect (army-less fight)
     is_duel = CardEffect.DUEL in attacker_effects
@@ -182,18 +214,20 @@ def resolve_combat(
         attacker_soldiers = 0
         defender_soldiers = 0
     
-    # Roll dice with potential Excalibur effect
+    # Roll dice with potential Excalibur effect (rolls are recorded for replay)
+    rng = state.next_rng()
+    roll = lambda: recorded_roll(state, lambda: roll_dice(rng))
     if CardEffect.EXCALIBUR in attacker_effects:
-        roll1, roll2 = roll_dice_with_excalibur()
+        roll1, roll2 = roll_dice_with_excalibur(roll)
         attacker_roll = max(roll1, roll2)
     else:
-        attacker_roll = roll_dice()
+        attacker_roll = roll()
     
     if defender and CardEffect.EXCALIBUR in defender_effects:
-        roll1, roll2 = roll_dice_with_excalibur()
+        roll1, roll2 = roll_dice_with_excalibur(roll)
         defender_roll = max(roll1, roll2)
     else:
-        defender_roll = roll_dice()
+        defender_roll = roll()
     
     # Apply Poisoned Arrows effect (halve opponent's dice)
     if CardEffect.POISONED_ARROWS in attacker_effects:
@@ -207,11 +241,7 @@ def resolve_combat(
     
     # Add bonus from attacker's fortifications on the TARGET holding
     # (If attacker has forts on the town they're attacking, they get bonus)
-    attacker_forts_on_target = holding.fortifications_by_player.get(attacker_id, 0)
-    if attacker_forts_on_target >= 1:
-        atk_attack_bonus += 1
-    if attacker_forts_on_target >= 2:
-        atk_attack_bonus += 2  # Total +3 for 2 forts
+    atk_attack_bonus += calculate_target_fortification_bonus(holding, attacker_id)
     
     atk_title_bonus = calculate_title_combat_bonus(state, attacker_id, target_holding_id, is_defending=False)
     attacker_strength = attacker_roll + atk_soldiers_bonus + atk_attack_bonus + atk_title_bonus
@@ -230,29 +260,13 @@ def resolve_combat(
         if attacker_strength == defender_strength:
             attacker_won = False
     
-    # Calculate losses - winner keeps soldiers rounded DOWN to nearest 100
-    # Example: 300 committed, win -> remaining = 100 (half=150, round down to 100)
+    # Calculate losses - winner keeps half, loser loses all
     if attacker_won:
-        # Check for Talented Commander (no losses on victory)
-        if CardEffect.TALENTED_COMMANDER in attacker_effects:
-            attacker_losses = 0
-        else:
-            # Winner keeps half, rounded down to nearest 100
-            remaining = (attacker_soldiers // 2 // 100) * 100  # Half, then round down to 100
-            attacker_losses = attacker_soldiers - remaining
-        defender_losses = defender_soldiers  # Loser loses all
+        attacker_losses = calculate_winner_losses(attacker_soldiers, attacker_effects)
+        defender_losses = defender_soldiers
     else:
-        attacker_losses = attacker_soldiers  # Loser loses all
-        # Check for Talented Commander for defender
-        if defender and CardEffect.TALENTED_COMMANDER in defender_effects:
-            defender_losses = 0
-        else:
-            # Winner keeps half, rounded down to nearest 100
-            if defender:
-                remaining = (defender_soldiers // 2 // 100) * 100
-                defender_losses = defender_soldiers - remaining
-            else:
-                defender_losses = 0
+        attacker_losses = attacker_soldiers
+        defender_losses = calculate_winner_losses(defender_soldiers, defender_effects) if defender else 0
     
     result = CombatResult(
         attacker_id=attacker_id,
@@ -284,9 +298,9 @@ def resolve_combat(
 
 def apply_combat_result(state: GameState, result: CombatResult) -> GameState:
     """Apply combat result to game state."""
-    attacker = next((p for p in state.players if p.id == result.attacker_id), None)
-    defender = next((p for p in state.players if p.id == result.defender_id), None) if result.defender_id else None
-    holding = next((h for h in state.holdings if h.id == result.target_holding_id), None)
+    attacker = state.get_player(result.attacker_id)
+    defender = state.get_player(result.defender_id) if result.defender_id else None
+    holding = state.get_holding(result.target_holding_id)
     
     if not attacker or not holding:
         return state
@@ -311,7 +325,7 @@ def apply_combat_result(state: GameState, result: CombatResult) -> GameState:
             defender.holdings.remove(result.target_holding_id)
         
         # Add to attacker's holdings
-        holding.owner_id = result.attacker_id
+        state.set_holding_owner(holding, result.attacker_id)
         if result.target_holding_id not in attacker.holdings:
             attacker.holdings.append(result.target_holding_id)
         
@@ -358,7 +372,6 @@ def apply_combat_result(state: GameState, result: CombatResult) -> GameState:
             # Make attacker king
             attacker.is_king = True
             attacker.title = TitleType.KING
-            # Note: 6 VP for being king is calculated dynamically in calculate_prestige
         
         # BARON -> BANDIT demotion: If defender lost their last holding
         if defender and len(defender.holdings) == 0:
@@ -367,12 +380,14 @@ def apply_combat_result(state: GameState, result: CombatResult) -> GameState:
             defender.duchies = []
             defender.is_king = False
             defender.title = TitleType.BANDIT
+        
+        refresh_prestige(state, attacker, defender)
     
     # Remove all fortifications from the town after combat
     if holding.holding_type == HoldingType.TOWN and holding.fortification_count > 0:
         # Decrement each player's fortifications_placed count
         for player_id, fort_count in holding.fortifications_by_player.items():
-            player = next((p for p in state.players if p.id == player_id), None)
+            player = state.get_player(player_id)
             if player:
                 player.fortifications_placed = max(0, player.fortifications_placed - fort_count)
         
@@ -1,5 +1,7 @@
 """Core game engine - orchestrates game flow and action processing."""
-from typing import Optional
+import weakref
+from collections import OrderedDict
+from typing import Collection, Iterator, Optional
 from app.models.schemas import (
     GameState, Action, ActionType, GamePhase, TitleType,
     CombatResult, EdictType, HoldingType, CardType, CardEffect,
@@ -9,57 +11,158 @@ from app.game.state import (
     get_game, save_game, next_player_turn, apply_income,
     can_claim_count, can_claim_duke, can_claim_king,
     get_player_holdings, count_player_towns, calculate_prestige,
-    check_victory
+    check_victory, refresh_prestige, logger_for
 )
-from app.game.combat import resolve_combat, apply_combat_result
+from app.game.combat import resolve_combat, apply_combat_result, combat_card_effects
+from app.game.odds import best_defender_commitment, combat_odds
 from app.game.board import (
     get_adjacent_holdings, get_county_castle, get_duchy_castle,
-    get_towns_in_county, get_all_towns
+    get_towns_in_county, get_all_towns, get_board_masks
 )
-from app.game.cards import is_instant_card, is_bonus_card, is_claim_card, get_card_county
-from app.game.logger import get_logger
+from app.game.cards import (
+    is_instant_card, is_bonus_card, is_claim_card, get_card_county, claim_target_error
+)
+from app.game.history import record_command, recorded_shuffle, recorded_draw
+
+
+# Valid-action lists per game: game_id -> (state, revision, {player_id: actions}),
+# most recently used last. Only the latest revision of each game is kept;
+# a state's revision changes on every save, so entries never go stale. The
+# entry also holds a weak reference to the state object it was built for, so
+# another object stored under the same ID (a recreated, recovered or
+# reloaded game) never matches it, even at the same revision.
+VALID_ACTIONS_CACHE_GAMES = 256
+_valid_actions_cache: "OrderedDict[str, tuple[weakref.ref, int, dict[str, list[Action]]]]" = OrderedDict()
+
+
+def forget_valid_actions(game_id: str) -> None:
+    """Drop a game's cached valid actions (called when the game is deleted)."""
+    _valid_actions_cache.pop(game_id, None)
+
+
+ALL_ACTION_TYPES = frozenset(ActionType)
 
 
 class GameEngine:
     """Main game engine for processing actions and managing game flow."""
     
-    def __init__(self, game_id: str):
+    def __init__(self, game_id: str, state: Optional[GameState] = None):
+        """Initialize the engine.
+        
+        Args:
+            game_id: ID of the game to run
+            state: Run on this state instead of loading the game from the store
+                (used for replays and other detached copies)
+        """
         self.game_id = game_id
-        self._state: Optional[GameState] = None
+        self._pinned_state = state
+        self._state: Optional[GameState] = state
     
     @property
     def state(self) -> GameState:
         """Get current game state."""
         if self._state is None:
-            self._state = get_game(self.game_id)
+            self._state = self._pinned_state or get_game(self.game_id)
         if self._state is None:
             raise ValueError(f"Game {self.game_id} not found")
         return self._state
     
     def refresh_state(self) -> GameState:
         """Reload state from storage."""
-        self._state = get_game(self.game_id)
+        self._state = self._pinned_state or get_game(self.game_id)
         return self.state
     
+    def fork(self) -> "GameEngine":
+        """Get an engine running on a fork of the current state.
+        
+        Actions performed through it change neither the stored game nor its
+        logs or history (see GameState.fork()).
+        """
+        return GameEngine(self.game_id, self.state.fork())
+    
     def get_valid_actions(self, player_id: str) -> list[Action]:
-        """Get all valid actions for a player."""
+        """Get all valid actions for a player.
+        
+        Lists are cached until the state's next revision, so the returned
+        actions are shared: callers must copy an action before filling it in.
+        """
+        state = self.state
+        # Detached copies share their game's ID and revision, so never cache them
+        if state.is_detached:
+            return self._build_valid_actions(state, player_id)
+        
+        entry = _valid_actions_cache.get(state.id)
+        if entry is None or entry[0]() is not state or entry[1] != state.revision:
+            entry = (weakref.ref(state), state.revision, {})
+            _valid_actions_cache[state.id] = entry
+            if len(_valid_actions_cache) > VALID_ACTIONS_CACHE_GAMES:
+                _valid_actions_cache.popitem(last=False)
+        else:
+            _valid_actions_cache.move_to_end(state.id)
+        
+        by_player = entry[2]
+        actions = by_player.get(player_id)
+        if actions is None:
+            actions = by_player[player_id] = self._build_valid_actions(state, player_id)
+        return list(actions)
+    
+    def iter_valid_actions(
+        self, player_id: str, types: Optional[Collection[ActionType]] = None
+    ) -> Iterator[Action]:
+        """Yield a player's valid actions lazily, in get_valid_actions() order.
+        
+        Rules for action types that aren't asked for are never evaluated, and
+        stopping early skips the rest, so callers that only need a few actions
+        don't pay for the full list. The state must not change mid-iteration.
+        
+        Actions may come from the get_valid_actions() cache and are shared
+        the same way: treat them as read-only and copy one before filling it in.
+        
+        Args:
+            player_id: Player to enumerate actions for
+            types: Only yield these action types (default: all)
+        """
         state = self.state
-        player = next((p for p in state.players if p.id == player_id), None)
+        wanted = ALL_ACTION_TYPES if types is None else frozenset(types)
+        
+        # Reuse a full list already built for this revision
+        entry = None if state.is_detached else _valid_actions_cache.get(state.id)
+        if (entry is not None and entry[0]() is state and entry[1] == state.revision
+                and player_id in entry[2]):
+            for action in entry[2][player_id]:
+                if action.action_type in wanted:
+                    yield action
+            return
+        
+        yield from self._generate_actions(state, player_id, wanted)
+    
+    def has_valid_action(self, player_id: str, action_type: ActionType) -> bool:
+        """Check whether a player has at least one valid action of a type."""
+        return next(self.iter_valid_actions(player_id, (action_type,)), None) is not None
+    
+    def _build_valid_actions(self, state: GameState, player_id: str) -> list[Action]:
+        """Enumerate all valid actions for a player from scratch."""
+        return list(self._generate_actions(state, player_id, ALL_ACTION_TYPES))
+    
+    def _generate_actions(
+        self, state: GameState, player_id: str, wanted: frozenset[ActionType]
+    ) -> Iterator[Action]:
+        """Generate the valid actions of the wanted types."""
+        player = state.get_player(player_id)
         
         if not player:
-            return []
+            return
         
         # Check if it's this player's turn
         if state.current_player_idx >= len(state.players):
-            return []
+            return
         if state.players[state.current_player_idx].id != player_id:
-            return []
+            return
         
         if state.phase != GamePhase.PLAYER_TURN:
-            return []
+            return
         
-        actions = []
-        player_holdings = [h for h in state.holdings if h.owner_id == player_id]
+        player_holdings = state.holdings_owned_by(player_id)
         
         # Cards are now auto-drawn at the beginning of each turn
         # No manual draw action needed
@@ -67,151 +170,160 @@ class GameEngine:
         # All these actions are available (unlimited actions per turn)
         
         # Move - can move armies between adjacent holdings
-        for holding in player_holdings:
-            adjacent = get_adjacent_holdings(holding.id)
-            for adj_id in adjacent:
-                adj_holding = next((h for h in state.holdings if h.id == adj_id), None)
-                # Can move to own holdings
-                if adj_holding and adj_holding.owner_id == player_id:
-                    actions.append(Action(
-                        action_type=ActionType.MOVE,
-                        player_id=player_id,
-                        source_holding_id=holding.id,
-                        target_holding_id=adj_id,
-                    ))
+        if ActionType.MOVE in wanted:
+            masks = get_board_masks()
+            owned = state.owned_mask(player_id)
+            for holding in player_holdings:
+                # Skip holdings with no adjacent holding of the player's
+                if not masks.adjacent[holding.id] & owned:
+                    continue
+                for adj_id in get_adjacent_holdings(holding.id):
+                    # Can move to own holdings
+                    if masks.bit[adj_id] & owned:
+                        yield Action(
+                            action_type=ActionType.MOVE,
+                            player_id=player_id,
+                            source_holding_id=holding.id,
+                            target_holding_id=adj_id,
+                        )
         
         # Recruit - move soldiers from holdings to pool
-        if player_holdings:
-            actions.append(Action(
+        if ActionType.RECRUIT in wanted and player_holdings:
+            yield Action(
                 action_type=ActionType.RECRUIT,
                 player_id=player_id,
-            ))
+            )
         
-        # Build fortification (costs 10 gold, max 4 per player total, max 2 per player per town, max 3 per town)
-        if player.gold >= 10 and player.fortifications_placed < 4:
-            for holding in state.holdings:
-                if holding.holding_type == HoldingType.TOWN:
-                    if holding.fortification_count < 3:
-                        # Check max 2 per player on this town
-                        player_forts_here = holding.fortifications_by_player.get(player_id, 0)
-                        if player_forts_here < 2:
-                            actions.append(Action(
-                                action_type=ActionType.BUILD_FORTIFICATION,
-                                player_id=player_id,
-                                target_holding_id=holding.id,
-                            ))
+        # Towns that can take another of the player's fortifications
+        # (max 3 per town, max 2 per player per town)
+        if player.gold >= 10 and (ActionType.BUILD_FORTIFICATION in wanted
+                                  or ActionType.RELOCATE_FORTIFICATION in wanted):
+            fort_targets = [
+                holding.id for holding in state.holdings
+                if holding.holding_type == HoldingType.TOWN
+                and holding.fortification_count < 3
+                and holding.fortifications_by_player.get(player_id, 0) < 2
+            ]
+        else:
+            fort_targets = []
+        
+        # Build fortification (costs 10 gold, max 4 per player total)
+        if ActionType.BUILD_FORTIFICATION in wanted and player.fortifications_placed < 4:
+            for target_id in fort_targets:
+                yield Action(
+                    action_type=ActionType.BUILD_FORTIFICATION,
+                    player_id=player_id,
+                    target_holding_id=target_id,
+                )
         
         # Relocate fortification (costs 10 gold, available when player has at least one fortification)
-        if player.gold >= 10:
+        if ActionType.RELOCATE_FORTIFICATION in wanted and fort_targets:
             for source in state.holdings:
-                player_forts_here = source.fortifications_by_player.get(player_id, 0)
-                if player_forts_here > 0:
-                    for target in state.holdings:
-                        if target.id != source.id and target.holding_type == HoldingType.TOWN:
-                            if target.fortification_count < 3:
-                                target_player_forts = target.fortifications_by_player.get(player_id, 0)
-                                if target_player_forts < 2:
-                                    actions.append(Action(
-                                        action_type=ActionType.RELOCATE_FORTIFICATION,
-                                        player_id=player_id,
-                                        source_holding_id=source.id,
-                                        target_holding_id=target.id,
-                                    ))
+                if source.fortifications_by_player.get(player_id, 0) > 0:
+                    for target_id in fort_targets:
+                        if target_id != source.id:
+                            yield Action(
+                                action_type=ActionType.RELOCATE_FORTIFICATION,
+                                player_id=player_id,
+                                source_holding_id=source.id,
+                                target_holding_id=target_id,
+                            )
         
         # Claim titles
-        self._add_title_claim_actions(actions, player, state)
+        if ActionType.CLAIM_TITLE in wanted:
+            yield from self._iter_title_claim_actions(player, state)
         
         # Attack (need at least 200 soldiers, one war per turn)
-        if player.soldiers >= 200 and not state.war_fought_this_turn:
+        if ActionType.ATTACK in wanted and player.soldiers >= 200 and not state.war_fought_this_turn:
             if not state.enforce_peace_active:  # Enforce Peace card blocks wars
-                self._add_attack_actions(actions, player, state)
+                yield from self._iter_attack_actions(player, state)
         
         # Claim Town (10 gold to peacefully capture unowned town with valid claim)
-        if player.gold >= 10:
+        if ActionType.CLAIM_TOWN in wanted and player.gold >= 10:
             for holding in state.holdings:
                 if (holding.holding_type == HoldingType.TOWN and 
                     holding.owner_id is None and 
                     holding.id in player.claims):
-                    actions.append(Action(
+                    yield Action(
                         action_type=ActionType.CLAIM_TOWN,
                         player_id=player_id,
                         target_holding_id=holding.id,
-                    ))
+                    )
         
         # Fake Claim (costs 35 gold to fabricate a claim on a town only)
         # Cannot fabricate claims on County, Duchy, or King castles
-        if player.gold >= 35:
+        if ActionType.FAKE_CLAIM in wanted and player.gold >= 35:
             for holding in state.holdings:
                 # Can only fabricate claim on TOWNS, not castles
                 # Skip if player already owns this holding or already has a claim on it
                 if (holding.holding_type == HoldingType.TOWN 
                     and holding.owner_id != player_id 
                     and holding.id not in player.claims):
-                    actions.append(Action(
+                    yield Action(
                         action_type=ActionType.FAKE_CLAIM,
                         player_id=player_id,
                         target_holding_id=holding.id,
-                    ))
+                    )
         
         # Play cards from hand
-        for card_id in player.hand:
-            card = state.cards.get(card_id)
-            if card and not is_instant_card(card):  # Only non-instant cards can be played from hand
-                actions.append(Action(
-                    action_type=ActionType.PLAY_CARD,
-                    player_id=player_id,
-                    card_id=card_id,
-                ))
+        if ActionType.PLAY_CARD in wanted:
+            for card_id in player.hand:
+                card = state.cards.get(card_id)
+                if card and not is_instant_card(card):  # Only non-instant cards can be played from hand
+                    yield Action(
+                        action_type=ActionType.PLAY_CARD,
+                        player_id=player_id,
+                        card_id=card_id,
+                    )
         
         # End turn is always available
-        actions.append(Action(
-            action_type=ActionType.END_TURN,
-            player_id=player_id,
-        ))
-        
-        return actions
+        if ActionType.END_TURN in wanted:
+            yield Action(
+                action_type=ActionType.END_TURN,
+                player_id=player_id,
+            )
     
-    def _add_title_claim_actions(self, actions: list[Action], player, state: GameState):
-        """Add title claiming actions if prerequisites are met."""
+    def _iter_title_claim_actions(self, player, state: GameState) -> Iterator[Action]:
+        """Yield title claiming actions if prerequisites are met."""
         # Claim Count
         for county in ["X", "U", "V", "Q"]:
             if county not in player.counties and can_claim_count(state, player.id, county):
                 castle_id = get_county_castle(county)
-                castle = next((h for h in state.holdings if h.id == castle_id), None)
+                castle = state.get_holding(castle_id)
                 if castle and castle.owner_id is None:
                     if player.gold >= 25:
-                        actions.append(Action(
+                        yield Action(
                             action_type=ActionType.CLAIM_TITLE,
                             player_id=player.id,
                             target_holding_id=castle_id,
-                        ))
+                        )
         
         # Claim Duke
         for duchy in ["XU", "QV"]:
             if duchy not in player.duchies and can_claim_duke(state, player.id, duchy):
                 castle_id = get_duchy_castle(duchy)
-                castle = next((h for h in state.holdings if h.id == castle_id), None)
+                castle = state.get_holding(castle_id)
                 if castle and castle.owner_id is None:
                     if player.gold >= 50:
-                        actions.append(Action(
+                        yield Action(
                             action_type=ActionType.CLAIM_TITLE,
                             player_id=player.id,
                             target_holding_id=castle_id,
-                        ))
+                        )
         
         # Claim King
         if not player.is_king and can_claim_king(state, player.id):
-            king_castle = next((h for h in state.holdings if h.id == "king_castle"), None)
+            king_castle = state.get_holding("king_castle")
             if king_castle and king_castle.owner_id is None:
                 if player.gold >= 75:
-                    actions.append(Action(
+                    yield Action(
                         action_type=ActionType.CLAIM_TITLE,
                         player_id=player.id,
                         target_holding_id="king_castle",
-                    ))
+                    )
     
-    def _add_attack_actions(self, actions: list[Action], player, state: GameState):
-        """Add attack actions for holdings the player can attack.
+    def _iter_attack_actions(self, player, state: GameState) -> Iterator[Action]:
+        """Yield attack actions for holdings the player can attack.
         
         Attack requires a valid claim on the target territory.
         Player can attack ANY holding they have a claim on (not just adjacent).
@@ -221,63 +333,59 @@ class GameEngine:
         BANDITS: Can attack any town without claims, but cannot attack castles.
         Bandits have no holdings, so source_holding_id is None.
         """
-        player_holdings = [h.id for h in state.holdings if h.owner_id == player.id]
+        player_holdings = [h.id for h in state.holdings_owned_by(player.id)]
         added_targets = set()  # Track to avoid duplicates
+        masks = get_board_masks()
+        # Holdings owned by OTHER players (not unowned, not own) - the only attackable ones
+        foreign = state.occupied_mask() & ~state.owned_mask(player.id)
         
         # Special case: BANDITS can attack any town (no claims needed, no holdings needed)
         if player.title == TitleType.BANDIT:
-            for holding in state.holdings:
-                # Bandits can only attack TOWNS owned by other players
-                if (holding.holding_type == HoldingType.TOWN and 
-                    holding.owner_id is not None and 
-                    holding.owner_id != player.id):
-                    actions.append(Action(
-                        action_type=ActionType.ATTACK,
-                        player_id=player.id,
-                        source_holding_id=None,  # Bandits have no holdings
-                        target_holding_id=holding.id,
-                    ))
+            for holding_id in masks.holding_ids(foreign & masks.towns):
+                yield Action(
+                    action_type=ActionType.ATTACK,
+                    player_id=player.id,
+                    source_holding_id=None,  # Bandits have no holdings
+                    target_holding_id=holding_id,
+                )
             return  # Bandits use simplified attack logic
         
         # First, add attacks for adjacent holdings (if player has claim)
-        # Only attack holdings owned by OTHER players (not unowned, not own)
         for holding_id in player_holdings:
-            adjacent = get_adjacent_holdings(holding_id)
-            for adj_id in adjacent:
-                adj_holding = next((h for h in state.holdings if h.id == adj_id), None)
-                # Must be owned by another player (not unowned, not own)
-                if adj_holding and adj_holding.owner_id is not None and adj_holding.owner_id != player.id:
-                    has_claim = self._has_valid_claim(player, adj_holding)
-                    can_attack = self._can_attack_holding(player, adj_holding)
-                    if has_claim and can_attack and adj_id not in added_targets:
-                        actions.append(Action(
-                            action_type=ActionType.ATTACK,
-                            player_id=player.id,
-                            source_holding_id=holding_id,
-                            target_holding_id=adj_id,
-                        ))
-                        added_targets.add(adj_id)
+            if not masks.adjacent[holding_id] & foreign:
+                continue
+            for adj_id in get_adjacent_holdings(holding_id):
+                if not masks.bit[adj_id] & foreign or adj_id in added_targets:
+                    continue
+                adj_holding = state.get_holding(adj_id)
+                if self._has_valid_claim(player, adj_holding) and self._can_attack_holding(player, adj_holding):
+                    yield Action(
+                        action_type=ActionType.ATTACK,
+                        player_id=player.id,
+                        source_holding_id=holding_id,
+                        target_holding_id=adj_id,
+                    )
+                    added_targets.add(adj_id)
         
         # Second, add attacks for ANY holding the player has a direct claim on
         # But only if the holding is OWNED by someone else (can't attack unowned)
         for claim_id in player.claims:
             if claim_id in added_targets:
                 continue
-            claim_holding = next((h for h in state.holdings if h.id == claim_id), None)
-            # Must be owned by another player (not unowned, not own)
-            if claim_holding and claim_holding.owner_id is not None and claim_holding.owner_id != player.id:
+            claim_holding = state.get_holding(claim_id)
+            if claim_holding and masks.bit[claim_id] & foreign:
                 # Check vassal protection
                 if not self._can_attack_holding(player, claim_holding):
                     continue
                 # Use any player holding as source (they're "projecting power")
                 source_holding = player_holdings[0] if player_holdings else None
                 if source_holding:
-                    actions.append(Action(
+                    yield Action(
                         action_type=ActionType.ATTACK,
                         player_id=player.id,
                         source_holding_id=source_holding,
                         target_holding_id=claim_id,
-                    ))
+                    )
                     added_targets.add(claim_id)
     
     def _has_valid_claim(self, player, holding) -> bool:
@@ -291,9 +399,6 @@ class GameEngine:
         
         IMPORTANT: Without any claims, you cannot attack anyone!
         """
-        # #region agent log
-        import json; open('/home/ilya/dev/kingdom/.cursor/debug.log', 'a').write(json.dumps({"location": "engine.py:_has_valid_claim:entry", "message": "Checking claim", "data": {"player_name": player.name, "player_claims": player.claims, "holding_id": holding.id, "holding_type": str(holding.holding_type), "holding_county": holding.county}, "timestamp": __import__('time').time()*1000, "sessionId": "debug-session", "hypothesisId": "H1-H5"}) + '\n')
-        # #endregion
         
         # BANDITS have implicit claims on all TOWNS (but not castles)
         if player.title == TitleType.BANDIT:
@@ -307,25 +412,16 @@ class GameEngine:
         # If player meets Count prerequisites for a county, they have a claim on that county castle
         if holding.holding_type == HoldingType.COUNTY_CASTLE and holding.county:
             if can_claim_count(self.state, player.id, holding.county):
-                # #region agent log
-                import json; open('/home/ilya/dev/kingdom/.cursor/debug.log', 'a').write(json.dumps({"location": "engine.py:_has_valid_claim:auto_count", "message": "AUTO CLAIM via Count prereqs", "data": {"player_name": player.name, "county": holding.county}, "timestamp": __import__('time').time()*1000, "sessionId": "debug-session", "hypothesisId": "H3"}) + '\n')
-                # #endregion
                 return True
         
         # If player meets Duke prerequisites for a duchy, they have a claim on that duchy castle
         if holding.holding_type == HoldingType.DUCHY_CASTLE and holding.duchy:
             if can_claim_duke(self.state, player.id, holding.duchy):
-                # #region agent log
-                import json; open('/home/ilya/dev/kingdom/.cursor/debug.log', 'a').write(json.dumps({"location": "engine.py:_has_valid_claim:auto_duke", "message": "AUTO CLAIM via Duke prereqs", "data": {"player_name": player.name, "duchy": holding.duchy}, "timestamp": __import__('time').time()*1000, "sessionId": "debug-session", "hypothesisId": "H3"}) + '\n')
-                # #endregion
                 return True
         
         # If player meets King prerequisites, they have a claim on the king castle
         if holding.id == "king_castle":
             if can_claim_king(self.state, player.id):
-                # #region agent log
-                import json; open('/home/ilya/dev/kingdom/.cursor/debug.log', 'a').write(json.dumps({"location": "engine.py:_has_valid_claim:auto_king", "message": "AUTO CLAIM via King prereqs", "data": {"player_name": player.name}, "timestamp": __import__('time').time()*1000, "sessionId": "debug-session", "hypothesisId": "H3"}) + '\n')
-                # #endregion
                 return True
         
         # If player has no explicit claims at all, return False for non-castle holdings
@@ -334,29 +430,17 @@ class GameEngine:
         
         # Check if holding ID is in player's claims list
         if holding.id in player.claims:
-            # #region agent log
-            import json; open('/home/ilya/dev/kingdom/.cursor/debug.log', 'a').write(json.dumps({"location": "engine.py:_has_valid_claim:direct_claim", "message": "DIRECT CLAIM on holding ID", "data": {"player_name": player.name, "holding_id": holding.id}, "timestamp": __import__('time').time()*1000, "sessionId": "debug-session", "hypothesisId": "H2"}) + '\n')
-            # #endregion
             return True
         
         # Check if player has a claim for the holding's county (for towns)
         county_claim_key = f"county_{holding.county}"
         if holding.county and county_claim_key in player.claims:
-            # #region agent log
-            import json; open('/home/ilya/dev/kingdom/.cursor/debug.log', 'a').write(json.dumps({"location": "engine.py:_has_valid_claim:county_claim", "message": "COUNTY CLAIM matched", "data": {"player_name": player.name, "county_claim_key": county_claim_key, "holding_id": holding.id, "holding_type": str(holding.holding_type)}, "timestamp": __import__('time').time()*1000, "sessionId": "debug-session", "hypothesisId": "H1"}) + '\n')
-            # #endregion
             return True
         
         # Check for "all" claims (ultimate/duchy)
         if "all" in player.claims:
-            # #region agent log
-            import json; open('/home/ilya/dev/kingdom/.cursor/debug.log', 'a').write(json.dumps({"location": "engine.py:_has_valid_claim:all_claim", "message": "ALL CLAIM (ultimate/duchy)", "data": {"player_name": player.name}, "timestamp": __import__('time').time()*1000, "sessionId": "debug-session", "hypothesisId": "H4"}) + '\n')
-            # #endregion
             return True
         
-        # #region agent log
-        import json; open('/home/ilya/dev/kingdom/.cursor/debug.log', 'a').write(json.dumps({"location": "engine.py:_has_valid_claim:no_claim", "message": "NO VALID CLAIM FOUND", "data": {"player_name": player.name, "holding_id": holding.id}, "timestamp": __import__('time').time()*1000, "sessionId": "debug-session", "hypothesisId": "H1-H5"}) + '\n')
-        # #endregion
         return False
     
     def _is_holding_in_domain(self, player, holding) -> bool:
@@ -430,13 +514,16 @@ class GameEngine:
             Tuple of (success, message, combat_result)
         """
         state = self.state
+        position = (state.current_round, state.current_player_idx)
         
         # Special case: DEFEND action is allowed during COMBAT phase
         if action.action_type == ActionType.DEFEND:
             if state.phase != GamePhase.COMBAT:
                 return False, "No combat to defend", None
             # Defender validation is done in _handle_defend
-            return self._handle_defend(action)
+            result = self._handle_defend(action)
+            self._record_action(action, result, position)
+            return result
         
         # Validate it's the player's turn for all other actions
         if state.phase != GamePhase.PLAYER_TURN:
@@ -469,9 +556,9 @@ class GameEngine:
         result = handler(action)
         
         # Log the action
-        logger = get_logger(self.game_id)
+        logger = logger_for(self.state)
         if logger:
-            player = next((p for p in self.state.players if p.id == action.player_id), None)
+            player = self.state.get_player(action.player_id)
             player_name = player.name if player else "Unknown"
             
             action_details = logger.get_action_details(action)
@@ -491,12 +578,24 @@ class GameEngine:
             self.state.phase = GamePhase.GAME_OVER
             save_game(self.state)
         
+        self._record_action(action, result, position)
         return result
     
+    def _record_action(self, action: Action, result: tuple, position: tuple[int, int]) -> None:
+        """Record a successful action in the game's event history.
+        
+        Failed actions are validated before any mutation, so they are skipped.
+        """
+        if result[0]:
+            record_command(
+                self.state, "action", {"action": action.model_dump(mode="json")},
+                round_num=position[0], player_idx=position[1],
+            )
+    
     def _handle_draw_card(self, action: Action) -> tuple[bool, str, None]:
         """Handle drawing a card."""
         state = self.state
-        player = next((p for p in state.players if p.id == action.player_id), None)
+        player = state.get_player(action.player_id)
         
         if state.card_drawn_this_turn:
             return False, "Already drew a card this turn", None
@@ -504,15 +603,15 @@ class GameEngine:
         if not state.deck:
             # Reshuffle discard pile
             if state.discard_pile:
-                import random
                 state.deck = state.discard_pile.copy()
-                random.shuffle(state.deck)
+                recorded_shuffle(state, state.deck, state.next_rng().shuffle)
                 state.discard_pile = []
             else:
                 return False, "No cards available", None
         
         card_id = state.deck.pop(0)
         card = state.cards.get(card_id)
+        recorded_draw(state, player.id, card_id)
         
         # Handle instant cards (personal and global events)
         if card and is_instant_card(card):
@@ -560,8 +659,8 @@ class GameEngine:
         state = self.state
         
         # Validate source and target
-        source = next((h for h in state.holdings if h.id == action.source_holding_id), None)
-        target = next((h for h in state.holdings if h.id == action.target_holding_id), None)
+        source = state.get_holding(action.source_holding_id)
+        target = state.get_holding(action.target_holding_id)
         
         if not source or not target:
             return False, "Invalid holdings", None
@@ -603,8 +702,8 @@ class GameEngine:
         - Max 3 per town total
         """
         state = self.state
-        player = next((p for p in state.players if p.id == action.player_id), None)
-        holding = next((h for h in state.holdings if h.id == action.target_holding_id), None)
+        player = state.get_player(action.player_id)
+        holding = state.get_holding(action.target_holding_id)
         
         if player.gold < 10:
             return False, "Not enough gold (need 10)", None
@@ -640,10 +739,10 @@ class GameEngine:
     def _handle_claim_title(self, action: Action) -> tuple[bool, str, None]:
         """Handle claiming a title."""
         state = self.state
-        player = next((p for p in state.players if p.id == action.player_id), None)
+        player = state.get_player(action.player_id)
         
         target_id = action.target_holding_id
-        holding = next((h for h in state.holdings if h.id == target_id), None)
+        holding = state.get_holding(target_id)
         
         if not holding:
             return False, "Holding not found", None
@@ -658,7 +757,8 @@ class GameEngine:
             
             player.gold -= 25
             player.counties.append(county)
-            holding.owner_id = player.id
+            state.set_holding_owner(holding, player.id)
+            refresh_prestige(state, player)
             if player.title == TitleType.BARON:
                 player.title = TitleType.COUNT
             
@@ -675,7 +775,8 @@ class GameEngine:
             
             player.gold -= 50
             player.duchies.append(duchy)
-            holding.owner_id = player.id
+            state.set_holding_owner(holding, player.id)
+            refresh_prestige(state, player)
             player.title = TitleType.DUKE
             
             state.action_log.append(action)
@@ -695,12 +796,13 @@ class GameEngine:
                     p.title = TitleType.DUKE if p.duchies else (
                         TitleType.COUNT if p.counties else TitleType.BARON
                     )
+                    refresh_prestige(state, p)
             
             player.gold -= 75
             player.is_king = True
             player.title = TitleType.KING
-            holding.owner_id = player.id
-            # Note: 6 VP for being king is calculated dynamically in calculate_prestige
+            state.set_holding_owner(holding, player.id)
+            refresh_prestige(state, player)
             
             state.action_log.append(action)
             save_game(state)
@@ -716,8 +818,8 @@ class GameEngine:
         Cannot fabricate claims on County, Duchy, or King castles.
         """
         state = self.state
-        player = next((p for p in state.players if p.id == action.player_id), None)
-        holding = next((h for h in state.holdings if h.id == action.target_holding_id), None)
+        player = state.get_player(action.player_id)
+        holding = state.get_holding(action.target_holding_id)
         
         if player.gold < 35:
             return False, "Not enough gold (need 35)", None
@@ -744,8 +846,8 @@ class GameEngine:
     def _handle_claim_town(self, action: Action) -> tuple[bool, str, None]:
         """Handle peacefully capturing an unowned town with a valid claim (10 gold)."""
         state = self.state
-        player = next((p for p in state.players if p.id == action.player_id), None)
-        holding = next((h for h in state.holdings if h.id == action.target_holding_id), None)
+        player = state.get_player(action.player_id)
+        holding = state.get_holding(action.target_holding_id)
         
         if player.gold < 10:
             return False, "Not enough gold (need 10)", None
@@ -768,8 +870,9 @@ class GameEngine:
         
         # Capture the town
         player.gold -= 10
-        holding.owner_id = player.id
+        state.set_holding_owner(holding, player.id)
         player.holdings.append(holding.id)
+        refresh_prestige(state, player)
         
         state.action_log.append(action)
         save_game(state)
@@ -779,10 +882,10 @@ class GameEngine:
     def _handle_relocate_fortification(self, action: Action) -> tuple[bool, str, None]:
         """Handle relocating a fortification (costs 10 gold)."""
         state = self.state
-        player = next((p for p in state.players if p.id == action.player_id), None)
+        player = state.get_player(action.player_id)
         
-        source = next((h for h in state.holdings if h.id == action.source_holding_id), None)
-        target = next((h for h in state.holdings if h.id == action.target_holding_id), None)
+        source = state.get_holding(action.source_holding_id)
+        target = state.get_holding(action.target_holding_id)
         
         if not source or not target:
             return False, "Invalid holdings", None
@@ -831,8 +934,8 @@ class GameEngine:
         If defender is human, creates pending_combat for their response.
         """
         state = self.state
-        player = next((p for p in state.players if p.id == action.player_id), None)
-        target = next((h for h in state.holdings if h.id == action.target_holding_id), None)
+        player = state.get_player(action.player_id)
+        target = state.get_holding(action.target_holding_id)
         
         if not target:
             return False, "Target holding not found", None
@@ -863,7 +966,7 @@ class GameEngine:
             return False, "Must commit at least 200 soldiers", None
         
         # Get defender
-        defender = next((p for p in state.players if p.id == target.owner_id), None)
+        defender = state.get_player(target.owner_id)
         
         # Check if defender is human - if so, create pending combat
         if defender and defender.player_type == PlayerType.HUMAN:
@@ -889,7 +992,7 @@ class GameEngine:
             defender_cards = self._ai_select_combat_cards(defender)
             # AI decides how many soldiers to commit based on situation
             defender_soldiers = self._ai_calculate_defender_commitment(
-                defender, soldiers, target
+                defender, action, soldiers, defender_cards
             )
         
         # Consume the claim (regardless of combat outcome)
@@ -911,7 +1014,7 @@ class GameEngine:
         state = apply_combat_result(state, result)
         
         # Log the combat
-        logger = get_logger(self.game_id)
+        logger = logger_for(state)
         if logger:
             defender_name = defender.name if defender else "Neutral"
             combat_details = {
@@ -969,64 +1072,37 @@ class GameEngine:
     def _ai_calculate_defender_commitment(
         self, 
         defender, 
+        action: Action,
         attacker_soldiers: int,
-        target_holding
+        defender_cards: list[str],
     ) -> int:
         """AI calculates how many soldiers to commit for defense.
         
-        Strategy:
-        - If we have fortifications, we have an advantage - commit less
-        - If attacker is committing heavily, we need to match
-        - Always keep some reserves if possible
-        - Commit enough to have a good chance of winning
-        
-        Combat formula: Strength = 2d6 + (soldiers/100) + modifiers
+        Picks the commitment with the best expected value from the exact
+        combat odds (see best_defender_commitment), taking both sides'
+        cards and fortifications into account.
         """
         if defender.soldiers == 0:
             return 0
-        
-        # Calculate our defensive advantage
-        fort_bonus = target_holding.fortification_count * 2 if target_holding else 0
-        defense_bonus = target_holding.defense_modifier if target_holding else 0
-        total_defense_bonus = fort_bonus + defense_bonus
-        
-        # Attacker's soldier bonus
-        attacker_bonus = attacker_soldiers // 100
-        
-        # We need to match or exceed attacker strength
-        # Base dice average is 7 (2d6)
-        # We want: our_soldiers/100 + our_bonuses >= attacker_soldiers/100
-        # So: our_soldiers >= (attacker_bonus - total_defense_bonus) * 100
-        
-        # Calculate minimum soldiers needed to match attacker
-        min_needed = max(0, (attacker_bonus - total_defense_bonus) * 100)
-        
-        # Add buffer for dice variance (about 200 extra for safety)
-        recommended = min_needed + 200
-        
-        # But also consider committing proportionally to threat
-        # If attacker is committing a lot, we might need to match more aggressively
-        proportional = int(attacker_soldiers * 0.8)  # Match 80% of attacker
-        
-        # Take the higher of the two strategies
-        target_commitment = max(recommended, proportional)
-        
-        # Round to nearest 100
-        target_commitment = (target_commitment // 100) * 100
-        
-        # Cap at available soldiers
-        target_commitment = min(target_commitment, defender.soldiers)
-        
-        # If we'd commit more than 80% of our army, just commit all
-        # (no point keeping tiny reserves)
-        if target_commitment >= defender.soldiers * 0.8:
-            target_commitment = defender.soldiers
-        
-        # Minimum commitment (if we have any soldiers, commit at least some)
-        if defender.soldiers > 0 and target_commitment == 0:
-            target_commitment = min(200, defender.soldiers)
-        
-        return target_commitment
+        state = self.state
+        attacker_cards = action.attack_cards or []
+        odds = combat_odds(
+            state,
+            action.player_id,
+            action.target_holding_id,
+            attacker_soldiers,
+            source_holding_id=action.source_holding_id,
+            attacker_cards=attacker_cards,
+            defender_cards=defender_cards,
+            defender_soldiers_override=0,
+        )
+        return best_defender_commitment(
+            defender.soldiers,
+            odds.attack_modifier,
+            odds.defense_modifier,
+            combat_card_effects(state, attacker_cards),
+            combat_card_effects(state, defender_cards),
+        )
     
     def _discard_combat_cards(self, player, card_ids: list[str]) -> None:
         """Remove combat cards from player's hand and add to discard."""
@@ -1048,9 +1124,9 @@ class GameEngine:
         if action.player_id != pending.defender_id:
             return False, "You are not the defender in this combat", None
         
-        defender = next((p for p in state.players if p.id == pending.defender_id), None)
-        attacker = next((p for p in state.players if p.id == pending.attacker_id), None)
-        target = next((h for h in state.holdings if h.id == pending.target_holding_id), None)
+        defender = state.get_player(pending.defender_id)
+        attacker = state.get_player(pending.attacker_id)
+        target = state.get_holding(pending.target_holding_id)
         
         if not defender or not attacker or not target:
             return False, "Invalid combat state", None
@@ -1078,7 +1154,7 @@ class GameEngine:
         state = apply_combat_result(state, result)
         
         # Log the combat
-        logger = get_logger(self.game_id)
+        logger = logger_for(state)
         if logger:
             combat_details = {
                 "attacker_soldiers_committed": result.attacker_soldiers_committed,
@@ -1125,7 +1201,7 @@ class GameEngine:
     def _handle_play_card(self, action: Action) -> tuple[bool, str, None]:
         """Handle playing a card from hand."""
         state = self.state
-        player = next((p for p in state.players if p.id == action.player_id), None)
+        player = state.get_player(action.player_id)
         
         if action.card_id not in player.hand:
             return False, "Card not in hand", None
@@ -1212,37 +1288,19 @@ class GameEngine:
         - Attack a territory (if occupied by another player)
         - Capture an unowned territory for 10 gold (via CLAIM_TOWN action)
         """
-        effect = card.effect
         target_id = action.target_holding_id
         
         if not target_id:
             return False, "Must specify a target holding", None
         
-        holding = next((h for h in state.holdings if h.id == target_id), None)
+        holding = state.get_holding(target_id)
         if not holding:
             return False, "Holding not found", None
         
         # Validate claim based on card type
-        if effect in [CardEffect.CLAIM_X, CardEffect.CLAIM_U, CardEffect.CLAIM_V, CardEffect.CLAIM_Q]:
-            required_county = get_card_county(card)
-            if holding.county != required_county:
-                return False, f"This claim only works in County {required_county}", None
-            # County claim cards can ONLY target TOWNS, NOT castles
-            # To claim a castle, you must meet Count prerequisites (2 towns or fortified capitol)
-            if holding.holding_type != HoldingType.TOWN:
-                return False, "County claim cards only work on towns. To claim a castle, meet Count prerequisites.", None
-        
-        elif effect == CardEffect.DUCHY_CLAIM:
-            # Can claim any town or Duke+ title
-            if holding.holding_type not in [HoldingType.TOWN, HoldingType.DUCHY_CASTLE, HoldingType.KING_CASTLE]:
-                return False, "Invalid target for Duchy Claim", None
-        
-        elif effect == CardEffect.ULTIMATE_CLAIM:
-            # Can claim anything - no restrictions
-            pass
-        
-        else:
-            return False, "Unknown claim type", None
+        error = claim_target_error(card, holding)
+        if error:
+            return False, error, None
         
         # Add the claim to player's claims list
         if holding.id not in player.claims:
@@ -1253,7 +1311,7 @@ class GameEngine:
     def _handle_end_turn(self, action: Action) -> tuple[bool, str, None]:
         """Handle ending the turn."""
         state = self.state
-        player = next((p for p in state.players if p.id == action.player_id), None)
+        player = state.get_player(action.player_id)
         
         # Clear player's active effects at end of turn
         player.active_effects = []
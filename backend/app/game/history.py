@@ -0,0 +1,508 @@
+"""Event-sourced game history.
+
+When `Settings.event_sourcing_enabled` is on, every state transition of a game
+is appended to `<event_log_directory>/<game_id>/events.jsonl`:
+
+- Commands: the calls that drive the game forward ("assign_town",
+  "auto_assign_towns", "start", "income" and successful "action"s). Each
+  records the round/turn it was issued in.
+- Random outcomes: "dice" rolls and "shuffle" orders, recorded while a
+  command runs (so they precede it in the log) and fed back on replay.
+- "draw" events: the card each draw produced, checked on replay.
+
+Every `event_checkpoint_interval` events a state snapshot is written to
+`checkpoint_<seq>.json` and indexed in `checkpoints.jsonl`. Snapshots leave
+out the ever-growing action/combat logs; the entries added since the previous
+checkpoint are appended to `logs.jsonl` instead. A game is rebuilt
+by loading the nearest checkpoint and re-running the commands after it on a
+detached copy, so replays never touch the store or the game log.
+
+Like game logs, the files are written by the background log writer
+(app.game.logger.LogWriter) unless `game_log_writer` is "sync", so recording
+never does disk I/O on the event loop. Rebuilding waits for pending writes
+first, and is meant to run off the loop (the routes use a threadpool).
+"""
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+from app.config import get_settings
+from app.models.schemas import GameState, Action
+from app.game.logger import LogWriter, get_log_writer
+
+
+# Event types that carry random outcomes consumed while a command runs
+RANDOM_EVENTS = ("dice", "shuffle", "draw")
+
+# Commands issued before the first turn; always part of any turn's state
+SETUP_COMMANDS = ("assign_town", "auto_assign_towns", "start")
+
+# Append-only state fields stored incrementally in logs.jsonl
+_LOG_FIELDS = ("action_log", "combat_log")
+
+# Module-level storage for active game histories
+_game_histories: dict[str, "GameHistory"] = {}
+
+# Recorded random outcomes for states being replayed, keyed by id(state)
+_replay_feeds: dict[int, "_ReplayFeed"] = {}
+
+
+def get_history(game_id: str) -> Optional["GameHistory"]:
+    """Get the history recorder of a game."""
+    return _game_histories.get(game_id)
+
+
+def create_history(state: GameState) -> Optional["GameHistory"]:
+    """Start recording a new game if event sourcing is enabled.
+
+    Writes the initial state as checkpoint 0. Files left under the game's ID
+    by an earlier game are discarded, never resumed (see recover_game).
+    """
+    settings = get_settings()
+    if not settings.event_sourcing_enabled:
+        return None
+    if state.id in _game_histories:
+        raise ValueError(f"Game {state.id} is already being recorded")
+
+    history = GameHistory(
+        state.id, settings.event_log_directory, settings.event_checkpoint_interval,
+        writer=_history_writer(),
+    )
+    history.write_checkpoint(state)
+    _game_histories[state.id] = history
+    return history
+
+
+def remove_history(game_id: str) -> None:
+    """Stop recording a game. Its files are kept on disk."""
+    history = _game_histories.pop(game_id, None)
+    if history:
+        history.close()
+
+
+def _history_writer() -> Optional[LogWriter]:
+    """The background writer histories use, or None to write inline."""
+    return get_log_writer() if get_settings().game_log_writer == "thread" else None
+
+
+class GameHistory:
+    """Append-only event log and checkpoints for one game.
+
+    Events are buffered and handed to the log writer, which calls back
+    _append/_flush_buffer/_finalize on its thread as it does for GameLogger.
+    """
+
+    def __init__(self, game_id: str, directory: str, checkpoint_interval: int,
+                 resume: bool = False, writer: Optional[LogWriter] = None):
+        """Initialize the history.
+
+        Args:
+            game_id: Unique identifier for the game
+            directory: Root directory for event logs
+            checkpoint_interval: Number of events between checkpoints
+            resume: Continue the game's existing log; otherwise any files
+                already in its directory are removed and recording starts over
+            writer: Background writer for the files (None writes inline)
+        """
+        self.game_id = game_id
+        self.directory = Path(directory) / game_id
+        existed = self.directory.exists()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.events_path = self.directory / "events.jsonl"
+        self.checkpoints_path = self.directory / "checkpoints.jsonl"
+        self.logs_path = self.directory / "logs.jsonl"
+        self.checkpoint_interval = max(1, checkpoint_interval)
+        self.writer = writer
+
+        # What the log writer drives: lines not yet written, written after
+        # every batch (flush_interval 0)
+        self._buffer: list[str] = []
+        self._last_flush = time.monotonic()
+        self.flush_interval = 0.0
+
+        if existed and not resume:
+            if writer is not None:
+                writer.flush()  # Let an earlier game's pending writes land first
+            for path in (self.events_path, self.checkpoints_path, self.logs_path,
+                         *self.directory.glob("checkpoint_*.json")):
+                path.unlink(missing_ok=True)
+
+        self.seq = 0
+        for event in read_events(self.directory):
+            self.seq = event["seq"]
+        self._last_checkpoint = self.seq
+        # Number of action/combat log entries already in logs.jsonl
+        action_log, combat_log = _read_logs(self.directory, self.seq)
+        self._logged = {"action_log": len(action_log), "combat_log": len(combat_log)}
+
+    def append(self, event_type: str, data: Any, **fields) -> int:
+        """Append an event and return its sequence number."""
+        self.seq += 1
+        self._submit({"seq": self.seq, "type": event_type, **fields, "data": data})
+        return self.seq
+
+    def _submit(self, entry: dict) -> None:
+        if self.writer is not None:
+            self.writer.submit(self, entry)
+        else:
+            self._append(entry)
+
+    def record_command(self, state: GameState, command: str, data: dict,
+                       round_num: int, player_idx: int) -> None:
+        """Record a command after it ran, checkpointing if one is due.
+
+        Args:
+            state: State after the command
+            command: Command type
+            data: Arguments needed to re-run the command
+            round_num: Round the command was issued in
+            player_idx: Current player index when the command was issued
+        """
+        self.append(command, data, round=round_num, player_idx=player_idx)
+        if self.writer is None:
+            self._flush_buffer()
+        if self.seq - self._last_checkpoint >= self.checkpoint_interval:
+            self.write_checkpoint(state)
+
+    def write_checkpoint(self, state: GameState) -> None:
+        """Snapshot the state as of the latest event.
+
+        The state is serialized here, as it can change right after; the
+        files are written with the events.
+        """
+        logs = {}
+        for field in _LOG_FIELDS:
+            entries = getattr(state, field)
+            logs[field] = [e.model_dump(mode="json") for e in entries[self._logged[field]:]]
+            self._logged[field] = len(entries)
+        self._submit({
+            "type": "checkpoint",
+            "seq": self.seq,
+            "round": state.current_round,
+            "player_idx": state.current_player_idx,
+            "state": state.model_dump_json(exclude=set(_LOG_FIELDS), exclude_defaults=True),
+            "logs": logs,
+        })
+        if self.writer is None:
+            self._flush_buffer()
+        self._last_checkpoint = self.seq
+
+    def sync(self) -> None:
+        """Wait until everything recorded so far is on disk."""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self) -> None:
+        """Write out what's pending; recording stops."""
+        if self.writer is not None:
+            self.writer.close_logger(self)
+        else:
+            self._finalize()
+
+    # ============ File Writes (log writer thread) ============
+
+    def _append(self, entry: dict) -> None:
+        if entry["type"] != "checkpoint":
+            self._buffer.append(json.dumps(entry, separators=(",", ":"), default=str))
+            return
+        # Events first, so the checkpoint never gets ahead of its log
+        self._flush_buffer()
+        path = self.directory / f"checkpoint_{entry['seq']:08d}.json"
+        path.write_text(entry["state"], encoding="utf-8")
+        with open(self.logs_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"seq": entry["seq"], **entry["logs"]}, separators=(",", ":")) + "\n")
+        with open(self.checkpoints_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "seq": entry["seq"],
+                "round": entry["round"],
+                "player_idx": entry["player_idx"],
+                "file": path.name,
+            }) + "\n")
+
+    def _flush_buffer(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        with open(self.events_path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def _finalize(self) -> None:
+        self._flush_buffer()
+
+
+# ============ Recording Hooks ============
+
+def record_command(state: GameState, command: str, data: dict,
+                   round_num: int, player_idx: int) -> None:
+    """Record a command for a live game (no-op for detached states)."""
+    if state.is_detached:
+        return
+    history = _game_histories.get(state.id)
+    if history:
+        history.record_command(state, command, data, round_num, player_idx)
+
+
+def _record_random(state: GameState, event_type: str, data: Any) -> None:
+    if state.is_detached:
+        return
+    history = _game_histories.get(state.id)
+    if history:
+        history.append(event_type, data)
+
+
+def recorded_roll(state: GameState, roll: Callable[[], int]) -> int:
+    """Roll dice for a game, or return the recorded roll when replaying.
+    
+    The roll is made either way so the game's random streams stay in step.
+    """
+    value = roll()
+    feed = _replay_feeds.get(id(state))
+    if feed is not None:
+        return feed.take("dice")
+    _record_random(state, "dice", value)
+    return value
+
+
+def recorded_shuffle(state: GameState, items: list,
+                     shuffle: Callable[[list], None],
+                     key: Callable[[Any], str] = str) -> None:
+    """Shuffle a list in place, or restore the recorded order when replaying.
+
+    The shuffle runs either way so the game's random streams stay in step.
+
+    Args:
+        state: Game the shuffle belongs to
+        items: List to shuffle in place
+        shuffle: In-place shuffle function (e.g. state.next_rng().shuffle)
+        key: Maps items to the identifiers stored in the log
+    """
+    shuffle(items)
+    feed = _replay_feeds.get(id(state))
+    if feed is not None:
+        order = feed.take("shuffle")
+        by_key = {key(item): item for item in items}
+        items[:] = [by_key[k] for k in order]
+        return
+    _record_random(state, "shuffle", [key(item) for item in items])
+
+
+def recorded_draw(state: GameState, player_id: str, card_id: str) -> None:
+    """Record a card draw, or check it against the log when replaying."""
+    feed = _replay_feeds.get(id(state))
+    if feed is not None:
+        expected = feed.take("draw")
+        if expected["card_id"] != card_id:
+            raise ValueError(
+                f"Replay diverged: drew {card_id}, log has {expected['card_id']}"
+            )
+        return
+    _record_random(state, "draw", {"player_id": player_id, "card_id": card_id})
+
+
+@contextmanager
+def forced_rolls(state: GameState, rolls: list[int]) -> Iterator[None]:
+    """Make a detached state's next dice rolls come out as given.
+    
+    Used to play out a chosen combat outcome on a fork.
+    """
+    if not state.is_detached:
+        raise ValueError("Rolls can only be forced on a detached state")
+    feed = _ReplayFeed()
+    feed.pending.extend((i, "dice", roll) for i, roll in enumerate(rolls))
+    _replay_feeds[id(state)] = feed
+    try:
+        yield
+    finally:
+        _replay_feeds.pop(id(state), None)
+
+
+class _ReplayFeed:
+    """Recorded random outcomes waiting to be consumed by the next command."""
+
+    def __init__(self):
+        self.pending: deque[tuple[int, str, Any]] = deque()
+
+    def take(self, event_type: str) -> Any:
+        if not self.pending:
+            raise ValueError(f"Replay diverged: no recorded {event_type} event")
+        seq, recorded_type, data = self.pending.popleft()
+        if recorded_type != event_type:
+            raise ValueError(
+                f"Replay diverged at event {seq}: expected {event_type}, log has {recorded_type}"
+            )
+        return data
+
+
+# ============ Rebuilding ============
+
+def read_events(directory: Path, after_seq: int = 0) -> Iterator[dict]:
+    """Iterate over a game's events with seq > after_seq."""
+    path = Path(directory) / "events.jsonl"
+    if not path.exists():
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event["seq"] > after_seq:
+                yield event
+
+
+def _read_checkpoints(directory: Path) -> list[dict]:
+    path = directory / "checkpoints.jsonl"
+    if not path.exists():
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _read_logs(directory: Path, upto_seq: int) -> tuple[list[dict], list[dict]]:
+    """Collect the action/combat log entries stored up to a checkpoint."""
+    action_log: list[dict] = []
+    combat_log: list[dict] = []
+    path = directory / "logs.jsonl"
+    if not path.exists():
+        return action_log, combat_log
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            chunk = json.loads(line)
+            if chunk["seq"] > upto_seq:
+                break
+            action_log.extend(chunk["action_log"])
+            combat_log.extend(chunk["combat_log"])
+    return action_log, combat_log
+
+
+def rebuild_game(
+    game_id: str,
+    seq: Optional[int] = None,
+    round_num: Optional[int] = None,
+    player_idx: int = 0,
+    directory: Optional[str] = None,
+) -> GameState:
+    """Rebuild a game from its event log.
+
+    Args:
+        game_id: Game to rebuild
+        seq: Rebuild the state right after this event
+        round_num: Rebuild the state at the start of this round's turn for
+            player_idx, before anything in that turn (including the round's
+            income) happened. Setup is always included. Ignored if seq is given.
+        player_idx: Turn within round_num
+        directory: Root event log directory (defaults to settings)
+
+    Returns:
+        A detached GameState; the latest state if no target is given.
+    """
+    history = _game_histories.get(game_id)
+    if history is not None:
+        history.sync()
+    root = Path(directory or get_settings().event_log_directory)
+    game_dir = root / game_id
+    checkpoints = _read_checkpoints(game_dir)
+    if not checkpoints:
+        raise ValueError(f"No history recorded for game {game_id}")
+
+    target = (round_num, player_idx) if round_num is not None and seq is None else None
+
+    def before_target(cp_seq: int, position: tuple[int, int]) -> bool:
+        if seq is not None:
+            return cp_seq <= seq
+        if target is not None:
+            return position < target
+        return True
+
+    # Latest checkpoint that doesn't go past the target
+    start = None
+    for cp in checkpoints:
+        if before_target(cp["seq"], (cp["round"], cp["player_idx"])):
+            start = cp
+    if start is None:
+        start = checkpoints[0]
+
+    snapshot = json.loads((game_dir / start["file"]).read_text(encoding="utf-8"))
+    snapshot["action_log"], snapshot["combat_log"] = _read_logs(game_dir, start["seq"])
+    state = GameState.model_validate(snapshot)
+    state.detach()
+
+    feed = _ReplayFeed()
+    _replay_feeds[id(state)] = feed
+    try:
+        for event in read_events(game_dir, after_seq=start["seq"]):
+            if event["type"] in RANDOM_EVENTS:
+                if seq is not None and event["seq"] > seq:
+                    break
+                feed.pending.append((event["seq"], event["type"], event["data"]))
+                continue
+            if seq is not None and event["seq"] > seq:
+                break
+            if (target is not None and event["type"] not in SETUP_COMMANDS
+                    and (event["round"], event["player_idx"]) >= target):
+                break
+            state = _apply_command(state, event)
+            if feed.pending:
+                raise ValueError(
+                    f"Replay diverged at event {event['seq']}: "
+                    f"{len(feed.pending)} recorded random events left unused"
+                )
+    finally:
+        _replay_feeds.pop(id(state), None)
+
+    return state
+
+
+def _apply_command(state: GameState, event: dict) -> GameState:
+    """Re-run one recorded command on a detached state."""
+    from app.game import state as game_state
+    from app.game.engine import GameEngine
+
+    command = event["type"]
+    data = event["data"]
+
+    if command == "assign_town":
+        game_state.assign_starting_town(state, data["player_id"], data["town_id"])
+    elif command == "auto_assign_towns":
+        game_state.auto_assign_starting_towns(state)
+    elif command == "start":
+        game_state.start_game(state)
+    elif command == "income":
+        game_state.apply_income(state)
+    elif command == "action":
+        engine = GameEngine(state.id, state=state)
+        success, message, _ = engine.perform_action(Action.model_validate(data["action"]))
+        if not success:
+            raise ValueError(
+                f"Replay diverged at event {event['seq']}: action failed ({message})"
+            )
+    else:
+        raise ValueError(f"Unknown command in event log: {command}")
+    return state
+
+
+def recover_game(game_id: str) -> GameState:
+    """Rebuild the latest state of a game and put it back into the store.
+
+    Recording resumes on the existing event log (before the game is back in
+    the store, so no command goes unrecorded).
+    """
+    from app.game.state import save_game
+
+    rebuilt = rebuild_game(game_id)
+    # Re-validate to get an attached copy (private flags aren't carried over)
+    state = GameState.model_validate(rebuilt.model_dump())
+
+    settings = get_settings()
+    if settings.event_sourcing_enabled and game_id not in _game_histories:
+        _game_histories[game_id] = GameHistory(
+            game_id, settings.event_log_directory, settings.event_checkpoint_interval,
+            resume=True, writer=_history_writer(),
+        )
+    save_game(state)
+    return state
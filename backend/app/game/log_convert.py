@@ -0,0 +1,83 @@
+"""Convert JSON Lines game logs to the single-document format.
+
+Usage:
+    python -m app.game.log_convert game_logs/game_1234abcd_20250101_120000.jsonl [...]
+
+Each input is streamed entry by entry, so large logs are never loaded into
+memory at once. The output is written next to the input with a .json
+extension (or to --output for a single input) and matches what the "json"
+log format produces: {"game_id", "log_file", "entries": [...]}.
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Iterator, Optional
+
+
+def read_jsonl_log(path: Path) -> tuple[dict, Iterator[dict]]:
+    """Open a JSON Lines game log.
+
+    Returns:
+        Tuple of (header, iterator over entries)
+    """
+    f = open(path, encoding="utf-8")
+    first = f.readline()
+    header = json.loads(first) if first.strip() else {}
+
+    def entries() -> Iterator[dict]:
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    return header, entries()
+
+
+def convert_log(source: Path, destination: Optional[Path] = None) -> Path:
+    """Convert one JSON Lines log to a single JSON document.
+
+    Args:
+        source: Path of the .jsonl log
+        destination: Output path (defaults to source with a .json suffix)
+
+    Returns:
+        Path of the written document
+    """
+    source = Path(source)
+    destination = Path(destination) if destination else source.with_suffix(".json")
+    header, entries = read_jsonl_log(source)
+
+    with open(destination, "w", encoding="utf-8") as out:
+        # Same layout as json.dump(..., indent=2), written incrementally
+        out.write("{\n")
+        out.write(f'  "game_id": {json.dumps(header.get("game_id"), ensure_ascii=False)},\n')
+        out.write(f'  "log_file": {json.dumps(destination.name, ensure_ascii=False)},\n')
+        out.write('  "entries": [')
+        first = True
+        for entry in entries:
+            out.write("\n" if first else ",\n")
+            first = False
+            text = json.dumps(entry, indent=2, ensure_ascii=False, default=str)
+            out.write("\n".join("    " + line for line in text.split("\n")))
+        out.write("]\n" if first else "\n  ]\n")
+        out.write("}")
+
+    return destination
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("logs", nargs="+", type=Path, help="JSON Lines log files")
+    parser.add_argument("-o", "--output", type=Path, help="Output path (single input only)")
+    args = parser.parse_args(argv)
+
+    if args.output and len(args.logs) > 1:
+        parser.error("--output can only be used with a single input file")
+
+    for log in args.logs:
+        written = convert_log(log, args.output)
+        print(f"{log} -> {written}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 """Game logging system for detailed game event tracking."""
+import atexit
 import json
 import os
+import tempfile
+import threading
+import time
+from collections import deque
 from datetime import datetime
 from typing import Optional, Any
 from pathlib import Path
@@ -11,6 +16,13 @@ from app.config import get_settings
 # Module-level storage for active game loggers
 _game_loggers: dict[str, "GameLogger"] = {}
 
+# Process-wide background writer (created on first use in "thread" mode)
+_log_writer: Optional["LogWriter"] = None
+_log_writer_lock = threading.Lock()
+
+# Bulky AI prompt/response events that the "drop_debug" policy may discard
+DEBUG_EVENT_TYPES = frozenset({"ai_decision", "ai_combat_decision"})
+
 
 def get_logger(game_id: str) -> Optional["GameLogger"]:
     """Get an existing logger for a game."""
@@ -23,7 +35,14 @@ def create_logger(game_id: str) -> Optional["GameLogger"]:
     if not settings.game_logging_enabled:
         return None
     
-    logger = GameLogger(game_id, settings.game_logs_directory)
+    logger = GameLogger(
+        game_id,
+        settings.game_logs_directory,
+        log_format=settings.game_log_format,
+        flush_bytes=settings.game_log_flush_bytes,
+        flush_interval=settings.game_log_flush_interval,
+        writer=get_log_writer() if settings.game_log_writer == "thread" else None,
+    )
     _game_loggers[game_id] = logger
     return logger
 
@@ -35,27 +54,289 @@ def remove_logger(game_id: str) -> None:
         del _game_loggers[game_id]
 
 
+def get_log_writer() -> "LogWriter":
+    """Get the process-wide background log writer, starting it on first use."""
+    global _log_writer
+    writer = _log_writer
+    if writer is None:
+        with _log_writer_lock:
+            if _log_writer is None:
+                settings = get_settings()
+                _log_writer = LogWriter(
+                    max_queue=settings.game_log_queue_size,
+                    backpressure=settings.game_log_backpressure,
+                    flush_interval=settings.game_log_flush_interval,
+                )
+            writer = _log_writer
+    return writer
+
+
+def shutdown_log_writer() -> None:
+    """Write out everything queued and stop the background writer.
+    
+    Called from the FastAPI lifespan on shutdown and at interpreter exit.
+    """
+    global _log_writer
+    with _log_writer_lock:
+        writer, _log_writer = _log_writer, None
+    if writer is not None:
+        writer.shutdown()
+
+
+atexit.register(shutdown_log_writer)
+
+
+class LogWriter:
+    """Dedicated thread that performs all log file I/O.
+    
+    Game code only enqueues (logger, entry) pairs, so disk latency never
+    blocks the asyncio event loop. Entries are written in order; buffered
+    jsonl loggers are flushed by their size/time policy, including while
+    the game is idle.
+    
+    Under the "spill" policy, events that don't fit in the queue go to a
+    temporary overflow file instead, as do all events after them until the
+    writer has caught up, so memory stays bounded and order is kept.
+    """
+    
+    # Control markers (never dropped, not counted against the bound)
+    _CLOSE = object()
+    
+    # Spill file lines per read, so draining doesn't hold the lock for long
+    _SPILL_CHUNK = 1000
+    
+    def __init__(self, max_queue: int = 10000, backpressure: str = "block",
+                 flush_interval: float = 1.0):
+        """Start the writer thread.
+        
+        Args:
+            max_queue: Number of queued events before backpressure applies
+            backpressure: "block", "drop_debug" or "spill" (see class docs)
+            flush_interval: How often idle buffers are checked for flushing
+        """
+        self.max_queue = max(1, max_queue)
+        self.backpressure = backpressure
+        self.flush_interval = flush_interval
+        self.dropped = 0  # Events discarded by "drop_debug"
+        self.spilled = 0  # Events written to the overflow file by "spill"
+        
+        self._queue: deque[tuple["GameLogger", Any]] = deque()
+        # Overflow file of the "spill" policy: one [logger key, entry] line
+        # per event, read back once the in-memory queue has been written
+        self._spill_file = None
+        self._spill_read_pos = 0
+        self._spill_pending = 0
+        self._spill_loggers: dict[int, "GameLogger"] = {}
+        self._spill_flushes: dict[int, threading.Event] = {}
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="game-log-writer", daemon=True)
+        self._thread.start()
+    
+    def submit(self, logger: "GameLogger", entry: dict) -> None:
+        """Queue an entry, applying the backpressure policy if the queue is full."""
+        with self._cond:
+            if self._stopped:
+                # Late entry after shutdown: write it inline instead of losing it
+                logger._append(entry)
+                logger._flush_buffer()
+                return
+            if self._spill_pending or (self.backpressure == "spill"
+                                       and len(self._queue) >= self.max_queue):
+                self._spill(logger, entry)
+                self.spilled += 1
+                self._cond.notify_all()
+                return
+            if len(self._queue) >= self.max_queue and not self._stopping:
+                if (self.backpressure == "drop_debug"
+                        and entry.get("event_type") in DEBUG_EVENT_TYPES):
+                    self.dropped += 1
+                    return
+                else:
+                    while len(self._queue) >= self.max_queue and not self._stopping:
+                        self._cond.wait()
+            self._queue.append((logger, entry))
+            self._cond.notify_all()
+    
+    def close_logger(self, logger: "GameLogger") -> None:
+        """Queue finalization of a logger after its pending entries."""
+        self._control(logger, self._CLOSE)
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything queued so far is written to disk.
+        
+        Returns:
+            False if the timeout expired first
+        """
+        done = threading.Event()
+        self._control(None, done)
+        return done.wait(timeout)
+    
+    def shutdown(self) -> None:
+        """Drain the queue, flush all buffers and stop the thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join()
+    
+    def _control(self, logger: Optional["GameLogger"], marker: Any) -> None:
+        with self._cond:
+            if not self._stopped:
+                if self._spill_pending:
+                    # Keep it behind the spilled events
+                    if marker is self._CLOSE:
+                        self._spill(logger, {"__control__": "close"})
+                    else:
+                        self._spill_flushes[id(marker)] = marker
+                        self._spill(None, {"__control__": "flush", "id": id(marker)})
+                else:
+                    self._queue.append((logger, marker))
+                self._cond.notify_all()
+                return
+            # Writer is gone: act inline
+            if marker is self._CLOSE:
+                logger._finalize()
+            else:
+                marker.set()
+    
+    def _spill(self, logger: Optional["GameLogger"], entry: dict) -> None:
+        """Append an event to the overflow file (call with the lock held)."""
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile("w+", encoding="utf-8", prefix="game-log-spill-")
+        if logger is not None:
+            self._spill_loggers[id(logger)] = logger
+        self._spill_file.seek(0, os.SEEK_END)
+        self._spill_file.write(json.dumps([id(logger) if logger else None, entry],
+                                          ensure_ascii=False, default=str) + "\n")
+        self._spill_pending += 1
+    
+    def _read_spill(self) -> list[tuple[Optional["GameLogger"], Any]]:
+        """Take the next chunk of spilled events, in order (call with the lock held)."""
+        self._spill_file.seek(self._spill_read_pos)
+        batch = []
+        while len(batch) < self._SPILL_CHUNK and self._spill_pending:
+            key, entry = json.loads(self._spill_file.readline())
+            self._spill_pending -= 1
+            logger = self._spill_loggers.get(key)
+            control = entry.get("__control__") if isinstance(entry, dict) else None
+            if control == "close":
+                batch.append((logger, self._CLOSE))
+            elif control == "flush":
+                batch.append((None, self._spill_flushes.pop(entry["id"])))
+            else:
+                batch.append((logger, entry))
+        self._spill_read_pos = self._spill_file.tell()
+        if not self._spill_pending:
+            # Caught up: start the file over
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+            self._spill_read_pos = 0
+            self._spill_loggers.clear()
+        return batch
+    
+    def _run(self) -> None:
+        buffered: set[GameLogger] = set()  # Loggers with unwritten lines
+        while True:
+            with self._cond:
+                if not self._queue and not self._spill_pending and not self._stopping:
+                    self._cond.wait(self.flush_interval)
+                batch = list(self._queue)
+                self._queue.clear()
+                # Spilled events come after everything that was queued in memory
+                if not batch and self._spill_pending:
+                    batch = self._read_spill()
+                stopping = self._stopping
+                # Wake producers blocked on a full queue
+                self._cond.notify_all()
+            
+            for logger, item in batch:
+                try:
+                    if item is self._CLOSE:
+                        logger._finalize()
+                        buffered.discard(logger)
+                    elif isinstance(item, threading.Event):
+                        for pending in buffered:
+                            pending._flush_buffer()
+                        buffered.clear()
+                        item.set()
+                    else:
+                        logger._append(item)
+                        if logger._buffer:
+                            buffered.add(logger)
+                except Exception as e:
+                    # Don't kill the writer if one log fails
+                    print(f"Warning: Failed to write game log: {e}")
+            
+            # Time-based flushing for games that went quiet
+            now = time.monotonic()
+            for logger in list(buffered):
+                if stopping or now - logger._last_flush >= logger.flush_interval:
+                    logger._flush_buffer()
+                if not logger._buffer:
+                    buffered.discard(logger)
+            
+            if stopping:
+                with self._cond:
+                    if not self._queue and not self._spill_pending:
+                        self._stopped = True
+                        if self._spill_file is not None:
+                            self._spill_file.close()
+                        return
+
+
 class GameLogger:
-    """Logger for recording detailed game events to a JSON file."""
+    """Logger for recording detailed game events to a log file.
+    
+    In "jsonl" format the file starts with a header line ({game_id, log_file})
+    followed by one line per event. Events are buffered and appended once
+    flush_bytes accumulate or flush_interval seconds have passed, and are not
+    kept in memory afterwards. The "json" format keeps every entry and
+    rewrites a single document on each event.
+    """
     
-    def __init__(self, game_id: str, logs_directory: str):
+    def __init__(
+        self,
+        game_id: str,
+        logs_directory: str,
+        log_format: str = "json",
+        flush_bytes: int = 64 * 1024,
+        flush_interval: float = 1.0,
+        writer: Optional[LogWriter] = None,
+    ):
         """Initialize the game logger.
         
         Args:
             game_id: Unique identifier for the game
             logs_directory: Directory path for log files
+            log_format: "jsonl" (append-only) or "json" (single document)
+            flush_bytes: Buffered bytes that trigger a write (jsonl only)
+            flush_interval: Max seconds an event stays buffered (jsonl only)
+            writer: Background writer that performs the file I/O; if None,
+                entries are written inline
         """
         self.game_id = game_id
         self.logs_directory = Path(logs_directory)
-        self.entries: list[dict] = []
+        self.log_format = log_format
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.writer = writer
+        self.entries: list[dict] = []  # Only used by the "json" format
         self._closed = False
         
+        # Pending JSON lines not yet written (jsonl format)
+        self._buffer: list[str] = []
+        self._buffered_bytes = 0
+        self._last_flush = time.monotonic()
+        self._header_written = False
+        
         # Create logs directory if it doesn't exist
         self.logs_directory.mkdir(parents=True, exist_ok=True)
         
         # Create log filename with timestamp
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.log_filename = f"game_{game_id[:8]}_{timestamp}.json"
+        extension = "jsonl" if log_format == "jsonl" else "json"
+        self.log_filename = f"game_{game_id[:8]}_{timestamp}.{extension}"
         self.log_path = self.logs_directory / self.log_filename
     
     def _create_entry(
@@ -86,9 +367,54 @@ class GameLogger:
         if self._closed:
             return
         
+        if self.writer is not None:
+            self.writer.submit(self, entry)
+        else:
+            self._append(entry)
+    
+    def _append(self, entry: dict) -> None:
+        """Write or buffer an entry (runs on the writer thread if there is one)."""
+        if self.log_format == "jsonl":
+            line = json.dumps(entry, ensure_ascii=False, default=str)
+            self._buffer.append(line)
+            self._buffered_bytes += len(line) + 1
+            if (self._buffered_bytes >= self.flush_bytes
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush_buffer()
+            return
+        
         self.entries.append(entry)
         self._save_to_file()
     
+    def flush(self) -> None:
+        """Write out all pending events."""
+        if self.writer is not None:
+            self.writer.flush()
+        else:
+            self._flush_buffer()
+    
+    def _flush_buffer(self) -> None:
+        """Append buffered events to the log file (jsonl format)."""
+        self._last_flush = time.monotonic()
+        if not self._buffer and self._header_written:
+            return
+        lines = self._buffer
+        self._buffer = []
+        self._buffered_bytes = 0
+        try:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                if not self._header_written:
+                    f.write(json.dumps({
+                        "game_id": self.game_id,
+                        "log_file": self.log_filename,
+                    }, ensure_ascii=False) + "\n")
+                    self._header_written = True
+                if lines:
+                    f.write("\n".join(lines) + "\n")
+        except Exception as e:
+            # Don't crash the game if logging fails
+            print(f"Warning: Failed to write game log: {e}")
+    
     def _save_to_file(self) -> None:
         """Save all entries to the log file."""
         try:
@@ -105,8 +431,18 @@ class GameLogger:
     def close(self) -> None:
         """Close the logger and finalize the log file."""
         if not self._closed:
-            self._save_to_file()
             self._closed = True
+            if self.writer is not None:
+                self.writer.close_logger(self)
+            else:
+                self._finalize()
+    
+    def _finalize(self) -> None:
+        """Write everything still pending to the log file."""
+        if self.log_format == "jsonl":
+            self._flush_buffer()
+        else:
+            self._save_to_file()
     
     # ============ Game Lifecycle Events ============
     
@@ -0,0 +1,287 @@
+"""Exact combat odds.
+
+resolve_combat rolls 2d6 per side; Excalibur takes the best of two rolls
+and an opponent's Poisoned Arrows halves the roll (rounded down). Once
+those are known, every other part of a side's strength is a fixed
+modifier, so the chance of winning depends only on the four card flags and
+the difference between the modifiers. For each flag combination the exact
+distribution of the roll difference is worked out once and kept as a table
+of win probabilities by modifier difference; evaluating a combat is then a
+table lookup.
+
+Modifiers are everything in a side's strength except the dice (strength -
+roll in a CombatResult): soldiers / 100, holding and fortification
+bonuses. Duel and Talented Commander don't change the odds, only what the
+sides commit and lose.
+
+best_defender_commitment() uses the same tables to pick how many soldiers
+an AI defender commits: the commitment with the best expected value of
+keeping the holding minus the soldiers it expects to lose.
+
+Usage:
+    odds = combat_odds(state, attacker_id, target_id, soldiers, source_id)
+    if odds.win_probability > 0.6: ...
+"""
+from functools import lru_cache
+from typing import Iterable, NamedTuple, Optional
+
+from app.config import get_settings
+from app.models.schemas import CardEffect, GameState
+from app.game.combat import (
+    calculate_attack_bonus, calculate_defense_bonus, calculate_target_fortification_bonus,
+    calculate_title_combat_bonus, calculate_winner_losses, combat_card_effects,
+    committed_defender_soldiers,
+)
+
+
+# Final rolls range from 1 (a halved 2 or 3) to 12, so roll differences span -11..11
+_MAX_DIFF = 11
+
+
+class CombatOdds(NamedTuple):
+    """Exact odds of a combat, as resolve_combat would fight it."""
+    win_probability: float
+    attacker_expected_losses: float
+    defender_expected_losses: float
+    attack_modifier: int
+    defense_modifier: int
+    attacker_soldiers: int
+    defender_soldiers: int
+
+
+@lru_cache(maxsize=None)
+def roll_distribution(excalibur: bool = False, halved: bool = False) -> dict[int, float]:
+    """Exact distribution of one side's final combat roll.
+
+    Args:
+        excalibur: Best of two 2d6 rolls
+        halved: Roll halved (rounded down) by the opponent's Poisoned Arrows
+
+    Returns:
+        Probability of each roll value
+    """
+    two_d6 = {total: (6 - abs(total - 7)) / 36 for total in range(2, 13)}
+    rolls = two_d6
+    if excalibur:
+        rolls = {}
+        for first, p_first in two_d6.items():
+            for second, p_second in two_d6.items():
+                best = max(first, second)
+                rolls[best] = rolls.get(best, 0.0) + p_first * p_second
+    if halved:
+        halves: dict[int, float] = {}
+        for total, p in rolls.items():
+            halves[total // 2] = halves.get(total // 2, 0.0) + p
+        rolls = halves
+    return rolls
+
+
+@lru_cache(maxsize=None)
+def _win_table(
+    attacker_excalibur: bool, attacker_halved: bool,
+    defender_excalibur: bool, defender_halved: bool,
+) -> tuple[float, ...]:
+    """P(attacker roll - defender roll > margin) for margin = -_MAX_DIFF.._MAX_DIFF."""
+    diffs = [0.0] * (2 * _MAX_DIFF + 1)
+    for attacker_roll, p_attacker in roll_distribution(attacker_excalibur, attacker_halved).items():
+        for defender_roll, p_defender in roll_distribution(defender_excalibur, defender_halved).items():
+            diffs[attacker_roll - defender_roll + _MAX_DIFF] += p_attacker * p_defender
+    # Suffix sums: the chance the difference beats each margin
+    table = []
+    above = 0.0
+    for p in reversed(diffs):
+        table.append(above)
+        above += p
+    return tuple(reversed(table))
+
+
+def _roll_flags(attacker_effects: Iterable[CardEffect], defender_effects: Iterable[CardEffect]) -> tuple[bool, ...]:
+    attacker_effects = set(attacker_effects)
+    defender_effects = set(defender_effects)
+    return (
+        CardEffect.EXCALIBUR in attacker_effects,
+        CardEffect.POISONED_ARROWS in defender_effects,
+        CardEffect.EXCALIBUR in defender_effects,
+        CardEffect.POISONED_ARROWS in attacker_effects,
+    )
+
+
+def win_probability(
+    attack_modifier: int,
+    defense_modifier: int,
+    attacker_effects: Iterable[CardEffect] = (),
+    defender_effects: Iterable[CardEffect] = (),
+) -> float:
+    """Exact probability that the attacker wins (the defender wins ties).
+
+    Args:
+        attack_modifier: Attacker's strength without the dice
+        defense_modifier: Defender's strength without the dice
+        attacker_effects: Combat effects the attacker selected
+        defender_effects: Combat effects the defender selected (leave empty
+            for an unowned holding; resolve_combat ignores them there)
+    """
+    margin = defense_modifier - attack_modifier
+    if margin < -_MAX_DIFF:
+        return 1.0
+    if margin >= _MAX_DIFF:
+        return 0.0
+    return _win_table(*_roll_flags(attacker_effects, defender_effects))[margin + _MAX_DIFF]
+
+
+def expected_losses(
+    attacker_soldiers: int,
+    defender_soldiers: int,
+    attack_modifier: int,
+    defense_modifier: int,
+    attacker_effects: Iterable[CardEffect] = (),
+    defender_effects: Iterable[CardEffect] = (),
+) -> tuple[float, float]:
+    """Expected soldier losses of (attacker, defender).
+
+    Soldier counts are the committed ones; with Duel nobody loses anything.
+    The modifiers are as for win_probability (with Duel they shouldn't
+    include soldiers).
+    """
+    attacker_effects = list(attacker_effects)
+    defender_effects = list(defender_effects)
+    if CardEffect.DUEL in attacker_effects:
+        return 0.0, 0.0
+    p = win_probability(attack_modifier, defense_modifier, attacker_effects, defender_effects)
+    attacker = p * calculate_winner_losses(attacker_soldiers, attacker_effects) + (1 - p) * attacker_soldiers
+    defender = p * defender_soldiers + (1 - p) * calculate_winner_losses(defender_soldiers, defender_effects)
+    return attacker, defender
+
+
+def combat_odds(
+    state: GameState,
+    attacker_id: str,
+    target_holding_id: str,
+    attacker_soldiers: int,
+    source_holding_id: str | None = None,
+    attacker_cards: list[str] | None = None,
+    defender_cards: list[str] | None = None,
+    defender_soldiers_override: int | None = None,
+) -> Optional[CombatOdds]:
+    """Exact odds of a combat, taking the same arguments as resolve_combat.
+
+    Commitment limits aren't checked; returns None if the attacker or
+    target doesn't exist.
+    """
+    attacker = state.get_player(attacker_id)
+    holding = state.get_holding(target_holding_id)
+    if not attacker or not holding:
+        return None
+
+    defender_id = holding.owner_id
+    defender = state.get_player(defender_id) if defender_id else None
+    defender_soldiers = committed_defender_soldiers(defender, attacker_soldiers, defender_soldiers_override)
+
+    attacker_effects = combat_card_effects(state, attacker_cards)
+    defender_effects = combat_card_effects(state, defender_cards) if defender else []
+    if CardEffect.DUEL in attacker_effects:
+        attacker_soldiers = 0
+        defender_soldiers = 0
+
+    attack_modifier = (
+        attacker_soldiers // 100
+        + calculate_attack_bonus(state, source_holding_id, attacker_id)
+        + calculate_target_fortification_bonus(holding, attacker_id)
+        + calculate_title_combat_bonus(state, attacker_id, target_holding_id, is_defending=False)
+    )
+    defense_modifier = (
+        defender_soldiers // 100
+        + calculate_defense_bonus(state, target_holding_id, defender_id)
+        + (calculate_title_combat_bonus(state, defender_id, target_holding_id, is_defending=True) if defender else 0)
+    )
+
+    p = win_probability(attack_modifier, defense_modifier, attacker_effects, defender_effects)
+    attacker_losses, defender_losses = expected_losses(
+        attacker_soldiers, defender_soldiers, attack_modifier, defense_modifier,
+        attacker_effects, defender_effects,
+    )
+    return CombatOdds(
+        win_probability=p,
+        attacker_expected_losses=attacker_losses,
+        defender_expected_losses=defender_losses,
+        attack_modifier=attack_modifier,
+        defense_modifier=defense_modifier,
+        attacker_soldiers=attacker_soldiers,
+        defender_soldiers=defender_soldiers,
+    )
+
+
+def best_defender_commitment(
+    available: int,
+    attack_modifier: int,
+    defense_modifier: int,
+    attacker_effects: Iterable[CardEffect] = (),
+    defender_effects: Iterable[CardEffect] = (),
+    holding_value: float | None = None,
+    reserve_weight: float | None = None,
+) -> int:
+    """Soldier commitment that maximizes a defender's expected value.
+
+    The value of a commitment is holding_value * P(holding kept) minus
+    reserve_weight * expected soldiers lost. A higher reserve weight keeps
+    more of the army back for later threats; 0 commits whatever gives the
+    best odds. Candidates are multiples of 100 (what the soldier bonus
+    counts) and the whole army; ties go to the smaller commitment.
+
+    Args:
+        available: Soldiers the defender has
+        attack_modifier: Attacker's strength without the dice
+        defense_modifier: Defender's strength without the dice or soldiers
+        attacker_effects: Combat effects the attacker selected
+        defender_effects: Combat effects the defender selected
+        holding_value: Worth of the holding in soldiers (defaults to settings)
+        reserve_weight: Cost of each soldier lost (defaults to settings)
+    """
+    attacker_effects = set(attacker_effects)
+    defender_effects = set(defender_effects)
+    if available <= 0 or CardEffect.DUEL in attacker_effects:
+        return 0  # Soldiers don't fight in a duel
+    if holding_value is None or reserve_weight is None:
+        settings = get_settings()
+        holding_value = settings.ai_defense_holding_value if holding_value is None else holding_value
+        reserve_weight = settings.ai_defense_reserve_weight if reserve_weight is None else reserve_weight
+    return _best_commitment(
+        available, attack_modifier, defense_modifier,
+        _roll_flags(attacker_effects, defender_effects),
+        CardEffect.TALENTED_COMMANDER in defender_effects,
+        holding_value, reserve_weight,
+    )
+
+
+@lru_cache(maxsize=4096)
+def _best_commitment(
+    available: int,
+    attack_modifier: int,
+    defense_modifier: int,
+    roll_flags: tuple[bool, ...],
+    talented_commander: bool,
+    holding_value: float,
+    reserve_weight: float,
+) -> int:
+    table = _win_table(*roll_flags)
+    winner_effects = [CardEffect.TALENTED_COMMANDER] if talented_commander else []
+    candidates = list(range(0, available + 1, 100))
+    if candidates[-1] != available:
+        candidates.append(available)
+
+    best, best_value = 0, float("-inf")
+    for soldiers in candidates:
+        margin = defense_modifier + soldiers // 100 - attack_modifier
+        if margin < -_MAX_DIFF:
+            p_lost = 1.0
+        elif margin >= _MAX_DIFF:
+            p_lost = 0.0
+        else:
+            p_lost = table[margin + _MAX_DIFF]
+        losses = p_lost * soldiers + (1 - p_lost) * calculate_winner_losses(soldiers, winner_effects)
+        value = holding_value * (1 - p_lost) - reserve_weight * losses
+        if value > best_value:
+            best, best_value = soldiers, value
+        if p_lost == 0.0:
+            break  # More soldiers can't do better than a sure win
+    return best
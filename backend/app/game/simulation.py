@@ -0,0 +1,1204 @@
+"""Headless game simulation for AI-vs-AI batch runs.
+
+A compact re-implementation of the rules in engine.py, state.py and combat.py
+for games where nobody is watching: players, holdings and cards are plain
+slotted objects and integer indexes instead of pydantic models, nothing is
+saved, logged or recorded, and policies are plain functions instead of async
+AI players.
+
+Games are bit-for-bit compatible with the reference engine: a headless game
+created with seed S makes the same legal actions available, consumes the
+same random streams (`f"{seed}:{counter}"`) and ends in the same state as a
+`create_game(..., seed=S)` game fed the same actions, all players being AI.
+tests/test_game.py cross-checks the two step by step; any rule change in the
+engine must be mirrored here.
+
+Usage:
+    results = simulate(1000, ["simple"] * 4, seed=1)
+
+    # Same games spread over a process pool, yielded as each one finishes
+    for result in run_batch(1000, ["simple"] * 4, seed=1):
+        ...
+"""
+import asyncio
+import multiprocessing
+import os
+import random
+import threading
+from bisect import insort
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Iterator, NamedTuple, Optional, Sequence, Union
+
+from app.config import get_settings
+from app.models.schemas import (
+    Action, ActionType, CardEffect, CardType, GamePhase, HoldingType,
+    SimulationResult, TitleType,
+)
+from app.game.board import ADJACENCY, CAPITOLS, create_board, get_board_masks
+from app.game.cards import create_deck
+from app.game.odds import best_defender_commitment
+
+
+# Victory threshold set by create_game()
+VICTORY_THRESHOLD = 20
+
+COUNTIES = ("X", "U", "V", "Q")
+DUCHIES = ("XU", "QV")
+DUCHY_COUNTIES = {"XU": ("X", "U"), "QV": ("Q", "V")}
+
+ARMY_CAPS = {
+    TitleType.BANDIT: 700,
+    TitleType.BARON: 500,
+    TitleType.COUNT: 800,
+    TitleType.DUKE: 1200,
+    TitleType.KING: 2000,
+}
+
+TITLE_TIERS = {
+    TitleType.BANDIT: -1, TitleType.BARON: 0, TitleType.COUNT: 1,
+    TitleType.DUKE: 2, TitleType.KING: 3,
+}
+
+COMBAT_EFFECTS = (
+    CardEffect.EXCALIBUR, CardEffect.POISONED_ARROWS,
+    CardEffect.TALENTED_COMMANDER, CardEffect.DUEL,
+)
+
+# Actions that can change someone's prestige
+PRESTIGE_ACTIONS = frozenset({ActionType.CLAIM_TITLE, ActionType.CLAIM_TOWN, ActionType.ATTACK})
+
+GOLD_EFFECTS = {
+    CardEffect.GOLD_5: 5, CardEffect.GOLD_10: 10,
+    CardEffect.GOLD_15: 15, CardEffect.GOLD_25: 25,
+}
+
+SOLDIER_EFFECTS = {
+    CardEffect.SOLDIERS_100: 100, CardEffect.SOLDIERS_200: 200,
+    CardEffect.SOLDIERS_300: 300,
+}
+
+CLAIM_COUNTIES = {
+    CardEffect.CLAIM_X: "X", CardEffect.CLAIM_U: "U",
+    CardEffect.CLAIM_V: "V", CardEffect.CLAIM_Q: "Q",
+}
+
+
+def _fort_bonus(forts: int) -> int:
+    """Combat bonus from a player's fortifications on a holding (+1, then +2)."""
+    return (1 if forts >= 1 else 0) + (2 if forts >= 2 else 0)
+
+
+# ============ Static Tables ============
+
+class _Board:
+    """Holding attributes by board index."""
+
+    def __init__(self):
+        holdings = create_board()
+        self.ids = [h.id for h in holdings]
+        self.index = {hid: i for i, hid in enumerate(self.ids)}
+        self.types = [h.holding_type for h in holdings]
+        self.counties = [h.county for h in holdings]
+        self.duchies = [h.duchy for h in holdings]
+        self.gold = [h.gold_value for h in holdings]
+        self.soldiers = [h.soldier_value for h in holdings]
+        self.defense = [h.defense_modifier for h in holdings]
+        self.attack = [h.attack_modifier for h in holdings]
+        self.adjacent = [[self.index[a] for a in ADJACENCY.get(hid, [])] for hid in self.ids]
+        self.is_town = [t == HoldingType.TOWN for t in self.types]
+        self.towns = [i for i, town in enumerate(self.is_town) if town]
+        self.county_towns = {
+            c: [i for i in self.towns if self.counties[i] == c] for c in COUNTIES
+        }
+        self.duchy_towns = {
+            d: [i for c in DUCHY_COUNTIES[d] for i in self.county_towns[c]] for d in DUCHIES
+        }
+        self.county_castle = {c: self.index[f"{c.lower()}_castle"] for c in COUNTIES}
+        self.duchy_castle = {d: self.index[f"{d.lower()}_castle"] for d in DUCHIES}
+        self.king_castle = self.index["king_castle"]
+        self.capitols = {c: self.index[CAPITOLS[c]] for c in COUNTIES}
+        # Bitmasks share bit positions with board indexes (both follow create_board())
+        masks = get_board_masks()
+        self.bit = [1 << i for i in range(len(self.ids))]
+        self.adjacent_mask = [masks.adjacent[hid] for hid in self.ids]
+        self.towns_mask = masks.towns
+        self.county_towns_mask = masks.county_towns
+        self.duchy_towns_mask = masks.duchy_towns
+
+
+@lru_cache(maxsize=1)
+def _board() -> _Board:
+    return _Board()
+
+
+class _Deck:
+    """Card attributes by card index, built from the current deck settings."""
+
+    def __init__(self):
+        cards = create_deck()
+        self.ids = [c.id for c in cards]
+        self.index = {cid: i for i, cid in enumerate(self.ids)}
+        self.types = [c.card_type for c in cards]
+        self.effects = [c.effect for c in cards]
+        self.instant = [
+            t in (CardType.PERSONAL_EVENT, CardType.GLOBAL_EVENT) for t in self.types
+        ]
+
+
+# ============ Game Objects ============
+
+class SimAction(NamedTuple):
+    """A compact action: holdings and cards are board/deck indexes."""
+    kind: ActionType
+    source: Optional[int] = None
+    target: Optional[int] = None
+    soldiers: Optional[int] = None
+    card: Optional[int] = None
+
+
+END_TURN = SimAction(ActionType.END_TURN)
+
+
+class SimPlayer:
+    """A player's mutable state."""
+
+    __slots__ = ("gold", "soldiers", "title", "counties", "duchies", "is_king",
+                 "holdings", "hand", "forts_placed", "claims", "effects",
+                 "big_war", "towns")
+
+    def __init__(self):
+        self.gold = 0
+        self.soldiers = 0
+        self.title = TitleType.BARON
+        self.counties: list[str] = []
+        self.duchies: list[str] = []
+        self.is_king = False
+        self.holdings: list[int] = []    # Player.holdings (castles claimed by title aren't listed)
+        self.hand: list[int] = []
+        self.forts_placed = 0
+        self.claims: list[int] = []
+        self.effects: list[CardEffect] = []
+        self.big_war = False
+        self.towns = 0                   # Towns owned, per the ownership index
+
+    @property
+    def army_cap(self) -> int:
+        cap = ARMY_CAPS[self.title]
+        return cap * 2 if self.big_war else cap
+
+    @property
+    def prestige(self) -> int:
+        return (self.towns + 2 * len(self.counties) + 4 * len(self.duchies)
+                + (6 if self.is_king else 0))
+
+
+class SimGame:
+    """One headless game, from setup to game over."""
+
+    def __init__(self, n_players: int, seed: int, deck: Optional[_Deck] = None):
+        """Create, set up and start a game, ready for its first income phase.
+
+        Args:
+            n_players: Number of players (4-6)
+            seed: Game seed (same meaning as create_game's seed)
+            deck: Card tables (defaults to the current deck settings)
+        """
+        if n_players < 4 or n_players > 6:
+            raise ValueError("Game requires 4-6 players")
+        self.board = board = _board()
+        self.deck_info = deck = deck or _Deck()
+        self.seed = seed
+        self.rng_counter = 0
+        # Separate stream for randomized policies, so they never shift the game's rolls
+        self.policy_rng = random.Random(f"{seed}:policy")
+
+        self.players = [SimPlayer() for _ in range(n_players)]
+        n_holdings = len(board.ids)
+        self.owner = [-1] * n_holdings
+        self.owned_by: list[list[int]] = [[] for _ in range(n_players)]  # Board order
+        self.owned_mask = [0] * n_players
+        self.occupied = 0
+        self.fort_count = [0] * n_holdings
+        self.forts = [[0] * n_players for _ in range(n_holdings)]
+
+        # Deck is stored reversed so drawing from the top is a pop()
+        order = list(range(len(deck.ids)))
+        random.Random(f"{seed}:deck").shuffle(order)
+        order.reverse()
+        self.deck = order
+        self.discard: list[int] = []
+
+        self.round = 1
+        self.current = 0
+        self.phase = GamePhase.SETUP
+        self.war_fought = False
+        self.forbid_mercenaries = False
+        self.enforce_peace = False
+        self.combats = 0
+
+        self._assign_starting_towns()
+        self.phase = GamePhase.INCOME
+
+    # ============ Randomness ============
+
+    def next_rng(self) -> random.Random:
+        """Same streams as GameState.next_rng()."""
+        rng = random.Random(f"{self.seed}:{self.rng_counter}")
+        self.rng_counter += 1
+        return rng
+
+    def _roll(self, rng: random.Random) -> int:
+        return rng.randint(1, 6) + rng.randint(1, 6)
+
+    # ============ Setup ============
+
+    def _assign_starting_towns(self) -> None:
+        settings = get_settings()
+        board = self.board
+        if settings.starting_town_mode == "fixed":
+            fixed = settings.fixed_starting_towns
+            if len(fixed) < len(self.players):
+                raise ValueError("Not enough fixed starting towns")
+            towns = [board.index[town_id] for town_id in fixed[:len(self.players)]]
+        else:
+            towns = list(board.towns)
+            self.next_rng().shuffle(towns)
+        for p, player in enumerate(self.players):
+            town = towns[p]
+            self._set_owner(town, p)
+            player.holdings.append(town)
+
+    # ============ Queries ============
+
+    def _set_owner(self, h: int, p: int) -> None:
+        previous = self.owner[h]
+        if previous == p:
+            return
+        if self.board.is_town[h]:
+            if previous >= 0:
+                self.players[previous].towns -= 1
+            if p >= 0:
+                self.players[p].towns += 1
+        bit = self.board.bit[h]
+        if previous >= 0:
+            self.owned_by[previous].remove(h)
+            self.owned_mask[previous] &= ~bit
+        if p >= 0:
+            insort(self.owned_by[p], h)
+            self.owned_mask[p] |= bit
+            self.occupied |= bit
+        else:
+            self.occupied &= ~bit
+        self.owner[h] = p
+
+    def owned(self, p: int) -> list[int]:
+        """Holdings owned by a player, in board order (don't modify the list)."""
+        return self.owned_by[p]
+
+    def _towns_in(self, p: int, towns: int) -> int:
+        """Count the player's holdings in a bitmask."""
+        return (self.owned_mask[p] & towns).bit_count()
+
+    def can_claim_count(self, p: int, county: str) -> bool:
+        board = self.board
+        if self._towns_in(p, board.county_towns_mask[county]) >= 2:
+            return True
+        capitol = board.capitols[county]
+        return self.owner[capitol] == p and self.forts[capitol][p] >= 1
+
+    def can_claim_duke(self, p: int, duchy: str) -> bool:
+        counties = self.players[p].counties
+        first, second = DUCHY_COUNTIES[duchy]
+        county_towns = self.board.county_towns_mask
+        if first in counties:
+            return self._towns_in(p, county_towns[second]) >= 1
+        if second in counties:
+            return self._towns_in(p, county_towns[first]) >= 1
+        return False
+
+    def can_claim_king(self, p: int) -> bool:
+        duchies = self.players[p].duchies
+        if not duchies:
+            return False
+        if len(duchies) >= 2:
+            return True
+        other = "QV" if "XU" in duchies else "XU"
+        return self._towns_in(p, self.board.duchy_towns_mask[other]) >= 1
+
+    def _has_valid_claim(self, p: int, h: int) -> bool:
+        player = self.players[p]
+        board = self.board
+        if player.title == TitleType.BANDIT:
+            return board.is_town[h]
+        if board.is_town[h]:
+            return h in player.claims
+        kind = board.types[h]
+        if kind == HoldingType.COUNTY_CASTLE and board.counties[h]:
+            if self.can_claim_count(p, board.counties[h]):
+                return True
+        if kind == HoldingType.DUCHY_CASTLE and board.duchies[h]:
+            if self.can_claim_duke(p, board.duchies[h]):
+                return True
+        if h == board.king_castle and self.can_claim_king(p):
+            return True
+        return h in player.claims
+
+    def _can_attack(self, p: int, h: int) -> bool:
+        """Vassal protection: holdings in the player's domain need Vassal Revolt."""
+        player = self.players[p]
+        county = self.board.counties[h]
+        in_domain = player.is_king or county in player.counties
+        if not in_domain:
+            for duchy in player.duchies:
+                if county in DUCHY_COUNTIES[duchy] or self.board.duchies[h] == duchy:
+                    in_domain = True
+                    break
+        return not in_domain or CardEffect.VASSAL_REVOLT in player.effects
+
+    def title_targets(self, p: int) -> list[int]:
+        """Castles the player can claim a title on right now."""
+        player = self.players[p]
+        board = self.board
+        owner = self.owner
+        targets = []
+        if player.gold >= 25:
+            for county in COUNTIES:
+                castle = board.county_castle[county]
+                if (county not in player.counties and owner[castle] < 0
+                        and self.can_claim_count(p, county)):
+                    targets.append(castle)
+        if player.gold >= 50:
+            for duchy in DUCHIES:
+                castle = board.duchy_castle[duchy]
+                if (duchy not in player.duchies and owner[castle] < 0
+                        and self.can_claim_duke(p, duchy)):
+                    targets.append(castle)
+        if (player.gold >= 75 and not player.is_king
+                and owner[board.king_castle] < 0 and self.can_claim_king(p)):
+            targets.append(board.king_castle)
+        return targets
+
+    def attack_options(self, p: int) -> list[tuple[Optional[int], int]]:
+        """(source, target) pairs the player can attack right now."""
+        player = self.players[p]
+        if player.soldiers < 200 or self.war_fought or self.enforce_peace:
+            return []
+        board = self.board
+        bit = board.bit
+        foreign = self.occupied & ~self.owned_mask[p]
+        options: list[tuple[Optional[int], int]] = []
+        if player.title == TitleType.BANDIT:
+            for h in board.towns:
+                if bit[h] & foreign:
+                    options.append((None, h))
+            return options
+
+        owned = self.owned(p)
+        added = set()
+        for h in owned:
+            if not board.adjacent_mask[h] & foreign:
+                continue
+            for adj in board.adjacent[h]:
+                if (bit[adj] & foreign and adj not in added
+                        and self._has_valid_claim(p, adj) and self._can_attack(p, adj)):
+                    options.append((h, adj))
+                    added.add(adj)
+        if owned:
+            for claim in player.claims:
+                if (claim not in added and bit[claim] & foreign
+                        and self._can_attack(p, claim)):
+                    options.append((owned[0], claim))
+                    added.add(claim)
+        return options
+
+    def claim_town_targets(self, p: int) -> list[int]:
+        player = self.players[p]
+        if player.gold < 10:
+            return []
+        owner = self.owner
+        return [h for h in self.board.towns if owner[h] < 0 and h in player.claims]
+
+    def fake_claim_targets(self, p: int) -> list[int]:
+        player = self.players[p]
+        if player.gold < 35:
+            return []
+        owner = self.owner
+        return [h for h in self.board.towns if owner[h] != p and h not in player.claims]
+
+    def fortify_targets(self, p: int) -> list[int]:
+        player = self.players[p]
+        if player.gold < 10 or player.forts_placed >= 4:
+            return []
+        fort_count, forts = self.fort_count, self.forts
+        return [h for h in self.board.towns if fort_count[h] < 3 and forts[h][p] < 2]
+
+    def legal_actions(self, p: int) -> list[SimAction]:
+        """All valid actions, in the same order as GameEngine.get_valid_actions()."""
+        if p != self.current or self.phase != GamePhase.PLAYER_TURN:
+            return []
+        player = self.players[p]
+        board = self.board
+        owner = self.owner
+        actions: list[SimAction] = []
+
+        owned = self.owned(p)
+        owned_mask = self.owned_mask[p]
+        for h in owned:
+            if not board.adjacent_mask[h] & owned_mask:
+                continue
+            for adj in board.adjacent[h]:
+                if owner[adj] == p:
+                    actions.append(SimAction(ActionType.MOVE, h, adj))
+        if owned:
+            actions.append(SimAction(ActionType.RECRUIT))
+
+        for h in self.fortify_targets(p):
+            actions.append(SimAction(ActionType.BUILD_FORTIFICATION, None, h))
+
+        if player.gold >= 10:
+            forts = self.forts
+            for src in range(len(owner)):
+                if forts[src][p] > 0:
+                    for tgt in board.towns:
+                        if tgt != src and self.fort_count[tgt] < 3 and forts[tgt][p] < 2:
+                            actions.append(SimAction(ActionType.RELOCATE_FORTIFICATION, src, tgt))
+
+        for h in self.title_targets(p):
+            actions.append(SimAction(ActionType.CLAIM_TITLE, None, h))
+        for src, tgt in self.attack_options(p):
+            actions.append(SimAction(ActionType.ATTACK, src, tgt))
+        for h in self.claim_town_targets(p):
+            actions.append(SimAction(ActionType.CLAIM_TOWN, None, h))
+        for h in self.fake_claim_targets(p):
+            actions.append(SimAction(ActionType.FAKE_CLAIM, None, h))
+
+        instant = self.deck_info.instant
+        for card in player.hand:
+            if not instant[card]:
+                actions.append(SimAction(ActionType.PLAY_CARD, card=card))
+
+        actions.append(END_TURN)
+        return actions
+
+    @property
+    def is_over(self) -> bool:
+        return self.phase == GamePhase.GAME_OVER
+
+    def winner(self) -> Optional[int]:
+        """Winner by the same tie-breaks as get_winner(), once the game is over."""
+        if not self.is_over:
+            return None
+        return min(
+            range(len(self.players)),
+            key=lambda p: (
+                -self.players[p].prestige, -TITLE_TIERS[self.players[p].title],
+                -self.players[p].gold, -self.players[p].soldiers,
+            ),
+        )
+
+    # ============ Game Flow ============
+
+    def _income(self, p: int) -> tuple[int, int]:
+        player = self.players[p]
+        if player.title == TitleType.BANDIT:
+            return 3, 200
+        board = self.board
+        gold = soldiers = 0
+        for h in player.holdings:
+            gold += board.gold[h]
+            soldiers += board.soldiers[h]
+            forts = self.forts[h][p]
+            if forts >= 1:
+                gold += 2
+            if forts >= 2:
+                gold += 5
+        if player.title == TitleType.COUNT:
+            gold += 2 * len(player.counties)
+        elif player.title == TitleType.DUKE:
+            gold += 4 * len(player.duchies)
+        elif player.is_king:
+            gold += 8
+        return gold, soldiers
+
+    def apply_income(self) -> None:
+        """Income phase: pay everyone, then start the round's first turn."""
+        if self.phase != GamePhase.INCOME:
+            raise ValueError("Not in income phase")
+        income = [self._income(p) for p in range(len(self.players))]
+        for player, (gold, soldiers) in zip(self.players, income):
+            player.gold += gold
+            player.soldiers = min(player.soldiers + soldiers, player.army_cap)
+        self.phase = GamePhase.PLAYER_TURN
+        self.current = 0
+        self.war_fought = False
+        self.forbid_mercenaries = False
+        self.enforce_peace = False
+        self._draw(0)
+
+    def _draw(self, p: int) -> None:
+        if not self.deck:
+            if not self.discard:
+                return
+            deck = self.discard
+            self.discard = []
+            self.next_rng().shuffle(deck)
+            deck.reverse()
+            self.deck = deck
+        card = self.deck.pop()
+        info = self.deck_info
+        if not info.instant[card]:
+            self.players[p].hand.append(card)
+            return
+
+        player = self.players[p]
+        effect = info.effects[card]
+        if effect in GOLD_EFFECTS:
+            player.gold += GOLD_EFFECTS[effect]
+        elif effect in SOLDIER_EFFECTS:
+            player.soldiers = min(player.soldiers + SOLDIER_EFFECTS[effect], player.army_cap)
+        elif effect == CardEffect.RAIDERS:
+            player.gold = max(0, player.gold - self._income(p)[0])
+        elif effect == CardEffect.CRUSADE:
+            for other in self.players:
+                other.gold //= 2
+                other.soldiers = other.soldiers // 2 // 100 * 100
+        self.discard.append(card)
+
+    def _next_turn(self) -> None:
+        self.current += 1
+        if self.current < len(self.players):
+            self.war_fought = False
+            self._draw(self.current)
+            return
+        # Upkeep
+        for player in self.players:
+            player.soldiers = min(player.soldiers, player.army_cap)
+        if self._victor() is not None:
+            self.phase = GamePhase.GAME_OVER
+            return
+        self.round += 1
+        self.phase = GamePhase.INCOME
+        self.current = 0
+
+    def _victor(self) -> Optional[int]:
+        for p, player in enumerate(self.players):
+            if player.prestige >= VICTORY_THRESHOLD:
+                return p
+        return None
+
+    def perform(self, action: SimAction) -> bool:
+        """Perform an action for the current player. Returns whether it succeeded."""
+        if self.phase != GamePhase.PLAYER_TURN:
+            return False
+        handler = self._handlers.get(action.kind)
+        if handler is None:
+            return False
+        ok = handler(self, self.current, action)
+        # Prestige only moves when holdings or titles change hands
+        if ok and action.kind in PRESTIGE_ACTIONS and self._victor() is not None:
+            self.phase = GamePhase.GAME_OVER
+        return ok
+
+    # ============ Action Handlers ============
+
+    def _move(self, p: int, a: SimAction) -> bool:
+        if a.source is None or a.target is None:
+            return False
+        return (self.owner[a.source] == p and self.owner[a.target] == p
+                and a.target in self.board.adjacent[a.source])
+
+    def _recruit(self, p: int, a: SimAction) -> bool:
+        return not self.forbid_mercenaries
+
+    def _build_fortification(self, p: int, a: SimAction) -> bool:
+        player = self.players[p]
+        h = a.target
+        if (player.gold < 10 or player.forts_placed >= 4 or h is None
+                or not self.board.is_town[h] or self.fort_count[h] >= 3 or self.forts[h][p] >= 2):
+            return False
+        player.gold -= 10
+        self.fort_count[h] += 1
+        player.forts_placed += 1
+        self.forts[h][p] += 1
+        return True
+
+    def _relocate_fortification(self, p: int, a: SimAction) -> bool:
+        player = self.players[p]
+        src, tgt = a.source, a.target
+        if (src is None or tgt is None or player.gold < 10 or self.forts[src][p] <= 0
+                or not self.board.is_town[tgt] or self.fort_count[tgt] >= 3
+                or self.forts[tgt][p] >= 2):
+            return False
+        player.gold -= 10
+        self.forts[src][p] -= 1
+        self.fort_count[src] -= 1
+        self.forts[tgt][p] += 1
+        self.fort_count[tgt] += 1
+        return True
+
+    def _claim_title(self, p: int, a: SimAction) -> bool:
+        player = self.players[p]
+        board = self.board
+        h = a.target
+        if h is None:
+            return False
+        kind = board.types[h]
+        if kind == HoldingType.COUNTY_CASTLE:
+            county = board.ids[h][0].upper()
+            if not self.can_claim_count(p, county) or player.gold < 25:
+                return False
+            player.gold -= 25
+            player.counties.append(county)
+            self._set_owner(h, p)
+            if player.title == TitleType.BARON:
+                player.title = TitleType.COUNT
+            return True
+        if kind == HoldingType.DUCHY_CASTLE:
+            duchy = board.ids[h][:2].upper()
+            if not self.can_claim_duke(p, duchy) or player.gold < 50:
+                return False
+            player.gold -= 50
+            player.duchies.append(duchy)
+            self._set_owner(h, p)
+            player.title = TitleType.DUKE
+            return True
+        if kind == HoldingType.KING_CASTLE:
+            if not self.can_claim_king(p) or player.gold < 75:
+                return False
+            for other in self.players:
+                if other.is_king:
+                    other.is_king = False
+                    other.title = _fallback_title(other)
+            player.gold -= 75
+            player.is_king = True
+            player.title = TitleType.KING
+            self._set_owner(h, p)
+            return True
+        return False
+
+    def _claim_town(self, p: int, a: SimAction) -> bool:
+        player = self.players[p]
+        h = a.target
+        if (player.gold < 10 or h is None or not self.board.is_town[h]
+                or self.owner[h] >= 0 or h not in player.claims):
+            return False
+        player.claims.remove(h)
+        player.gold -= 10
+        self._set_owner(h, p)
+        player.holdings.append(h)
+        return True
+
+    def _fake_claim(self, p: int, a: SimAction) -> bool:
+        player = self.players[p]
+        h = a.target
+        if player.gold < 35 or h is None or not self.board.is_town[h] or h in player.claims:
+            return False
+        player.gold -= 35
+        player.claims.append(h)
+        return True
+
+    def _play_card(self, p: int, a: SimAction) -> bool:
+        player = self.players[p]
+        card = a.card
+        if card not in player.hand:
+            return False
+        info = self.deck_info
+        effect = info.effects[card]
+        if info.types[card] == CardType.BONUS:
+            if effect == CardEffect.BIG_WAR:
+                player.big_war = True
+            elif effect == CardEffect.ADVENTURER:
+                if player.gold < 25:
+                    return False
+                player.gold -= 25
+                player.soldiers = min(player.soldiers + 500, player.army_cap)
+            elif effect in (CardEffect.EXCALIBUR, CardEffect.POISONED_ARROWS,
+                            CardEffect.TALENTED_COMMANDER, CardEffect.VASSAL_REVOLT,
+                            CardEffect.DUEL):
+                player.effects.append(effect)
+            elif effect == CardEffect.FORBID_MERCENARIES:
+                self.forbid_mercenaries = True
+            elif effect == CardEffect.ENFORCE_PEACE:
+                self.enforce_peace = True
+            elif effect != CardEffect.SPY:
+                return False
+        elif info.types[card] == CardType.CLAIM:
+            h = a.target
+            if h is None:
+                return False
+            board = self.board
+            if effect in CLAIM_COUNTIES:
+                if board.counties[h] != CLAIM_COUNTIES[effect] or not board.is_town[h]:
+                    return False
+            elif effect == CardEffect.DUCHY_CLAIM:
+                if board.types[h] not in (HoldingType.TOWN, HoldingType.DUCHY_CASTLE,
+                                          HoldingType.KING_CASTLE):
+                    return False
+            elif effect != CardEffect.ULTIMATE_CLAIM:
+                return False
+            if h not in player.claims:
+                player.claims.append(h)
+        else:
+            return False
+        player.hand.remove(card)
+        self.discard.append(card)
+        return True
+
+    def _attack(self, p: int, a: SimAction) -> bool:
+        player = self.players[p]
+        h = a.target
+        if h is None or self.war_fought or self.enforce_peace:
+            return False
+        if not self._has_valid_claim(p, h) or not self._can_attack(p, h):
+            return False
+        soldiers = max(200, (a.soldiers or 200) // 100 * 100)
+        if player.soldiers < soldiers:
+            return False
+
+        d = self.owner[h]
+        defender = self.players[d] if d >= 0 else None
+        defender_cards: list[int] = []
+        defender_soldiers = 0
+        if defender is not None:
+            info = self.deck_info
+            defender_cards = [
+                c for c in defender.hand
+                if info.types[c] == CardType.BONUS and info.effects[c] in COMBAT_EFFECTS
+            ]
+            defender_soldiers = self._defender_commitment(
+                defender, p, h, a.source, soldiers, defender_cards
+            )
+        if h in player.claims:
+            player.claims.remove(h)
+
+        self._resolve_combat(p, d, h, a.source, soldiers, defender_soldiers, defender_cards)
+
+        if defender is not None:
+            for card in defender_cards:
+                if card in defender.hand:
+                    defender.hand.remove(card)
+                    self.discard.append(card)
+        player.big_war = False
+        self.war_fought = True
+        return True
+
+    def _defender_commitment(self, defender: SimPlayer, p: int, h: int, source: Optional[int],
+                             attacker_soldiers: int, defender_cards: list[int]) -> int:
+        """Same solver as GameEngine._ai_calculate_defender_commitment()."""
+        if defender.soldiers == 0:
+            return 0
+        attack_modifier, defense_modifier = self._combat_modifiers(p, self.owner[h], h, source)
+        effects = self.deck_info.effects
+        return best_defender_commitment(
+            defender.soldiers,
+            attack_modifier + attacker_soldiers // 100,
+            defense_modifier,
+            defender_effects=[effects[c] for c in defender_cards],
+        )
+
+    def _combat_modifiers(self, p: int, d: int, h: int, source: Optional[int]) -> tuple[int, int]:
+        """Attack and defense bonuses of a combat, without soldiers or dice."""
+        board = self.board
+        attack_bonus = _fort_bonus(self.forts[h][p])
+        if source is not None:
+            attack_bonus += board.attack[source] + _fort_bonus(self.forts[source][p])
+        defense_bonus = (1 if board.is_town[h] else 0) + board.defense[h]
+        if d >= 0:
+            defense_bonus += _fort_bonus(self.forts[h][d])
+        return attack_bonus, defense_bonus
+
+    def _resolve_combat(self, p: int, d: int, h: int, source: Optional[int],
+                        attacker_soldiers: int, defender_soldiers: int,
+                        defender_cards: list[int]) -> None:
+        """resolve_combat() + apply_combat_result() for an attack without attack cards."""
+        board = self.board
+        attacker = self.players[p]
+        defender = self.players[d] if d >= 0 else None
+        effects = self.deck_info.effects
+        defender_effects = [effects[c] for c in defender_cards]
+
+        rng = self.next_rng()
+        attacker_roll = self._roll(rng)
+        if defender is not None and CardEffect.EXCALIBUR in defender_effects:
+            defender_roll = max(self._roll(rng), self._roll(rng))
+        else:
+            defender_roll = self._roll(rng)
+        if defender is not None and CardEffect.POISONED_ARROWS in defender_effects:
+            attacker_roll //= 2
+
+        attack_bonus, defense_bonus = self._combat_modifiers(p, d, h, source)
+        attacker_strength = attacker_roll + attacker_soldiers // 100 + attack_bonus
+        defender_strength = defender_roll + defender_soldiers // 100 + defense_bonus
+        attacker_won = attacker_strength > defender_strength
+
+        if attacker_won:
+            attacker_losses = attacker_soldiers - attacker_soldiers // 2 // 100 * 100
+            defender_losses = defender_soldiers
+        else:
+            attacker_losses = attacker_soldiers
+            if defender is None or CardEffect.TALENTED_COMMANDER in defender_effects:
+                defender_losses = 0
+            else:
+                defender_losses = defender_soldiers - defender_soldiers // 2 // 100 * 100
+
+        attacker.soldiers = max(0, attacker.soldiers - attacker_losses)
+        if defender is not None:
+            defender.soldiers = max(0, defender.soldiers - defender_losses)
+        for effect in COMBAT_EFFECTS:
+            if effect in attacker.effects:
+                attacker.effects.remove(effect)
+            if defender is not None and effect in defender.effects:
+                defender.effects.remove(effect)
+
+        if attacker_won:
+            self._transfer(attacker, defender, p, h)
+
+        if board.is_town[h] and self.fort_count[h] > 0:
+            for q, forts in enumerate(self.forts[h]):
+                if forts:
+                    self.players[q].forts_placed = max(0, self.players[q].forts_placed - forts)
+            self.fort_count[h] = 0
+            self.forts[h] = [0] * len(self.players)
+        self.combats += 1
+
+    def _transfer(self, attacker: SimPlayer, defender: Optional[SimPlayer], p: int, h: int) -> None:
+        board = self.board
+        if defender is not None and h in defender.holdings:
+            defender.holdings.remove(h)
+        self._set_owner(h, p)
+        if h not in attacker.holdings:
+            attacker.holdings.append(h)
+        if attacker.title == TitleType.BANDIT and board.is_town[h]:
+            attacker.title = TitleType.BARON
+
+        kind = board.types[h]
+        if kind == HoldingType.COUNTY_CASTLE:
+            county = board.ids[h][0].upper()
+            if defender is not None and county in defender.counties:
+                defender.counties.remove(county)
+                if not defender.counties and not defender.duchies and not defender.is_king:
+                    defender.title = TitleType.BARON
+            if county not in attacker.counties:
+                attacker.counties.append(county)
+            if attacker.title in (TitleType.BANDIT, TitleType.BARON):
+                attacker.title = TitleType.COUNT
+        elif kind == HoldingType.DUCHY_CASTLE:
+            duchy = board.ids[h][:2].upper()
+            if defender is not None and duchy in defender.duchies:
+                defender.duchies.remove(duchy)
+                if not defender.duchies and not defender.is_king:
+                    defender.title = TitleType.COUNT if defender.counties else TitleType.BARON
+            if duchy not in attacker.duchies:
+                attacker.duchies.append(duchy)
+            if attacker.title in (TitleType.BANDIT, TitleType.BARON, TitleType.COUNT):
+                attacker.title = TitleType.DUKE
+        elif kind == HoldingType.KING_CASTLE:
+            if defender is not None and defender.is_king:
+                defender.is_king = False
+                defender.title = _fallback_title(defender)
+            attacker.is_king = True
+            attacker.title = TitleType.KING
+
+        if defender is not None and not defender.holdings:
+            defender.counties = []
+            defender.duchies = []
+            defender.is_king = False
+            defender.title = TitleType.BANDIT
+
+    def _end_turn(self, p: int, a: SimAction) -> bool:
+        self.players[p].effects = []
+        self._next_turn()
+        return True
+
+    _handlers: dict[ActionType, Callable[["SimGame", int, SimAction], bool]] = {
+        ActionType.MOVE: _move,
+        ActionType.RECRUIT: _recruit,
+        ActionType.BUILD_FORTIFICATION: _build_fortification,
+        ActionType.RELOCATE_FORTIFICATION: _relocate_fortification,
+        ActionType.CLAIM_TITLE: _claim_title,
+        ActionType.CLAIM_TOWN: _claim_town,
+        ActionType.ATTACK: _attack,
+        ActionType.FAKE_CLAIM: _fake_claim,
+        ActionType.PLAY_CARD: _play_card,
+        ActionType.END_TURN: _end_turn,
+    }
+
+    # ============ Conversion ============
+
+    def to_action(self, action: SimAction, player_ids: Sequence[str]) -> Action:
+        """Convert to a reference engine Action for the current player."""
+        ids = self.board.ids
+        return Action(
+            action_type=action.kind,
+            player_id=player_ids[self.current],
+            source_holding_id=ids[action.source] if action.source is not None else None,
+            target_holding_id=ids[action.target] if action.target is not None else None,
+            soldiers_count=action.soldiers,
+            card_id=self.deck_info.ids[action.card] if action.card is not None else None,
+        )
+
+
+def _fallback_title(player: SimPlayer) -> TitleType:
+    """Title left to a player who loses the crown."""
+    if player.duchies:
+        return TitleType.DUKE
+    return TitleType.COUNT if player.counties else TitleType.BARON
+
+
+# ============ Policies ============
+
+Policy = Callable[[SimGame, int], SimAction]
+
+CAPITOL_IDS = frozenset(CAPITOLS.values())
+
+
+def simple_policy(game: SimGame, p: int) -> SimAction:
+    """Headless port of SimpleAIPlayer.decide_action(); makes the same choices."""
+    player = game.players[p]
+    titles = game.title_targets(p)
+    if titles:
+        return SimAction(ActionType.CLAIM_TITLE, None, titles[0])
+
+    attacks = game.attack_options(p)
+    claim_towns = game.claim_town_targets(p)
+    if attacks:
+        source, target = attacks[0]
+        soldiers = max(300, int(player.soldiers * 0.7)) // 100 * 100
+        return SimAction(ActionType.ATTACK, source, target, soldiers)
+    if claim_towns:
+        return SimAction(ActionType.CLAIM_TOWN, None, claim_towns[0])
+
+    info = game.deck_info
+    playable = [c for c in player.hand if not info.instant[c]]
+    # No claims: a claim card first, then a fabricated claim
+    for card in playable:
+        if info.types[card] == CardType.CLAIM:
+            target = _claim_card_target(game, p, info.effects[card])
+            if target is not None:
+                return SimAction(ActionType.PLAY_CARD, None, target, card=card)
+    fake_claims = game.fake_claim_targets(p)
+    if fake_claims:
+        return SimAction(ActionType.FAKE_CLAIM, None, fake_claims[0])
+
+    for card in playable:
+        kind, effect = info.types[card], info.effects[card]
+        if kind == CardType.BONUS:
+            if effect != CardEffect.ADVENTURER or player.gold >= 25:
+                return SimAction(ActionType.PLAY_CARD, card=card)
+
+    forts = game.fortify_targets(p)
+    if forts:
+        ids = game.board.ids
+        capitols = [h for h in forts if ids[h] in CAPITOL_IDS]
+        return SimAction(ActionType.BUILD_FORTIFICATION, None, (capitols or forts)[0])
+    return END_TURN
+
+
+def _claim_card_target(game: SimGame, p: int, effect: CardEffect) -> Optional[int]:
+    """Same targeting as SimpleAIPlayer._find_claim_target()."""
+    board = game.board
+    owner = game.owner
+    claims = game.players[p].claims
+    if effect in CLAIM_COUNTIES:
+        county = CLAIM_COUNTIES[effect]
+        castle = board.county_castle[county]
+        if owner[castle] >= 0 and owner[castle] != p and castle not in claims:
+            return castle
+        for h in board.county_towns[county]:
+            if owner[h] != p and h not in claims:
+                return h
+    elif effect == CardEffect.DUCHY_CLAIM:
+        for h in board.towns:
+            if owner[h] != p and h not in claims:
+                return h
+    elif effect == CardEffect.ULTIMATE_CLAIM:
+        for h in range(len(owner)):
+            if owner[h] != p and h not in claims:
+                return h
+    return None
+
+
+def random_policy(game: SimGame, p: int) -> SimAction:
+    """Pick uniformly among the legal actions, from the game's policy stream."""
+    return game.policy_rng.choice(game.legal_actions(p))
+
+
+POLICIES: dict[str, Policy] = {
+    "simple": simple_policy,
+    "random": random_policy,
+}
+
+
+# ============ Batch API ============
+
+def play_game(game: SimGame, policies: Sequence[Policy], max_steps: int = 3000) -> SimulationResult:
+    """Play a game to the end (or max_steps actions).
+
+    A failed action ends the player's turn, so a policy that keeps choosing
+    an invalid action can't stall the game.
+    """
+    action_counts: dict[str, int] = {}
+    prestige_curve: list[list[int]] = []
+    steps = 0
+    while game.phase != GamePhase.GAME_OVER and steps < max_steps:
+        if game.phase == GamePhase.INCOME:
+            prestige_curve.append([player.prestige for player in game.players])
+            game.apply_income()
+            continue
+        p = game.current
+        action = policies[p](game, p)
+        ok = game.perform(action)
+        steps += 1
+        if ok:
+            key = action.kind.value
+            action_counts[key] = action_counts.get(key, 0) + 1
+        else:
+            game.perform(END_TURN)
+    prestige_curve.append([player.prestige for player in game.players])
+
+    return SimulationResult(
+        seed=game.seed,
+        winner=game.winner(),
+        rounds=game.round,
+        steps=steps,
+        prestige=[player.prestige for player in game.players],
+        prestige_curve=prestige_curve,
+        action_counts=action_counts,
+        combats=game.combats,
+    )
+
+
+def resolve_policies(policies: Sequence[Union[str, Policy]]) -> list[Policy]:
+    """Map policy names to functions (callables are passed through)."""
+    resolved = []
+    for policy in policies:
+        if isinstance(policy, str):
+            if policy not in POLICIES:
+                raise ValueError(f"Unknown policy: {policy}")
+            policy = POLICIES[policy]
+        resolved.append(policy)
+    return resolved
+
+
+def simulate(
+    n_games: int,
+    policies: Sequence[Union[str, Policy]],
+    seed: int = 0,
+    max_steps: int = 3000,
+) -> list[SimulationResult]:
+    """Play n_games headless games.
+
+    Args:
+        n_games: Number of games
+        policies: One policy per seat (a name from POLICIES or a function
+            taking (game, player_index) and returning a SimAction)
+        seed: Game i uses seed + i, so any game can be replayed on its own
+            or on the reference engine with create_game(..., seed=seed + i)
+        max_steps: Action limit per game
+
+    Returns:
+        One result per game, in order
+    """
+    resolved = resolve_policies(policies)
+    deck = _Deck()
+    results = []
+    for i in range(n_games):
+        game = SimGame(len(resolved), seed + i, deck)
+        results.append(play_game(game, resolved, max_steps))
+    return results
+
+
+# ============ Parallel Batches ============
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Get the shared worker pool for batch runs (created on first use).
+    
+    Workers are started fresh rather than forked: the server already runs
+    threads (log writer, store flusher) whose locks a forked child could
+    inherit while held.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = get_settings().simulation_workers or os.cpu_count() or 1
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def shutdown_process_pool() -> None:
+    """Stop the shared worker pool, dropping queued games (call on shutdown)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _play_seed(policies: Sequence[Union[str, Policy]], seed: int, max_steps: int) -> SimulationResult:
+    """Worker entry point: play the game with the given seed."""
+    return simulate(1, policies, seed, max_steps)[0]
+
+
+def submit_batch(
+    n_games: int,
+    policies: Sequence[Union[str, Policy]],
+    seed: int = 0,
+    max_steps: int = 3000,
+    executor: Optional[Executor] = None,
+) -> list[Future]:
+    """Queue one task per game on a process pool.
+
+    Arguments are the same as simulate(); policies must be names or
+    module-level functions so they can be sent to the workers.
+
+    Returns:
+        One future per game, in seed order
+    """
+    resolve_policies(policies)  # Fail here rather than in every worker
+    executor = executor or get_process_pool()
+    policies = tuple(policies)
+    return [executor.submit(_play_seed, policies, seed + i, max_steps) for i in range(n_games)]
+
+
+def run_batch(
+    n_games: int,
+    policies: Sequence[Union[str, Policy]],
+    seed: int = 0,
+    max_steps: int = 3000,
+    executor: Optional[Executor] = None,
+) -> Iterator[SimulationResult]:
+    """Play games in parallel, yielding each result as its game finishes.
+
+    Results arrive in completion order; use result.seed to tell them apart.
+    Games not yet started are cancelled if the iterator is closed early.
+    """
+    futures = submit_batch(n_games, policies, seed, max_steps, executor)
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+async def stream_batch(
+    n_games: int,
+    policies: Sequence[Union[str, Policy]],
+    seed: int = 0,
+    max_steps: int = 3000,
+    executor: Optional[Executor] = None,
+) -> AsyncIterator[SimulationResult]:
+    """Async version of run_batch() that never blocks the event loop."""
+    futures = submit_batch(n_games, policies, seed, max_steps, executor)
+    try:
+        for next_result in asyncio.as_completed([asyncio.wrap_future(f) for f in futures]):
+            yield await next_result
+    finally:
+        for future in futures:
+            future.cancel()
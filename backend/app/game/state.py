@@ -6,13 +6,20 @@ from app.models.schemas import (
     GameState, Player, PlayerType, TitleType, GamePhase,
     Holding, HoldingType, Card, Army, CardType, CardEffect, DrawnCardInfo
 )
-from app.game.board import create_board, get_towns_in_county
+from app.game.board import create_board, get_board_masks
 from app.game.cards import create_deck, shuffle_deck, is_instant_card
 from app.game.logger import create_logger, get_logger, remove_logger, GameLogger
+from app.game.storage import get_store
+from app.game.history import (
+    create_history, remove_history, record_command, recorded_shuffle, recorded_draw
+)
 
 
-# In-memory game storage
-_games: dict[str, GameState] = {}
+def logger_for(state: GameState) -> Optional[GameLogger]:
+    """Get the logger of a game, or None for detached states."""
+    if state.is_detached:
+        return None
+    return get_logger(state.id)
 
 
 def auto_draw_card(state: GameState, player: Player) -> Optional[str]:
@@ -26,7 +33,7 @@ def auto_draw_card(state: GameState, player: Player) -> Optional[str]:
         # Reshuffle discard pile if needed
         if state.discard_pile:
             state.deck = state.discard_pile.copy()
-            random.shuffle(state.deck)
+            recorded_shuffle(state, state.deck, state.next_rng().shuffle)
             state.discard_pile = []
         else:
             state.last_drawn_card = None
@@ -34,6 +41,7 @@ def auto_draw_card(state: GameState, player: Player) -> Optional[str]:
     
     card_id = state.deck.pop(0)
     card = state.cards.get(card_id)
+    recorded_draw(state, player.id, card_id)
     
     if not card:
         state.last_drawn_card = None
@@ -57,7 +65,7 @@ def auto_draw_card(state: GameState, player: Player) -> Optional[str]:
     )
     
     # Log the card draw
-    logger = get_logger(state.id)
+    logger = logger_for(state)
     effect_applied = None
     
     # Check if instant card (personal/global events)
@@ -136,11 +144,15 @@ def _apply_instant_card_effect(state: GameState, player: Player, card: Card) ->
                 p.soldiers = (p.soldiers // 2 // 100) * 100  # Half, then round down to 100
 
 
-def create_game(player_configs: list[dict]) -> GameState:
+def create_game(player_configs: list[dict], seed: Optional[int] = None) -> GameState:
     """Create a new game with the given player configurations.
     
     Args:
         player_configs: List of dicts with keys: name, player_type, color
+        seed: Seed for the game's random streams. With a seed, the deck
+            order, town assignment and every dice roll are reproducible
+            (game and player IDs are always unique). Without one, a seed is
+            drawn from the global random module.
     
     Returns:
         New GameState
@@ -149,6 +161,7 @@ def create_game(player_configs: list[dict]) -> GameState:
     if player_count < 4 or player_count > 6:
         raise ValueError("Game requires 4-6 players")
     
+    rng_seed = random.getrandbits(63) if seed is None else seed
     game_id = str(uuid.uuid4())
     
     # Create board
@@ -157,7 +170,7 @@ def create_game(player_configs: list[dict]) -> GameState:
     # Create deck
     cards = create_deck()
     cards_dict = {c.id: c for c in cards}
-    deck = shuffle_deck(cards)
+    deck = shuffle_deck(cards, random.Random(f"{rng_seed}:deck"))
     
     # Create players
     players = []
@@ -209,10 +222,12 @@ def create_game(player_configs: list[dict]) -> GameState:
         holdings=holdings,
         deck=deck,
         cards=cards_dict,
+        rng_seed=rng_seed,
     )
     
     # Store game
-    _games[game_id] = state
+    save_game(state)
+    create_history(state)
     
     # Initialize game logger
     logger = create_logger(game_id)
@@ -229,56 +244,77 @@ def create_game(player_configs: list[dict]) -> GameState:
 
 def get_game(game_id: str) -> Optional[GameState]:
     """Get a game by ID."""
-    state = _games.get(game_id)
-    if state:
-        # Update prestige values on players so frontend sees current totals
-        update_player_prestige(state)
-    return state
+    # Prestige is kept current by refresh_prestige() whenever towns or
+    # titles change hands, so reads don't need to recompute anything.
+    return get_store().get(game_id)
+
+
+def player_prestige(state: GameState, player: Player) -> int:
+    """Compute a player's prestige from their towns and titles.
+    
+    - 1 VP per town
+    - 2 VP per county
+    - 4 VP per duchy
+    - 6 VP for being king
+    
+    O(1): the town count comes from the state's ownership index.
+    """
+    vp = state.count_towns_owned(player.id)
+    vp += 2 * len(player.counties)
+    vp += 4 * len(player.duchies)
+    if player.is_king:
+        vp += 6
+    return vp
+
+
+def refresh_prestige(state: GameState, *players: Optional[Player]) -> None:
+    """Refresh the cached prestige of the given players.
+    
+    Must be called after towns, counties, duchies or the crown change hands,
+    for every player who gained or lost something.
+    """
+    for player in players:
+        if player is not None:
+            player.prestige = player_prestige(state, player)
 
 
 def update_player_prestige(state: GameState) -> None:
-    """Update the prestige field on each player with their calculated total.
+    """Recompute the cached prestige of every player.
     
-    This ensures the frontend sees the correct prestige values.
+    Only needed when a state is loaded or rebuilt from outside the normal
+    mutation paths; gameplay code uses refresh_prestige() instead.
     """
-    for player in state.players:
-        vp = 0  # Start from 0, calculate everything
-        
-        # 1 VP per town
-        vp += len([h for h in state.holdings 
-                   if h.owner_id == player.id and h.holding_type == HoldingType.TOWN])
-        
-        # 2 VP per county
-        vp += 2 * len(player.counties)
-        
-        # 4 VP per duchy
-        vp += 4 * len(player.duchies)
-        
-        # 6 VP for being king
-        if player.is_king:
-            vp += 6
-        
-        player.prestige = vp
+    refresh_prestige(state, *state.players)
 
 
 def save_game(state: GameState) -> None:
-    """Save/update a game state."""
-    _games[state.id] = state
+    """Save/update a game state.
+    
+    With a persistent backend this only marks the game dirty; the write
+    happens in the store's next batch. Detached states are never saved.
+    
+    Every mutation ends here, so this also bumps the state's revision.
+    """
+    state.revision += 1
+    if state.is_detached:
+        return
+    get_store().save(state)
 
 
 def delete_game(game_id: str) -> bool:
     """Delete a game."""
-    if game_id in _games:
-        # Clean up logger
-        remove_logger(game_id)
-        del _games[game_id]
-        return True
-    return False
+    from app.game.engine import forget_valid_actions
+    
+    # Clean up logger, history recorder and cached valid actions
+    remove_logger(game_id)
+    remove_history(game_id)
+    forget_valid_actions(game_id)
+    return get_store().delete(game_id)
 
 
 def list_games() -> list[str]:
     """List all game IDs."""
-    return list(_games.keys())
+    return get_store().list_ids()
 
 
 def assign_starting_town(state: GameState, player_id: str, town_id: str) -> GameState:
@@ -293,12 +329,12 @@ def assign_starting_town(state: GameState, player_id: str, town_id: str) -> Game
         Updated game state
     """
     # Find player
-    player = next((p for p in state.players if p.id == player_id), None)
+    player = state.get_player(player_id)
     if not player:
         raise ValueError(f"Player {player_id} not found")
     
     # Find holding
-    holding = next((h for h in state.holdings if h.id == town_id), None)
+    holding = state.get_holding(town_id)
     if not holding:
         raise ValueError(f"Holding {town_id} not found")
     
@@ -309,26 +345,17 @@ def assign_starting_town(state: GameState, player_id: str, town_id: str) -> Game
         raise ValueError("Town already claimed")
     
     # Assign town to player
-    holding.owner_id = player_id
+    state.set_holding_owner(holding, player_id)
     player.holdings.append(town_id)
+    refresh_prestige(state, player)
     
     # Give starting resources from the town (soldier_value is actual soldiers now)
     player.gold = holding.gold_value
     player.soldiers = holding.soldier_value
     
-    # Update holdings list in state
-    for i, h in enumerate(state.holdings):
-        if h.id == town_id:
-            state.holdings[i] = holding
-            break
-    
-    # Update players list in state
-    for i, p in enumerate(state.players):
-        if p.id == player_id:
-            state.players[i] = player
-            break
-    
     save_game(state)
+    record_command(state, "assign_town", {"player_id": player_id, "town_id": town_id},
+                   state.current_round, state.current_player_idx)
     return state
 
 
@@ -339,7 +366,6 @@ def auto_assign_starting_towns(state: GameState) -> GameState:
     - "fixed": Each player gets a predetermined 5-gold town (one per county)
     - "random": Random distribution across counties
     """
-    import random
     from app.config import get_settings
     
     if state.phase != GamePhase.SETUP:
@@ -359,26 +385,21 @@ def auto_assign_starting_towns(state: GameState) -> GameState:
                 raise ValueError(f"Not enough fixed starting towns for player {idx + 1}")
             
             town_id = fixed_towns[idx]
-            town = next((h for h in state.holdings if h.id == town_id), None)
+            town = state.get_holding(town_id)
             
             if not town:
                 raise ValueError(f"Fixed starting town '{town_id}' not found")
             if town.owner_id:
                 raise ValueError(f"Fixed starting town '{town_id}' is already claimed")
             
-            town.owner_id = player.id
+            state.set_holding_owner(town, player.id)
             player.holdings.append(town.id)
+            refresh_prestige(state, player)
             
             # Players start with nothing - they gain resources from income phase
             player.gold = 0
             player.soldiers = 0
             player.hand = []  # No starting cards
-            
-            # Update holding in state
-            for i, h in enumerate(state.holdings):
-                if h.id == town.id:
-                    state.holdings[i] = town
-                    break
     else:
         # Random mode: shuffle and assign
         unclaimed_towns = [
@@ -386,7 +407,7 @@ def auto_assign_starting_towns(state: GameState) -> GameState:
             if h.holding_type == HoldingType.TOWN and h.owner_id is None
         ]
         
-        random.shuffle(unclaimed_towns)
+        recorded_shuffle(state, unclaimed_towns, state.next_rng().shuffle, key=lambda h: h.id)
         
         for player in state.players:
             if player.holdings:
@@ -396,21 +417,18 @@ def auto_assign_starting_towns(state: GameState) -> GameState:
                 raise ValueError("Not enough towns for all players")
             
             town = unclaimed_towns.pop(0)
-            town.owner_id = player.id
+            state.set_holding_owner(town, player.id)
             player.holdings.append(town.id)
+            refresh_prestige(state, player)
             
             # Players start with nothing - they gain resources from income phase
             player.gold = 0
             player.soldiers = 0
             player.hand = []  # No starting cards
-            
-            # Update holding in state
-            for i, h in enumerate(state.holdings):
-                if h.id == town.id:
-                    state.holdings[i] = town
-                    break
     
     save_game(state)
+    record_command(state, "auto_assign_towns", {},
+                   state.current_round, state.current_player_idx)
     return state
 
 
@@ -427,6 +445,7 @@ def start_game(state: GameState) -> GameState:
     # Move to income phase
     state.phase = GamePhase.INCOME
     save_game(state)
+    record_command(state, "start", {}, state.current_round, state.current_player_idx)
     return state
 
 
@@ -457,7 +476,7 @@ def calculate_income(state: GameState) -> dict[str, dict]:
         
         # Income from holdings
         for holding_id in player.holdings:
-            holding = next((h for h in state.holdings if h.id == holding_id), None)
+            holding = state.get_holding(holding_id)
             if holding:
                 gold += holding.gold_value
                 soldiers += holding.soldier_value  # Now actual soldiers (100, 200, etc.)
@@ -489,9 +508,10 @@ def apply_income(state: GameState) -> GameState:
         raise ValueError("Not in income phase")
     
     income = calculate_income(state)
+    round_num, player_idx = state.current_round, state.current_player_idx
     
     # Log income phase
-    logger = get_logger(state.id)
+    logger = logger_for(state)
     if logger:
         income_details = {}
         for player in state.players:
@@ -537,12 +557,13 @@ def apply_income(state: GameState) -> GameState:
     auto_draw_card(state, first_player)
     
     save_game(state)
+    record_command(state, "income", {"income": income}, round_num, player_idx)
     return state
 
 
 def next_player_turn(state: GameState) -> GameState:
     """Advance to the next player's turn."""
-    logger = get_logger(state.id)
+    logger = logger_for(state)
     
     # Log turn end for current player before advancing
     if state.current_player_idx < len(state.players):
@@ -591,18 +612,12 @@ def process_upkeep(state: GameState) -> GameState:
     for player in state.players:
         player.soldiers = min(player.soldiers, player.army_cap)
     
-    # Award prestige to current king
-    for player in state.players:
-        if player.is_king:
-            player.prestige += 2
-    
-    # Check for victory (18 VP threshold)
-    prestige = calculate_prestige(state)
-    for player in state.players:
-        if prestige[player.id] >= state.victory_threshold:
-            state.phase = GamePhase.GAME_OVER
-            save_game(state)
-            return state
+    # Check for victory (18 VP threshold). The king's 6 VP is already part
+    # of their cached prestige; there is no separate per-round award.
+    if _find_victor(state):
+        state.phase = GamePhase.GAME_OVER
+        save_game(state)
+        return state
     
     # Advance round (no round limit - game continues until victory)
     state.current_round += 1
@@ -620,58 +635,54 @@ def check_victory(state: GameState) -> Optional[Player]:
     
     Returns the winning player or None.
     """
-    prestige = calculate_prestige(state)
-    for player in state.players:
-        if prestige[player.id] >= state.victory_threshold:
-            # Log game end
-            logger = get_logger(state.id)
-            if logger:
-                final_standings = []
-                sorted_players = sorted(
-                    state.players,
-                    key=lambda p: prestige[p.id],
-                    reverse=True
-                )
-                for i, p in enumerate(sorted_players):
-                    final_standings.append({
-                        "rank": i + 1,
-                        "player_id": p.id,
-                        "player_name": p.name,
-                        "player_type": p.player_type.value,
-                        "prestige": prestige[p.id],
-                        "title": p.title.value,
-                        "gold": p.gold,
-                        "soldiers": p.soldiers,
-                        "holdings": list(p.holdings),
-                    })
-                logger.log_game_end(
-                    round_num=state.current_round,
-                    winner_id=player.id,
-                    winner_name=player.name,
-                    final_standings=final_standings
-                )
-            return player
-    return None
+    player = _find_victor(state)
+    if not player:
+        return None
+    
+    # Log game end
+    logger = logger_for(state)
+    if logger:
+        final_standings = []
+        sorted_players = sorted(
+            state.players,
+            key=lambda p: p.prestige,
+            reverse=True
+        )
+        for i, p in enumerate(sorted_players):
+            final_standings.append({
+                "rank": i + 1,
+                "player_id": p.id,
+                "player_name": p.name,
+                "player_type": p.player_type.value,
+                "prestige": p.prestige,
+                "title": p.title.value,
+                "gold": p.gold,
+                "soldiers": p.soldiers,
+                "holdings": list(p.holdings),
+            })
+        logger.log_game_end(
+            round_num=state.current_round,
+            winner_id=player.id,
+            winner_name=player.name,
+            final_standings=final_standings
+        )
+    return player
 
 
 def get_player_holdings(state: GameState, player_id: str) -> list[Holding]:
     """Get all holdings owned by a player."""
-    return [h for h in state.holdings if h.owner_id == player_id]
+    return state.holdings_owned_by(player_id)
 
 
 def count_player_towns(state: GameState, player_id: str) -> int:
     """Count how many towns a player owns."""
-    return len([
-        h for h in state.holdings 
-        if h.owner_id == player_id and h.holding_type == HoldingType.TOWN
-    ])
+    return state.count_towns_owned(player_id)
 
 
 def count_towns_in_county(state: GameState, player_id: str, county: str) -> int:
     """Count how many towns a player owns in a county."""
-    county_towns = get_towns_in_county(county)
-    player_towns = [h.id for h in state.holdings if h.owner_id == player_id and h.id in county_towns]
-    return len(player_towns)
+    county_towns = get_board_masks().county_towns.get(county, 0)
+    return (state.owned_mask(player_id) & county_towns).bit_count()
 
 
 def can_claim_count(state: GameState, player_id: str, county: str) -> bool:
@@ -691,7 +702,7 @@ def can_claim_count(state: GameState, player_id: str, county: str) -> bool:
     from app.game.board import get_capitol_for_county
     capitol_id = get_capitol_for_county(county)
     if capitol_id:
-        capitol = next((h for h in state.holdings if h.id == capitol_id), None)
+        capitol = state.get_holding(capitol_id)
         if capitol and capitol.owner_id == player_id:
             # Check if player has at least 1 fortification on the capitol
             player_forts = capitol.fortifications_by_player.get(player_id, 0)
@@ -703,7 +714,7 @@ def can_claim_count(state: GameState, player_id: str, county: str) -> bool:
 
 def can_claim_duke(state: GameState, player_id: str, duchy: str) -> bool:
     """Check if a player can claim Duke of a duchy."""
-    player = next((p for p in state.players if p.id == player_id), None)
+    player = state.get_player(player_id)
     if not player:
         return False
     
@@ -730,18 +741,7 @@ def can_claim_duke(state: GameState, player_id: str, duchy: str) -> bool:
 
 def has_town_in_duchy(state: GameState, player_id: str, duchy: str) -> bool:
     """Check if player owns any town in the specified duchy."""
-    # Counties in each duchy
-    duchy_counties = {
-        "XU": ["X", "U"],
-        "QV": ["Q", "V"]
-    }
-    counties = duchy_counties.get(duchy, [])
-    
-    for holding in state.holdings:
-        if holding.owner_id == player_id and holding.holding_type == HoldingType.TOWN:
-            if holding.county in counties:
-                return True
-    return False
+    return bool(state.owned_mask(player_id) & get_board_masks().duchy_towns.get(duchy, 0))
 
 
 def can_claim_king(state: GameState, player_id: str) -> bool:
@@ -749,7 +749,7 @@ def can_claim_king(state: GameState, player_id: str) -> bool:
     
     Requirement: Duke in one duchy + own a town in the other duchy.
     """
-    player = next((p for p in state.players if p.id == player_id), None)
+    player = state.get_player(player_id)
     if not player:
         return False
     
@@ -775,36 +775,21 @@ def can_claim_king(state: GameState, player_id: str) -> bool:
 
 
 def calculate_prestige(state: GameState) -> dict[str, int]:
-    """Calculate current prestige for all players.
+    """Get current prestige for all players.
     
-    Prestige is calculated from scratch based on current holdings/titles:
-    - 1 VP per town
-    - 2 VP per county
-    - 4 VP per duchy
-    - 6 VP for being king
+    Reads the per-player counters maintained by refresh_prestige(); see
+    player_prestige() for the scoring rules.
     """
-    prestige = {}
-    
+    return {player.id: player.prestige for player in state.players}
+
+
+def _find_victor(state: GameState) -> Optional[Player]:
+    """Return the first player at or above the victory threshold, if any."""
+    threshold = state.victory_threshold
     for player in state.players:
-        vp = 0  # Calculate from scratch, not from player.prestige
-        
-        # 1 VP per town
-        vp += len([h for h in state.holdings 
-                   if h.owner_id == player.id and h.holding_type == HoldingType.TOWN])
-        
-        # 2 VP per county
-        vp += 2 * len(player.counties)
-        
-        # 4 VP per duchy
-        vp += 4 * len(player.duchies)
-        
-        # 6 VP for being king
-        if player.is_king:
-            vp += 6
-        
-        prestige[player.id] = vp
-    
-    return prestige
+        if player.prestige >= threshold:
+            return player
+    return None
 
 
 def get_winner(state: GameState) -> Optional[Player]:
@@ -0,0 +1,423 @@
+"""Pluggable game storage backends.
+
+`save_game`/`get_game`/`list_games`/`delete_game` in app.game.state go through
+the process-wide store returned by get_store(). Two backends are available,
+selected by `Settings.game_storage_backend`:
+
+- "memory": games live in a dict and are lost on restart (the default).
+- "sqlite": games are persisted to `Settings.database_url`. Writes are
+  batched (write-behind): save_game only marks a game dirty, and dirty games
+  are written in a single transaction once enough of them accumulate or the
+  flush interval elapses. A bounded working set of games is kept in memory.
+"""
+import asyncio
+import threading
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from app.config import get_settings
+from app.models.schemas import GameState
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    """The event loop running in this thread, if any."""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class GameStore(ABC):
+    """Interface for game state storage."""
+
+    @abstractmethod
+    def get(self, game_id: str) -> Optional[GameState]:
+        """Get a game by ID, or None if it doesn't exist."""
+
+    @abstractmethod
+    def save(self, state: GameState) -> None:
+        """Save/update a game state."""
+
+    @abstractmethod
+    def delete(self, game_id: str) -> bool:
+        """Delete a game. Returns True if it existed."""
+
+    @abstractmethod
+    def list_ids(self) -> list[str]:
+        """List all stored game IDs."""
+
+    def flush(self) -> None:
+        """Write any buffered changes to durable storage."""
+
+    def close(self) -> None:
+        """Flush and release any resources held by the store."""
+        self.flush()
+
+
+class InMemoryGameStore(GameStore):
+    """Keeps every game in a dict for the lifetime of the process."""
+
+    def __init__(self):
+        self._games: dict[str, GameState] = {}
+
+    def get(self, game_id: str) -> Optional[GameState]:
+        return self._games.get(game_id)
+
+    def save(self, state: GameState) -> None:
+        self._games[state.id] = state
+
+    def delete(self, game_id: str) -> bool:
+        return self._games.pop(game_id, None) is not None
+
+    def list_ids(self) -> list[str]:
+        return list(self._games.keys())
+
+
+class SQLiteGameStore(GameStore):
+    """SQLite-backed store with write-behind batching.
+
+    Game states are mutable objects that the engine keeps working on after
+    saving them, so the store hands out the same live object for a game for
+    as long as anyone holds it: the LRU working set keeps recent games alive,
+    and a weak map still finds a state the LRU evicted while an engine was
+    using it, rather than loading a second copy from the database. Each save
+    bumps the game's dirty generation; a flush writes the latest snapshot of
+    every dirty game and only marks a game clean if it wasn't saved again
+    while the flush was running.
+
+    Snapshots are serialized on the thread that saved the game, never by the
+    flusher, since nothing else locks a state the engine is mutating. A save
+    made outside an event loop is serialized right away. A save made on an
+    event loop is serialized by a callback on that loop after flush_interval,
+    so bursts of saves cost one serialization, taken between two steps of the
+    game rather than halfway through one.
+    """
+
+    def __init__(
+        self,
+        database_url: str,
+        flush_interval: float = 1.0,
+        batch_size: int = 50,
+        cache_size: int = 256,
+    ):
+        """Initialize the store.
+
+        Args:
+            database_url: SQLAlchemy URL of the SQLite database
+            flush_interval: Max seconds a save may stay buffered (0 disables the timer)
+            batch_size: Number of dirty games that triggers an immediate flush
+            cache_size: Number of clean games kept in memory
+        """
+        from sqlalchemy import (
+            create_engine, MetaData, Table, Column, String, Text, DateTime
+        )
+
+        if not database_url.startswith("sqlite"):
+            raise ValueError(f"SQLiteGameStore requires a sqlite:// URL, got {database_url!r}")
+
+        self._engine = create_engine(
+            database_url,
+            connect_args={"check_same_thread": False},
+        )
+        metadata = MetaData()
+        self._table = Table(
+            "games",
+            metadata,
+            Column("id", String(64), primary_key=True),
+            Column("state", Text, nullable=False),
+            Column("created_at", DateTime, nullable=False),
+            Column("updated_at", DateTime, nullable=False),
+        )
+        metadata.create_all(self._engine)
+
+        self.batch_size = max(1, batch_size)
+        self.cache_size = max(0, cache_size)
+        self.flush_interval = flush_interval
+
+        # Working set: game_id -> live state, least recently used first
+        self._cache: OrderedDict[str, GameState] = OrderedDict()
+        # Every state handed out that is still referenced somewhere
+        self._live: "weakref.WeakValueDictionary[str, GameState]" = weakref.WeakValueDictionary()
+        # Dirty games: game_id -> generation of the latest save
+        self._dirty: dict[str, int] = {}
+        self._generation = 0
+        # Serialized dirty games: game_id -> (generation, JSON)
+        self._snapshots: dict[str, tuple[int, str]] = {}
+        # Games saved on an event loop and not serialized yet: game_id -> (loop, state)
+        self._unserialized: dict[str, tuple[asyncio.AbstractEventLoop, GameState]] = {}
+        self._scheduled: set[asyncio.AbstractEventLoop] = set()
+
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._wakeup = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="game-store-flusher", daemon=True
+            )
+            self._flusher.start()
+
+    # ============ GameStore API ============
+
+    def get(self, game_id: str) -> Optional[GameState]:
+        with self._lock:
+            state = self._cache.get(game_id)
+            if state is not None:
+                self._cache.move_to_end(game_id)
+            else:
+                state = self._live.get(game_id)
+                if state is not None:
+                    # Evicted but still in use: bring it back
+                    self._cache[game_id] = state
+                    self._trim_cache()
+            if state is not None:
+                if game_id in self._unserialized:
+                    # Saved on a loop that has stopped: snapshot it before the
+                    # caller starts mutating it
+                    self._serialize_pending(lambda loop: not loop.is_running(), [game_id])
+                return state
+
+        from sqlalchemy import select
+        with self._engine.connect() as conn:
+            row = conn.execute(
+                select(self._table.c.state).where(self._table.c.id == game_id)
+            ).first()
+        if row is None:
+            return None
+
+        state = GameState.model_validate_json(row[0])
+        with self._lock:
+            # Another thread may have loaded or saved it in the meantime
+            existing = self._cache.get(game_id) or self._live.get(game_id)
+            if existing is not None:
+                return existing
+            self._cache[game_id] = state
+            self._live[game_id] = state
+            self._trim_cache()
+        return state
+
+    def save(self, state: GameState) -> None:
+        loop = _running_loop()
+        with self._lock:
+            self._cache[state.id] = state
+            self._cache.move_to_end(state.id)
+            self._live[state.id] = state
+            self._generation += 1
+            generation = self._dirty[state.id] = self._generation
+            if loop is None:
+                self._unserialized.pop(state.id, None)
+            else:
+                self._unserialized[state.id] = (loop, state)
+                schedule = loop not in self._scheduled
+                self._scheduled.add(loop)
+            should_flush = len(self._dirty) >= self.batch_size
+
+        if loop is None:
+            self._set_snapshot(state.id, generation, state.model_dump_json())
+        elif schedule:
+            loop.call_later(self.flush_interval, self._serialize_loop, loop)
+        if should_flush:
+            self.flush()
+
+    def delete(self, game_id: str) -> bool:
+        from sqlalchemy import delete
+        with self._flush_lock:
+            with self._lock:
+                existed = self._cache.pop(game_id, None) is not None
+                self._live.pop(game_id, None)
+                self._dirty.pop(game_id, None)
+                self._snapshots.pop(game_id, None)
+                self._unserialized.pop(game_id, None)
+            with self._engine.begin() as conn:
+                result = conn.execute(
+                    delete(self._table).where(self._table.c.id == game_id)
+                )
+        return existed or result.rowcount > 0
+
+    def list_ids(self) -> list[str]:
+        from sqlalchemy import select
+        with self._engine.connect() as conn:
+            stored = [
+                row[0] for row in conn.execute(
+                    select(self._table.c.id).order_by(self._table.c.created_at)
+                )
+            ]
+        with self._lock:
+            known = set(stored)
+            stored.extend(gid for gid in self._dirty if gid not in known)
+        return stored
+
+    def flush(self) -> None:
+        """Write all serialized dirty games in one transaction.
+
+        Called on an event loop, this first serializes the games saved on that
+        loop. Games still waiting for another loop's callback stay dirty until
+        a later flush.
+        """
+        from sqlalchemy.dialects.sqlite import insert
+
+        current = _running_loop()
+        with self._flush_lock:
+            with self._lock:
+                # Our own loop's games are safe to serialize here; so are those
+                # of loops that have stopped and won't run their callback
+                self._serialize_pending(
+                    lambda loop: loop is current or not loop.is_running()
+                )
+                self._scheduled = {
+                    loop for loop in self._scheduled if loop.is_running()
+                }
+                pending = [
+                    (gid, gen, data) for gid, (gen, data) in self._snapshots.items()
+                    if self._dirty.get(gid) is not None
+                ]
+                if not pending:
+                    return
+
+            now = datetime.now(timezone.utc)
+            rows = []
+            for game_id, _gen, data in pending:
+                rows.append({
+                    "id": game_id,
+                    "state": data,
+                    "created_at": now,
+                    "updated_at": now,
+                })
+
+            stmt = insert(self._table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[self._table.c.id],
+                set_={
+                    "state": stmt.excluded.state,
+                    "updated_at": stmt.excluded.updated_at,
+                },
+            )
+            with self._engine.begin() as conn:
+                conn.execute(stmt, rows)
+
+            with self._lock:
+                for game_id, gen, _data in pending:
+                    if self._snapshots.get(game_id, (None,))[0] == gen:
+                        del self._snapshots[game_id]
+                    # Saved again during the flush: keep it dirty
+                    if self._dirty.get(game_id) == gen:
+                        del self._dirty[game_id]
+                self._trim_cache()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock:
+            # Shutting down: no game is being played any more
+            self._serialize_pending(lambda loop: True)
+        self.flush()
+        self._engine.dispose()
+
+    # ============ Internals ============
+
+    def _set_snapshot(self, game_id: str, generation: int, data: str) -> None:
+        """Record a serialized state unless a newer save got there first."""
+        with self._lock:
+            if game_id not in self._dirty:
+                return  # Deleted meanwhile
+            current = self._snapshots.get(game_id)
+            if current is None or current[0] < generation:
+                self._snapshots[game_id] = (generation, data)
+
+    def _serialize_pending(
+        self,
+        owned: Callable[[asyncio.AbstractEventLoop], bool],
+        game_ids: Optional[list[str]] = None,
+    ) -> None:
+        """Serialize games saved on loops for which owned(loop) is true.
+
+        Must be called with _lock held, which keeps the states from being
+        handed out while they're serialized.
+        """
+        ids = list(self._unserialized) if game_ids is None else game_ids
+        for game_id in ids:
+            loop, state = self._unserialized[game_id]
+            if owned(loop):
+                del self._unserialized[game_id]
+                self._set_snapshot(game_id, self._dirty[game_id], state.model_dump_json())
+
+    def _serialize_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Callback serializing the games saved on its loop since the last run."""
+        with self._lock:
+            self._scheduled.discard(loop)
+            self._serialize_pending(lambda owner: owner is loop)
+
+    def _trim_cache(self) -> None:
+        """Evict least recently used clean games beyond cache_size."""
+        excess = len(self._cache) - self.cache_size
+        if excess <= 0:
+            return
+        for game_id in list(self._cache):
+            if excess <= 0:
+                break
+            if game_id not in self._dirty:
+                del self._cache[game_id]
+                excess -= 1
+
+    def _flush_loop(self) -> None:
+        """Background timer that flushes buffered saves."""
+        while not self._wakeup.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                # Don't kill the flusher; the next tick retries
+                print(f"Warning: Failed to flush game store: {e}")
+
+
+# ============ Process-wide Store ============
+
+_store: Optional[GameStore] = None
+_store_lock = threading.Lock()
+
+
+def create_store() -> GameStore:
+    """Create a store from application settings."""
+    settings = get_settings()
+    if settings.game_storage_backend == "sqlite":
+        return SQLiteGameStore(
+            settings.database_url,
+            flush_interval=settings.game_storage_flush_interval,
+            batch_size=settings.game_storage_batch_size,
+            cache_size=settings.game_storage_cache_size,
+        )
+    return InMemoryGameStore()
+
+
+def get_store() -> GameStore:
+    """Get the process-wide game store, creating it on first use."""
+    global _store
+    store = _store
+    if store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_store()
+            store = _store
+    return store
+
+
+def set_store(store: Optional[GameStore]) -> Optional[GameStore]:
+    """Replace the process-wide store. Returns the previous one (not closed)."""
+    global _store
+    with _store_lock:
+        previous, _store = _store, store
+    return previous
+
+
+def close_store() -> None:
+    """Flush and close the process-wide store (called on app shutdown)."""
+    store = set_store(None)
+    if store is not None:
+        store.close()
@@ -1,17 +1,38 @@
 """FastAPI application entry point."""
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.config import get_settings
 from app.api.routes import router as api_router
 from app.api.websocket import router as ws_router
+from app.api.jobs import shutdown_job_manager
+from app.ai.clients import shutdown_client_pool
+from app.game.storage import close_store
+from app.game.logger import shutdown_log_writer
+from app.game.simulation import shutdown_process_pool
 
 settings = get_settings()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup/shutdown hooks."""
+    yield
+    await shutdown_job_manager()
+    await shutdown_client_pool()
+    shutdown_process_pool()
+    # Write out buffered game logs and saves
+    shutdown_log_writer()
+    close_store()
+
+
 app = FastAPI(
     title="Machiavelli's Kingdom",
     description="A Medieval Strategy Board Game API",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS middleware for frontend
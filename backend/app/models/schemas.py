@@ -1,7 +1,8 @@
 """Pydantic models for game state and API requests/responses."""
+import random
 from enum import Enum
 from typing import Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
 
 # ============ Enums ============
@@ -279,6 +280,9 @@ class AIDecisionLog(BaseModel):
     considered: list[AIDecisionLogEntry]
     chosen_action: str
     reason: str
+    # Prompt-cache use of the LLM call behind the decision (None: no call, or not reported)
+    cache_hits: Optional[int] = None
+    cache_misses: Optional[int] = None
 
 
 # ============ Pending Combat ============
@@ -347,12 +351,170 @@ class GameState(BaseModel):
     # Pending combat (waiting for human defender response)
     pending_combat: Optional[PendingCombat] = None
     
+    # Randomness: each dice roll/shuffle draws from its own stream derived
+    # from (rng_seed, rng_counter), so a game is reproducible from its seed
+    # no matter how many other games run in the same process
+    rng_seed: int = 0
+    rng_counter: int = 0
+    
+    # Bumped by save_game() after every mutation; caches derived from the
+    # state (like valid actions) are keyed by it
+    revision: int = 0
+    
+    # Lookup indexes (not serialized - rebuilt from players/holdings on demand)
+    _index: Optional["_GameIndex"] = PrivateAttr(default=None)
+    
+    # Detached states (replays, what-if copies) are never saved or logged
+    _detached: bool = PrivateAttr(default=False)
+    
+    @property
+    def is_detached(self) -> bool:
+        """Whether this state is a working copy outside the game store."""
+        return self.__pydantic_private__["_detached"]
+    
+    def detach(self) -> None:
+        """Mark this state as a working copy: save_game and game logging skip it."""
+        self.__pydantic_private__["_detached"] = True
+    
+    def fork(self) -> "GameState":
+        """Make a cheap detached copy for lookahead and what-if evaluation.
+        
+        Much faster than model_copy(deep=True): data the engine never changes
+        in place (the cards, existing log entries, the last drawn card) is
+        shared, and players, holdings, armies and the pending combat are
+        copied one level deep - enough for the engine to mutate the fork
+        freely without affecting this state.
+        """
+        fork = self.model_copy()
+        fields = fork.__dict__
+        fields["players"] = [_copy_one_level(p) for p in self.players]
+        fields["holdings"] = [_copy_one_level(h) for h in self.holdings]
+        fields["armies"] = [a.model_copy() for a in self.armies]
+        fields["deck"] = list(self.deck)
+        fields["discard_pile"] = list(self.discard_pile)
+        fields["action_log"] = list(self.action_log)
+        fields["combat_log"] = list(self.combat_log)
+        if self.pending_combat is not None:
+            fields["pending_combat"] = _copy_one_level(self.pending_combat)
+        fork.__pydantic_private__ = {"_index": None, "_detached": True}
+        return fork
+    
+    def next_rng(self) -> random.Random:
+        """Get the game's next random stream (one per dice roll or shuffle)."""
+        rng = random.Random(f"{self.rng_seed}:{self.rng_counter}")
+        self.rng_counter += 1
+        return rng
+    
     @property
     def current_player(self) -> Optional[Player]:
         """Get the current player."""
         if 0 <= self.current_player_idx < len(self.players):
             return self.players[self.current_player_idx]
         return None
+    
+    def _lookup(self) -> "_GameIndex":
+        """Get the lookup index, rebuilding it if the holdings/players lists were replaced."""
+        # Read the private storage directly - pydantic's __getattr__ is slow on hot paths
+        index = self.__pydantic_private__["_index"]
+        if index is None or not index.is_current(self):
+            index = _GameIndex(self)
+            self.__pydantic_private__["_index"] = index
+        return index
+    
+    def reindex(self) -> None:
+        """Rebuild all lookup indexes from scratch."""
+        self.__pydantic_private__["_index"] = _GameIndex(self)
+    
+    def get_holding(self, holding_id: Optional[str]) -> Optional[Holding]:
+        """Look up a holding by ID."""
+        return self._lookup().holdings_by_id.get(holding_id)
+    
+    def get_player(self, player_id: Optional[str]) -> Optional[Player]:
+        """Look up a player by ID."""
+        return self._lookup().players_by_id.get(player_id)
+    
+    def holdings_owned_by(self, player_id: str) -> list[Holding]:
+        """Get all holdings owned by a player, in board order."""
+        index = self._lookup()
+        mask = index.owned_masks.get(player_id)
+        if not mask:
+            return []
+        holdings_by_id = index.holdings_by_id
+        return [holdings_by_id[hid] for hid in index.masks.holding_ids(mask)]
+    
+    def owned_mask(self, player_id: Optional[str]) -> int:
+        """Bitmask of the holdings owned by a player (see board.BoardMasks)."""
+        return self._lookup().owned_masks.get(player_id, 0)
+    
+    def occupied_mask(self) -> int:
+        """Bitmask of the holdings owned by anyone."""
+        return self._lookup().occupied
+    
+    def count_towns_owned(self, player_id: str) -> int:
+        """Count the towns owned by a player."""
+        index = self._lookup()
+        return (index.owned_masks.get(player_id, 0) & index.masks.towns).bit_count()
+    
+    def set_holding_owner(self, holding: Holding, owner_id: Optional[str]) -> None:
+        """Change the owner of a holding, keeping the ownership index in sync.
+        
+        All ownership changes must go through here rather than assigning
+        holding.owner_id directly.
+        """
+        index = self._lookup()
+        previous = holding.owner_id
+        if previous == owner_id:
+            return
+        bit = index.masks.bit[holding.id]
+        owned_masks = index.owned_masks
+        if previous is not None:
+            owned_masks[previous] = owned_masks.get(previous, 0) & ~bit
+        holding.owner_id = owner_id
+        if owner_id is not None:
+            owned_masks[owner_id] = owned_masks.get(owner_id, 0) | bit
+            index.occupied |= bit
+        else:
+            index.occupied &= ~bit
+
+
+def _copy_one_level(model: BaseModel) -> BaseModel:
+    """Shallow-copy a model along with its list and dict fields."""
+    copy = model.model_copy()
+    fields = copy.__dict__
+    for key, value in fields.items():
+        if isinstance(value, (list, dict)):
+            fields[key] = value.copy()
+    return copy
+
+
+class _GameIndex:
+    """ID-keyed lookup tables and ownership bitmasks for a GameState."""
+    
+    __slots__ = ("holdings", "players", "holdings_by_id", "players_by_id",
+                 "masks", "owned_masks", "occupied")
+    
+    def __init__(self, state: GameState):
+        from app.game.board import get_board_masks
+        
+        self.holdings = state.holdings
+        self.players = state.players
+        self.holdings_by_id: dict[str, Holding] = {h.id: h for h in state.holdings}
+        self.players_by_id: dict[str, Player] = {p.id: p for p in state.players}
+        self.masks = masks = get_board_masks()
+        self.owned_masks: dict[str, int] = {}
+        self.occupied = 0
+        for h in state.holdings:
+            if h.owner_id is not None:
+                bit = masks.bit[h.id]
+                self.owned_masks[h.owner_id] = self.owned_masks.get(h.owner_id, 0) | bit
+                self.occupied |= bit
+    
+    def is_current(self, state: GameState) -> bool:
+        """Check that the index was built from the state's current lists."""
+        return (self.holdings is state.holdings
+                and self.players is state.players
+                and len(self.holdings_by_id) == len(state.holdings)
+                and len(self.players_by_id) == len(state.players))
 
 
 # ============ API Requests/Responses ============
@@ -360,6 +522,7 @@ class GameState(BaseModel):
 class CreateGameRequest(BaseModel):
     """Request to create a new game."""
     player_configs: list[dict]  # [{name, player_type, color}, ...]
+    seed: Optional[int] = None  # Fixes dice and shuffles for reproducible games
 
 
 class CreateGameResponse(BaseModel):
@@ -382,6 +545,27 @@ class PerformActionResponse(BaseModel):
     combat_result: Optional[CombatResult] = None
 
 
+class CombatOutcome(BaseModel):
+    """One way a previewed combat can end, with its probability."""
+    attacker_won: bool
+    probability: float
+    attacker_losses: int
+    defender_losses: int
+    prestige_changes: dict[str, int]  # Player ID -> prestige gained (negative if lost)
+    diff: list[dict]  # JSON Patch from the current state
+
+
+class ActionPreview(BaseModel):
+    """What an action would do, worked out on a fork of the game (see app.api.preview)."""
+    success: bool
+    message: str
+    diff: list[dict]  # JSON Patch from the current state (cards left out)
+    prestige_changes: dict[str, int]  # Player ID -> prestige gained (negative if lost)
+    combat_result: Optional[CombatResult] = None  # One sampled roll
+    # Every way the combat can end, for attacks and defends
+    outcomes: Optional[list[CombatOutcome]] = None
+
+
 class GetValidActionsRequest(BaseModel):
     """Request to get valid actions for a player."""
     game_id: str
@@ -396,4 +580,57 @@ class GetValidActionsResponse(BaseModel):
 class SimulationConfig(BaseModel):
     """Configuration for AI simulation mode."""
     player_configs: list[dict]  # AI player configurations
+    seed: Optional[int] = None  # Fixes dice and shuffles for reproducible games
     speed_ms: int = Field(default=1000, ge=100)  # Delay between turns
+
+
+class SimulationJobKind(str, Enum):
+    """Which worker pool a simulation job runs in."""
+    CPU = "cpu"  # Every AI player runs locally (SimpleAI)
+    LLM = "llm"  # At least one AI player calls an LLM
+
+
+class SimulationJobStatus(str, Enum):
+    """Lifecycle of a background simulation job."""
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    CANCELLED = "cancelled"
+    FAILED = "failed"
+
+
+class SimulationJob(BaseModel):
+    """A background simulation of one game (see app.api.jobs)."""
+    id: str
+    game_id: str
+    kind: SimulationJobKind
+    status: SimulationJobStatus = SimulationJobStatus.QUEUED
+    max_steps: int
+    steps: int = 0
+    round: int = 0
+    revision: int = 0  # Bumped on every change
+    created_at: str  # ISO timestamps
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    result: Optional[dict] = None  # Same shape as POST /simulation/{game_id}/run
+    error: Optional[str] = None
+
+
+class SimulationBatchRequest(BaseModel):
+    """Request to play a batch of headless AI-vs-AI games."""
+    n_games: int = Field(ge=1, le=100_000)
+    policies: list[str] = ["simple", "simple", "simple", "simple"]  # One per seat
+    seed: int = 0  # Game i uses seed + i
+    max_steps: int = Field(default=3000, ge=1)
+
+
+class SimulationResult(BaseModel):
+    """Summary of one headless AI-vs-AI game (see app.game.simulation)."""
+    seed: int
+    winner: Optional[int] = None  # Seat index of the winner (None if unfinished)
+    rounds: int
+    steps: int  # Actions taken
+    prestige: list[int]  # Final prestige per seat
+    prestige_curve: list[list[int]]  # Prestige per seat at each income phase, then final
+    action_counts: dict[str, int]  # Successful actions by type
+    combats: int
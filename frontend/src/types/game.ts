@@ -187,6 +187,8 @@ export interface AIDecisionLog {
   considered: AIDecisionLogEntry[]
   chosen_action: string
   reason: string
+  cache_hits?: number | null
+  cache_misses?: number | null
 }
 
 export interface GameState {